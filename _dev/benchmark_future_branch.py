@@ -0,0 +1,81 @@
+"""
+Compares the descendant walk used by TreeDB.get_future_branch
+(_DescendantWalker) with the original Python while-loop, on synthetic
+depth-first trees of increasing size.
+
+Usage:
+------
+    python benchmark_future_branch.py [nrows ...]
+"""
+
+import sys
+import time
+import numpy as np
+
+from harvesting_tools.readtreeHDF5_public import _DescendantWalker
+
+
+def make_deep_tree(nrows, max_depth=100, seed=0):
+    """
+    Single tree with IDs assigned in a depth-first fashion, i.e. every
+    subhalo comes after its descendant, and the subtree of any subhalo
+    occupies adjacent rows. Branches are at most max_depth long.
+    """
+    rng = np.random.default_rng(seed)
+    pops = rng.geometric(0.5, nrows) - 1
+    descendant_id = np.full(nrows, -1, dtype=np.int64)
+    path = [0]
+    for i in range(1, nrows):
+        del path[max(1, len(path) - pops[i]):]
+        if len(path) == max_depth:
+            path.pop()
+        descendant_id[i] = path[-1]
+        path.append(i)
+    subhalo_id = np.arange(nrows, dtype=np.int64)
+    root_descendant_id = np.zeros(nrows, dtype=np.int64)
+    return subhalo_id, descendant_id, root_descendant_id
+
+
+def legacy_walk(subhalo_id, descendant_id, root_descendant_id, start):
+    desc_id = descendant_id[start]
+    root_desc_id = root_descendant_id[start]
+    indices = [start]
+    while desc_id >= root_desc_id:
+        cur_index = np.where(subhalo_id == desc_id)[0][0]
+        indices.append(cur_index)
+        desc_id = descendant_id[cur_index]
+    return indices[::-1]
+
+
+if __name__ == "__main__":
+    sizes = [int(n) for n in sys.argv[1:]] or [10**4, 10**5, 10**6]
+    nstarts = 20
+
+    for nrows in sizes:
+        subhalo_id, descendant_id, root_descendant_id = make_deep_tree(nrows)
+        # get_future_branch walks from the last row of the subtree
+        starts = np.random.default_rng(1).integers(0, nrows, nstarts)
+
+        t0 = time.perf_counter()
+        legacy = [legacy_walk(subhalo_id[:s+1], descendant_id[:s+1],
+                              root_descendant_id[:s+1], s) for s in starts]
+        t_legacy = (time.perf_counter() - t0) / nstarts
+
+        t0 = time.perf_counter()
+        for s in starts:
+            walker = _DescendantWalker(subhalo_id[:s+1], descendant_id[:s+1],
+                                       root_descendant_id[:s+1])
+            indices, _ = walker.walk(s)
+        t_single = (time.perf_counter() - t0) / nstarts
+
+        t0 = time.perf_counter()
+        walker = _DescendantWalker(subhalo_id, descendant_id, root_descendant_id)
+        indices, offsets = walker.walk(starts)
+        t_batch = (time.perf_counter() - t0) / nstarts
+
+        for i, s in enumerate(starts):
+            assert np.array_equal(indices[offsets[i]:offsets[i+1]], legacy[i])
+
+        print(f"nrows = {nrows:>8d}: loop {t_legacy*1e3:9.3f} ms, "
+              f"walker {t_single*1e3:9.3f} ms, "
+              f"batched walker {t_batch*1e3:9.3f} ms per branch")
@@ -0,0 +1,103 @@
+"""
+Builds an orbit store (harvesting_tools.orbit_store) from the orbit
+files of one sample, checks that it reads back identical to the files
+(in full, and for a random selection of pairs and snapshots), and
+compares the file sizes and load times (best of repeats loads, so that
+the writeback of the freshly built store does not count).
+
+Usage:
+------
+    python benchmark_orbit_store.py <path-to-harvest> <mass> <ratio> [--float32] [--dense | --ragged]
+    -- NOTE:
+        - --dense or --ragged forces the layout of the trajectories
+            (default: from the occupancy of the sample)
+
+e.g. python benchmark_orbit_store.py /xdisk/gbesla/katiechambe/harvest high major
+"""
+
+import os
+import sys
+import time
+import h5py
+import numpy as np
+
+from harvesting_tools.harvest_paths import SetupPaths
+from harvesting_tools.orbit_store import build_orbit_store, OrbitStore, snapshot_keys
+
+repeats = 3
+
+
+def read_files(orbitpaths):
+    """the orbit files, as lists of dicts"""
+    orbits = []
+    for snap, path in orbitpaths:
+        f = h5py.File(path, 'r')
+        orbits.append({key: np.array(val) for key, val in f.items()})
+        f.close()
+    return orbits
+
+
+def read_store(storepath, sample):
+    """the sample of the store, with sample.load()"""
+    with OrbitStore(storepath) as store:
+        return store[sample].load()
+
+
+def best_time(func, *args):
+    """result of func(*args) and its shortest time of repeats calls"""
+    times = []
+    for i in range(repeats):
+        t0 = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - t0)
+        del result
+    return func(*args), min(times)
+
+if __name__ == "__main__":
+    paths = SetupPaths(sys.argv[1])
+    masstype, pairtype = sys.argv[2], sys.argv[3]
+    float32 = "--float32" in sys.argv
+    layout = "dense" if "--dense" in sys.argv else "ragged" if "--ragged" in sys.argv else None
+    storepath = f"{paths.path_orbits}orbit_store_{masstype}mass_{pairtype}.hdf5"
+    orbitpaths = [(snap, f"{paths.path_orbits}{masstype}mass_{pairtype}_{snap}.hdf5") for snap in range(100)]
+    orbitpaths = [(snap, path) for snap, path in orbitpaths if os.path.exists(path)]
+
+    t0 = time.perf_counter()
+    build_orbit_store(paths, storepath, [snap for snap, path in orbitpaths],
+                      samples=[(masstype, pairtype)], float32=float32, layout=layout)
+    t_build = time.perf_counter() - t0
+
+    orbits, t_files = best_time(read_files, orbitpaths)
+    collection, t_store = best_time(read_store, storepath, f"{masstype}mass_{pairtype}")
+
+    with OrbitStore(storepath) as store:
+        sample = store[f"{masstype}mass_{pairtype}"]
+        rng = np.random.default_rng(0)
+        pairs = np.sort(rng.choice(sample.npairs, min(500, sample.npairs), replace=False))
+        selected = {key: sample.get(key, pairs=pairs, snapshots=slice(40, 90))
+                    for key in ["Separations", "SubhaloPos1", "GroupFlag"]}
+        layout = sample.layout
+
+    start = 0
+    for (snap, path), orbit in zip(orbitpaths, orbits):
+        npairs = len(orbit["PairKey"])
+        assert np.all(collection["CatalogSnapshot"][start:start+npairs] == snap)
+        for key, val in orbit.items():
+            if key in snapshot_keys:
+                assert np.array_equal(val, collection[key]), key
+            elif key == "PairKey":
+                assert list(val) == collection[key][start:start+npairs], key
+            elif float32 and val.dtype == np.float64 and val.ndim > 1:
+                assert np.allclose(val, collection[key][start:start+npairs], rtol=1e-6, equal_nan=True), key
+            else:
+                assert np.array_equal(val, collection[key][start:start+npairs], equal_nan=True), key
+        start += npairs
+
+    for key, val in selected.items():
+        assert np.array_equal(val, collection[key][pairs, 40:90], equal_nan=True), key
+
+    size_files = sum(os.path.getsize(path) for snap, path in orbitpaths)
+    size_store = os.path.getsize(storepath)
+    print(f"{len(orbitpaths)} orbit files, {start} pairs: {layout} store built in {t_build:.2f} s")
+    print(f"size: files {size_files/1e6:.1f} MB, store {size_store/1e6:.1f} MB")
+    print(f"load: files {t_files:.2f} s, store {t_store:.2f} s")
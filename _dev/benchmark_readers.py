@@ -0,0 +1,181 @@
+"""
+Times the tree and group catalog readers and the orbit collection on a
+synthetic simulation in the TNG layout (harvesting_tools.synthetic_tng),
+so that changes to the readers can be compared without the TNG100 data.
+
+Benchmarks:
+    main_branch       TreeDB.get_main_branch, one subhalo at a time
+    future_branch     TreeDB.get_future_branch, one subhalo at a time
+    trace_tree        TraceMergerTree (past and future branch)
+    main_branches     TreeDB.get_main_branches, all subhalos at once
+    future_branches   TreeDB.get_future_branches, all subhalos at once
+    catalog           subfind_catalog, all datablocks
+    catalog_lazy      subfind_catalog(lazy=True) and three datablocks
+    offsets           get_offsets of the catalog
+    orbits            group_pairs and build_orbits of the last snapshot
+
+Usage:
+------
+    python benchmark_readers.py [--trees 2000] [--dir <simdir>] [--repeat 5]
+                                [--save results.json] [--compare baseline.json]
+    -- NOTE:
+        - without --dir the simulation is written to a temporary directory
+            and removed at the end; with --dir it is written only if it
+            does not exist yet, so that it can be reused between runs
+        - the best time of --repeat runs is reported for each benchmark
+        - --compare exits with status 1 if any benchmark is more than
+            --tolerance (default 1.2) times slower than in the baseline
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import h5py
+
+from harvesting_tools.synthetic_tng import make_synthetic_tng, write_snapshot_data
+from harvesting_tools.readtreeHDF5_public import TreeDB
+from harvesting_tools.readsubfHDF5_Py3 import subfind_catalog, get_offsets
+from harvesting_tools.merger_trees import TraceMergerTree
+from harvesting_tools.abundance_matching import AbundanceMatching
+from harvesting_tools.group_pairs import group_pairs
+from harvesting_tools.orbits import build_orbits
+
+little_h = 0.6774
+
+
+def best_time(func, repeat):
+    """shortest wall time of repeat calls of func"""
+    times = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def read_snapdata(path):
+    f = h5py.File(path, 'r')
+    snapdata = {key: np.array(val) for key, val in f.items()}
+    f.close()
+    return snapdata
+
+
+def tracked_subhalos(treedir, snapshot, nsubhalos, seed=0):
+    """random subfind IDs of subhalos that are in the trees"""
+    offsets = h5py.File(f"{treedir}offsets/offsets_{snapshot:03d}.hdf5", 'r')
+    tracked = np.flatnonzero(offsets["Subhalo/SubLink/RowNum"][()] >= 0)
+    offsets.close()
+    return np.random.default_rng(seed).choice(tracked, min(nsubhalos, len(tracked)), replace=False)
+
+
+def benchmarks(simdir, snapdata, nsubhalos):
+    """dict of benchmark name: function to time"""
+    treedir = f"{simdir}/postprocessing/"
+    catdir = f"{simdir}/output/"
+    snapshot = len(snapdata['Snapshot']) - 1
+    scale = snapdata['Scale'][snapshot]
+
+    # future branches are read from halfway through the simulation
+    subfind_ids = tracked_subhalos(treedir, snapshot, nsubhalos)
+    snapnums = np.full(len(subfind_ids), snapshot)
+    future_ids = tracked_subhalos(treedir, snapshot//2, nsubhalos)
+    future_snapnums = np.full(len(future_ids), snapshot//2)
+
+    def main_branch():
+        tree = TreeDB(treedir)
+        for subfind_id in subfind_ids:
+            tree.get_main_branch(snapshot, subfind_id, keysel=['SnapNum', 'SubhaloMass', 'SubhaloPos'])
+
+    def future_branch():
+        tree = TreeDB(treedir)
+        for subfind_id in future_ids[:len(future_ids)//4]:
+            tree.get_future_branch(snapshot//2, subfind_id, keysel=['SnapNum', 'SubhaloMass'])
+
+    def trace_tree():
+        for subfind_id in subfind_ids[:len(subfind_ids)//4]:
+            TraceMergerTree(treedir, snapshot, subfind_id)
+
+    def main_branches():
+        TreeDB(treedir).get_main_branches(snapnums, subfind_ids, keysel=['SnapNum', 'SubhaloMass', 'SubhaloPos'])
+
+    def future_branches():
+        TreeDB(treedir).get_future_branches(future_snapnums, future_ids, keysel=['SnapNum', 'SubhaloMass'])
+
+    def catalog():
+        subfind_catalog(catdir, snapshot, keysel=None)
+
+    def catalog_lazy():
+        cat = subfind_catalog(catdir, snapshot, lazy=True)
+        cat.SubhaloMass, cat.SubhaloPos, cat.GroupFirstSub
+
+    cat = subfind_catalog(catdir, snapshot, keysel=None)
+
+    def offsets():
+        get_offsets(cat)
+
+    def orbits():
+        stellar_mass = AbundanceMatching(cat.SubhaloMass*1e10/little_h, snapdata['Redshift'][snapshot],
+                                         1).realizations(med=True)[:, 0]/1e10
+        pairs = group_pairs(cat, stellar_mass, scale, little_h)
+        build_orbits(TreeDB(treedir), pairs, snapshot, snapdata)
+
+    return {"main_branch": main_branch, "future_branch": future_branch, "trace_tree": trace_tree,
+            "main_branches": main_branches, "future_branches": future_branches,
+            "catalog": catalog, "catalog_lazy": catalog_lazy, "offsets": offsets, "orbits": orbits}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the readers on a synthetic simulation")
+    parser.add_argument("--trees", type=int, default=2000)
+    parser.add_argument("--snapshots", type=int, default=100)
+    parser.add_argument("--subhalos", type=int, default=200, help="subhalos read one at a time")
+    parser.add_argument("--dir", default=None, help="simulation directory (reused if it exists)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", nargs="+", default=None, help="benchmarks to run")
+    parser.add_argument("--save", default=None, help="write the timings to this json file")
+    parser.add_argument("--compare", default=None, help="json file of baseline timings")
+    parser.add_argument("--tolerance", type=float, default=1.2)
+    args = parser.parse_args()
+
+    simdir = args.dir if args.dir is not None else tempfile.mkdtemp(prefix="synthetic_tng_")
+    try:
+        if not os.path.exists(f"{simdir}/snapshot_data.hdf5"):
+            t0 = time.perf_counter()
+            info = make_synthetic_tng(simdir, args.trees, args.snapshots)
+            write_snapshot_data(f"{simdir}/snapshot_data.hdf5", args.snapshots)
+            print(f"wrote {info['nrows']} tree rows in {time.perf_counter() - t0:.1f} s")
+        snapdata = read_snapdata(f"{simdir}/snapshot_data.hdf5")
+
+        results = {}
+        for name, func in benchmarks(simdir, snapdata, args.subhalos).items():
+            if args.only is not None and name not in args.only:
+                continue
+            results[name] = best_time(func, args.repeat)
+            print(f"{name:>16s}: {results[name]*1e3:10.2f} ms")
+    finally:
+        if args.dir is None:
+            shutil.rmtree(simdir)
+
+    if args.save is not None:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=1)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        slower = []
+        for name, t in results.items():
+            if name not in baseline:
+                continue
+            ratio = t/baseline[name]
+            flag = "  SLOWER" if ratio > args.tolerance else ""
+            print(f"{name:>16s}: {ratio:6.2f} x baseline{flag}")
+            if ratio > args.tolerance:
+                slower.append(name)
+        if slower:
+            sys.exit(1)
@@ -0,0 +1,102 @@
+"""
+Checks group_pairs against a loop over the groups of a group catalog,
+column by column (exact equality), and checks that it writes the same
+set of columns as the units list and as an existing pairs/*.hdf5 file.
+
+Usage:
+------
+    python check_group_pairs.py <catalog-basedir> <snapshot> [<pairs-file>]
+    -- NOTE:
+        - the stellar masses are the median abundance matching masses
+        - e.g. with the synthetic simulation of harvesting_tools.synthetic_tng
+            and data/pairs/highmass_major_99.hdf5
+"""
+
+import sys
+import numpy as np
+import h5py
+
+from harvesting_tools.readsubfHDF5_Py3 import subfind_catalog
+from harvesting_tools.abundance_matching import AbundanceMatching
+from harvesting_tools.group_pairs import group_pairs, units_dict
+from harvesting_tools.vector_correction import vectorCorrection as vector
+
+little_h = 0.6774
+
+# catalog field of the per-subhalo columns, and whether it is divided by h
+sub_fields = {"Mass": ("SubhaloMass", True), "MassType": ("SubhaloMassType", True),
+              "Vel": ("SubhaloVel", False), "BHMass": ("SubhaloBHMass", True),
+              "BHMdot": ("SubhaloBHMdot", False), "SFR": ("SubhaloSFR", False),
+              "SFRinRad": ("SubhaloSFRinRad", False),
+              "GasMetallicity": ("SubhaloGasMetallicity", False)}
+
+
+def loop_pairs(cat, stellar_mass, scale):
+    """the pairs of group_pairs, one group at a time"""
+    rows = {key: [] for key in units_dict}
+    boxsize = cat.boxsize*scale/little_h
+    for group in range(cat.ngroups):
+        nsubs = cat.GroupNsubs[group]
+        if nsubs < 2:
+            continue
+        subs = cat.GroupFirstSub[group] + np.arange(nsubs)
+        subs = subs[np.argsort(-stellar_mass[subs], kind='stable')]
+        sub1, sub2 = subs[0], subs[1]
+        stell1, stell2 = stellar_mass[sub1], stellar_mass[sub2]
+        stell3 = stellar_mass[subs[2]] if nsubs > 2 else 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = stell2/stell1
+        triple = 2 if (not np.isfinite(ratio)) or (stell1 <= 0) else int(stell3 > 0.1*stell2)
+
+        pos1 = cat.SubhaloPos[sub1].astype(np.float64)*scale/little_h
+        pos2 = cat.SubhaloPos[sub2].astype(np.float64)*scale/little_h
+        separation = np.linalg.norm(vector(pos1[np.newaxis], pos2[np.newaxis], boxsize), axis=1)[0]
+        vel1, vel2 = cat.SubhaloVel[sub1].astype(np.float64), cat.SubhaloVel[sub2].astype(np.float64)
+
+        row = {"Group ID": group, "Group Mass": np.float64(cat.Group_M_TopHat200[group])/little_h,
+               "Group Radius": np.float64(cat.Group_R_TopHat200[group])*scale/little_h,
+               "Group Nsubs": nsubs, "Sub1 ID": sub1, "Sub2 ID": sub2,
+               "Sub1 Stellar Mass": stell1, "Sub2 Stellar Mass": stell2,
+               "Sub1 Pos": pos1, "Sub2 Pos": pos2,
+               "Separation": separation, "Comoving Separation": separation/scale,
+               "RelVel": np.linalg.norm((vel1 - vel2)[np.newaxis], axis=1)[0],
+               "Stellar Mass Ratio": ratio, "Realization": -1, "TripleFlag": triple}
+        for name, (field, per_h) in sub_fields.items():
+            for num, sub in [(1, sub1), (2, sub2)]:
+                val = np.asarray(getattr(cat, field)[sub]).astype(np.float64)
+                row[f"Sub{num} {name}"] = val/little_h if per_h else val
+        for key, val in row.items():
+            rows[key].append(val)
+    return {key: np.array(val) for key, val in rows.items()}
+
+
+if __name__ == "__main__":
+    basedir, snapshot = sys.argv[1], int(sys.argv[2])
+    cat = subfind_catalog(basedir, snapshot, keysel=None)
+    scale = 1/(1 + cat.redshift)
+    stellar_mass = AbundanceMatching(cat.SubhaloMass*1e10/little_h, cat.redshift,
+                                     1).realizations(med=True)[:, 0]/1e10
+
+    pairs = group_pairs(cat, stellar_mass, scale, little_h)
+    assert set(pairs) == set(units_dict), set(pairs) ^ set(units_dict)
+    if len(sys.argv) > 3:
+        f = h5py.File(sys.argv[3], 'r')
+        filekeys = set(f.keys()) - {"Header"}
+        f.close()
+        assert set(pairs) == filekeys, set(pairs) ^ filekeys
+
+    expected = loop_pairs(cat, stellar_mass, scale)
+    mismatched = {}
+    for key in units_dict:
+        val, ref = np.asarray(pairs[key]), expected[key]
+        assert val.shape == ref.shape, (key, val.shape, ref.shape)
+        same = val == ref
+        if val.dtype.kind == 'f':
+            same |= np.isnan(val) & np.isnan(ref)
+        different = ~same
+        if different.any():
+            mismatched[key] = int(different.sum())
+    for key, count in mismatched.items():
+        print(f"{key}: {count} of {expected[key].size} elements differ")
+    assert not mismatched
+    print(f"identical: {len(pairs['Sub1 ID'])} pairs, {len(pairs)} columns")
@@ -0,0 +1,49 @@
+"""
+Checks that orbits collected through a LineageRegistry are identical to
+those read directly from the trees, for the pair catalogs of several
+snapshots, and reports how many lineages were read for how many
+subhalo requests.
+
+Usage:
+------
+    python check_lineages.py <path-to-harvest> <path-to-tng> <mass> <ratio> <snapshot> [<snapshot> ...]
+"""
+
+import sys
+import time
+import numpy as np
+
+from harvesting_tools.harvest_paths import SetupPaths
+from harvesting_tools.readtreeHDF5_public import TreeDB
+from harvesting_tools.branch_cache import LineageRegistry
+from harvesting_tools.orbits import build_orbits
+from harvesting_tools.orbit_pool import read_pairs, read_snapdata
+
+
+if __name__ == "__main__":
+    paths = SetupPaths(sys.argv[1])
+    paths.tng(sys.argv[2])
+    masstype, pairtype = sys.argv[3], sys.argv[4]
+    snapshots = [int(snap) for snap in sys.argv[5:]]
+    snapdata = read_snapdata(paths)
+    tree = TreeDB(paths.tng_trees)
+    lineages = LineageRegistry(TreeDB(paths.tng_trees), nsnaps=len(snapdata['Snapshot']))
+
+    t_tree, t_lineages = 0., 0.
+    for snapshot in snapshots:
+        pairs = read_pairs(paths, snapshot, masstype, pairtype)
+        t0 = time.perf_counter()
+        direct = build_orbits(tree, pairs, snapshot, snapdata)
+        t_tree += time.perf_counter() - t0
+        t0 = time.perf_counter()
+        registered = build_orbits(lineages, pairs, snapshot, snapdata)
+        t_lineages += time.perf_counter() - t0
+        for key, val in direct.items():
+            if key == "PairKey":
+                assert val == registered[key], key
+            else:
+                val = np.asarray(val)
+                assert np.array_equal(val, np.asarray(registered[key]), equal_nan=(val.dtype.kind == 'f')), key
+
+    print(f"identical: {lineages.nrequests} subhalo requests, {len(lineages)} lineages read")
+    print(f"trees {t_tree:.2f} s, lineage registry {t_lineages:.2f} s")
@@ -0,0 +1,52 @@
+"""
+Checks the cumulative-sum get_offsets of readsubfHDF5_Py3 against the
+original per-group, per-subhalo loop, and times both.
+
+Usage:
+------
+    python check_offsets.py <path-to-tng> <snapshot>
+
+e.g. python check_offsets.py /xdisk/gbesla/katiechambe/IllustrisTNG/TNG100-1/ 99
+"""
+
+import sys
+import time
+import numpy as np
+
+from harvesting_tools.readsubfHDF5_Py3 import subfind_catalog, get_offsets
+
+
+def legacy_offsets(cat, part_types=[0, 1, 4, 5]):
+    """the loop of the original get_offsets"""
+    GroupOffset = np.zeros((cat.ngroups, 6), dtype="int64")
+    HaloOffset  = np.zeros((cat.nsubs, 6), dtype="int64")
+
+    for parttype in part_types:
+        k = 0
+        for i in range(0, cat.ngroups):
+                    if i > 0:
+                           GroupOffset[i, parttype] = GroupOffset[i-1, parttype] + cat.GroupLenType[i-1, parttype]
+                    if cat.GroupNsubs[i] > 0:
+                            HaloOffset[k, parttype] = GroupOffset[i, parttype]
+                            k += 1
+                            for j in range(1, cat.GroupNsubs[i]):
+                                    HaloOffset[k, parttype] =  HaloOffset[k-1, parttype] + cat.SubhaloLenType[k-1, parttype]
+                                    k += 1
+    return GroupOffset, HaloOffset
+
+
+if __name__ == "__main__":
+    cat = subfind_catalog(sys.argv[1], int(sys.argv[2]),
+                          keysel=["GroupLenType", "GroupNsubs", "SubhaloLenType"])
+
+    t0 = time.perf_counter()
+    group_legacy, halo_legacy = legacy_offsets(cat)
+    t_legacy = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    group_offsets, halo_offsets = get_offsets(cat)
+    t_vector = time.perf_counter() - t0
+
+    assert np.array_equal(group_legacy, group_offsets)
+    assert np.array_equal(halo_legacy, halo_offsets)
+    print(f"{cat.ngroups} groups, {cat.nsubs} subhalos identical: "
+          f"loop {t_legacy:.2f} s, cumsum {t_vector:.3f} s")
@@ -0,0 +1,238 @@
+"""
+Checks the vectorized orbit collection (harvesting_tools.orbits) against
+the per-pair, per-snapshot loop of pull_orbitdata-collection.py and
+against the existing orbits/*.hdf5 file, element by element, and times
+the loop and the vectorized collection.
+
+Usage:
+------
+    python check_orbits.py <path-to-harvest> <path-to-tng> <snapshot> <mass> <ratio> [npairs]
+
+e.g. python check_orbits.py /xdisk/gbesla/katiechambe/harvest /xdisk/gbesla/katiechambe/IllustrisTNG/TNG100-1/ 50 high major 200
+
+Without the trees, the separations, velocities and positions of existing
+orbit files can be recomputed from their positions and velocities:
+    python check_orbits.py stored <snapshot_data.hdf5> <orbits-file> [<orbits-file> ...]
+    -- NOTE:
+        - the number of differing elements of every dataset is reported;
+            the exit status is 1 if any element differs
+        - the loop uses np.linalg.norm, which sums the squares in an order
+            that depends on the BLAS library, so Separations,
+            SeparationsComoving and RelativeVelocity can differ from it in
+            the last bit on some machines; the orbit files themselves are
+            reproduced exactly
+"""
+
+import os
+import sys
+import time
+import h5py
+import numpy as np
+
+from harvesting_tools.harvest_paths import SetupPaths
+from harvesting_tools.readtreeHDF5_public import TreeDB
+from harvesting_tools.orbits import build_orbits, collect_orbits
+from harvesting_tools.vector_correction import vectorCorrection as vector
+
+
+def legacy_orbits(tree, pairs, snapshot, convert, little_h=0.6774):
+    """
+    The loop of pull_orbitdata-collection.py, with each merged branch
+    ordered from the root descendant down to the main leaf progenitor
+    """
+    full_snaps = np.arange(0, len(convert['Snapshot']), 1)
+    numpairs = len(pairs['Sub1 ID'])
+    merge_flag = np.zeros((numpairs), dtype="bool")
+    merge_snap = np.zeros((numpairs), dtype="int32")
+    merge_redshift = np.zeros((numpairs), dtype="int32")
+    infall_snap = np.zeros((numpairs), dtype="int32")
+    infall_redshift = np.zeros((numpairs))
+    pairkey = []
+    seps = np.zeros((numpairs, len(full_snaps)))
+    seps_comov = np.zeros((numpairs, len(full_snaps)))
+    seps_scaled = np.zeros((numpairs, len(full_snaps)))
+    vels = np.zeros((numpairs, len(full_snaps)))
+    group_flag = np.zeros((numpairs, len(full_snaps)), dtype="bool")
+    rvir = np.zeros((numpairs, len(full_snaps)))
+    pos1, pos2 = np.zeros((2, numpairs, len(full_snaps), 3))
+    vel1, vel2 = np.zeros((2, numpairs, len(full_snaps), 3))
+    seps.fill(np.nan)
+    seps_comov.fill(np.nan)
+    seps_scaled.fill(np.nan)
+    vels.fill(np.nan)
+
+    for ind in range(numpairs):
+        trees = []
+        for sub in [pairs['Sub1 ID'][ind], pairs['Sub2 ID'][ind]]:
+            past = tree.get_main_branch(snapshot, sub)
+            future = tree.get_future_branch(snapshot, sub)
+            merged = {}
+            for key in past._fields:
+                merged[key] = np.concatenate([getattr(future, key)[:-1], getattr(past, key)])
+            trees.append(merged)
+        tree_primary, tree_secondary = trees
+
+        root1 = tree_primary['RootDescendantID'][0]
+        root2 = tree_secondary['RootDescendantID'][0]
+        if root1 == root2:
+            merge_flag[ind] = True
+            desc_mask1 = np.isin(tree_primary['DescendantID'], tree_secondary['DescendantID'])
+            desc_mask2 = np.isin(tree_secondary['DescendantID'], tree_primary['DescendantID'])
+            desc_overlap1 = tree_primary["SnapNum"][desc_mask1]
+            desc_overlap2 = tree_secondary["SnapNum"][desc_mask2]
+            if desc_overlap1[-1] == desc_overlap2[-1]:
+                merge_snap[ind] = desc_overlap1[-1]+1
+                merge_redshift[ind] = convert['Redshift'][int(merge_snap[ind])]
+            elif abs(desc_overlap1[-1]-desc_overlap2[-1]) == 1:
+                merge_snap[ind] = np.min(np.intersect1d(desc_overlap1, desc_overlap2))
+                merge_redshift[ind] = convert['Redshift'][int(merge_snap[ind])]
+        else:
+            merge_snap[ind] = -1
+            merge_redshift[ind] = -1
+
+        for snap in full_snaps:
+            scale = convert['Scale'][snap]
+            if (snap in tree_primary['SnapNum']) and (snap in tree_secondary['SnapNum']):
+                # scalar locations, since numpy >= 2 no longer assigns
+                # one-element arrays to array elements
+                loc1 = np.where(tree_primary['SnapNum'] == snap)[0][0]
+                loc2 = np.where(tree_secondary['SnapNum'] == snap)[0][0]
+                grnum1 = tree_primary['SubhaloGrNr'][loc1]
+                grnum2 = tree_secondary['SubhaloGrNr'][loc2]
+                group_flag[ind][snap] = grnum1 == grnum2
+                subpos1 = tree_primary['SubhaloPos'][loc1]
+                subpos2 = tree_secondary['SubhaloPos'][loc2]
+                # periodic wrap in the precision of the tree (float32),
+                # length in double precision
+                comoving_dist = np.linalg.norm(vector(subpos1, subpos2, 75000).astype(np.float64))
+                seps_comov[ind][snap] = comoving_dist
+                seps[ind][snap] = comoving_dist*(scale)/little_h
+                pos1[ind][snap] = subpos1
+                pos2[ind][snap] = subpos2
+                rvir_comov = tree_primary['Group_R_TopHat200'][loc1]
+                # explicit casts give the numpy 1.24 (value-based casting)
+                # results of the original script with any numpy version
+                rvir[ind][snap] = rvir_comov*np.float32(scale)/np.float32(little_h)
+                seps_scaled[ind][snap] = np.float32(comoving_dist)/rvir_comov
+                vel1[ind][snap] = tree_primary['SubhaloVel'][loc1]
+                vel2[ind][snap] = tree_secondary['SubhaloVel'][loc2]
+                vels[ind][snap] = np.linalg.norm(vel1[ind][snap]-vel2[ind][snap])
+
+        infall_snap[ind] = np.where(group_flag[ind]==True)[0][0]
+        infall_redshift[ind] = convert['Redshift'][infall_snap[ind]]
+        pk_string = (str(tree_primary['SubhaloID'][-1])+str(tree_secondary['SubhaloID'][-1]))
+        pairkey.append(pk_string.encode("utf-8"))
+
+    return {"MergeFlag":merge_flag, "MergeRedshift":merge_redshift,
+            "MergeSnapshot":merge_snap, "InfallRedshift":infall_redshift,
+            "InfallSnapshot":infall_snap, "PairKey":pairkey, "GroupFlag":group_flag,
+            "GroupRvir":rvir, "Separations":seps, "SeparationsComoving":seps_comov,
+            "SeparationsScaled":seps_scaled, "RelativeVelocity":vels,
+            "SubhaloPos1":pos1, "SubhaloPos2":pos2, "SubhaloVel1":vel1, "SubhaloVel2":vel2}
+
+
+def mismatches(expected, collection):
+    """number of differing elements of every dataset of two orbit collections"""
+    counts = {}
+    for key, val in expected.items():
+        if key == "PairKey":
+            counts[key] = sum(a != b for a, b in zip(val, collection[key])) + abs(len(val) - len(collection[key]))
+            continue
+        val, other = np.asarray(val), np.asarray(collection[key])
+        assert val.dtype == other.dtype, (key, val.dtype, other.dtype)
+        assert val.shape == other.shape, (key, val.shape, other.shape)
+        same = val == other
+        if val.dtype.kind == 'f':
+            same |= np.isnan(val) & np.isnan(other)
+        counts[key] = int((~same).sum())
+    return counts
+
+
+def report(name, counts, expected):
+    """prints the datasets that differ; True if none does"""
+    differing = {key: count for key, count in counts.items() if count > 0}
+    for key, count in differing.items():
+        print(f"  {key}: {count} of {np.asarray(expected[key]).size} elements differ from {name}")
+    if not differing:
+        print(f"  identical to {name}")
+    return not differing
+
+
+def stored_branches(stored, num):
+    """
+    Dense branches with the positions and velocities of an orbit file,
+    present wherever its separations are finite (the other fields are
+    placeholders)
+    """
+    present = np.isfinite(stored['SeparationsComoving'])
+    npairs, nsnaps = present.shape
+    ids = np.arange(npairs*nsnaps).reshape(npairs, nsnaps) + num*npairs*nsnaps
+    return {'SnapNum': np.where(present, np.arange(nsnaps), -1),
+            'SubhaloID': ids, 'DescendantID': ids, 'RootDescendantID': ids,
+            'SubhaloPos': stored[f'SubhaloPos{num}'].astype(np.float32),
+            'SubhaloVel': stored[f'SubhaloVel{num}'].astype(np.float32),
+            'SubhaloGrNr': np.zeros((npairs, nsnaps), dtype=np.int32),
+            'Group_R_TopHat200': np.ones((npairs, nsnaps), dtype=np.float32)}
+
+
+def check_stored(snapdata_path, orbit_paths):
+    """recomputes the position and velocity datasets of orbit files"""
+    f = h5py.File(snapdata_path, 'r')
+    convert = {key: np.array(val) for key, val in f.items()}
+    f.close()
+    keys = ["Separations", "SeparationsComoving", "RelativeVelocity",
+            "SubhaloPos1", "SubhaloPos2", "SubhaloVel1", "SubhaloVel2"]
+    ok = True
+    for path in orbit_paths:
+        f = h5py.File(path, 'r')
+        stored = {key: np.array(val) for key, val in f.items()}
+        f.close()
+        npairs = len(stored['SeparationsComoving'])
+        pairs = {key: np.zeros(npairs) for key in ['Sub1 Mass', 'Sub2 Mass', 'Sub1 Stellar Mass',
+                                                   'Sub2 Stellar Mass', 'Stellar Mass Ratio']}
+        pairs.update({key: np.zeros(npairs, dtype=np.int64) for key in ['Sub1 ID', 'Sub2 ID', 'Group ID']})
+        collection = collect_orbits(pairs, stored_branches(stored, 1), stored_branches(stored, 2), convert)
+        print(f"{path}: {npairs} pairs")
+        expected = {key: stored[key] for key in keys}
+        ok &= report(path, mismatches(expected, collection), expected)
+    return ok
+
+
+if __name__ == "__main__":
+    if sys.argv[1] == "stored":
+        sys.exit(0 if check_stored(sys.argv[2], sys.argv[3:]) else 1)
+
+    paths = SetupPaths(sys.argv[1])
+    paths.tng(sys.argv[2])
+    snapshot, masstype, pairtype = int(sys.argv[3]), sys.argv[4], sys.argv[5]
+
+    f = h5py.File(f"{paths.path_pairs}{masstype}mass_{pairtype}_{snapshot}.hdf5", 'r')
+    pairs = {key: np.array(val) for key, val in f.items() if key != "Header"}
+    f.close()
+    npairs = len(pairs['Sub1 ID'])
+    if len(sys.argv) > 6:
+        npairs = min(npairs, int(sys.argv[6]))
+        pairs = {key: val[:npairs] for key, val in pairs.items()}
+
+    f = h5py.File(f"{paths.path_misc}snapshot_data.hdf5", 'r')
+    convert = {key: np.array(val) for key, val in f.items()}
+    f.close()
+
+    tree = TreeDB(paths.tng_trees)
+    t0 = time.perf_counter()
+    legacy = legacy_orbits(tree, pairs, snapshot, convert)
+    t_legacy = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    collection = build_orbits(tree, pairs, snapshot, convert)
+    t_vector = time.perf_counter() - t0
+
+    print(f"{npairs} pairs: loop {t_legacy:.2f} s, vectorized {t_vector:.2f} s")
+    ok = report("the loop", mismatches(legacy, collection), legacy)
+    orbitpath = f"{paths.path_orbits}{masstype}mass_{pairtype}_{snapshot}.hdf5"
+    if os.path.exists(orbitpath):
+        f = h5py.File(orbitpath, 'r')
+        stored = {key: np.array(val)[:npairs] for key, val in f.items() if key in legacy}
+        f.close()
+        stored["PairKey"] = list(stored["PairKey"])
+        ok &= report(orbitpath, mismatches(stored, collection), stored)
+    sys.exit(0 if ok else 1)
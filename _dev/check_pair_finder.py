@@ -0,0 +1,71 @@
+"""
+Checks find_pairs and count_tertiaries against all-pairs separations on
+random subhalos, some of them exactly on the box edges (at 0, at tiny
+negative coordinates and at boxsize, which cKDTree refuses unless they are
+wrapped into [0, boxsize)).
+
+Usage:
+------
+    python check_pair_finder.py [<nsubs>]
+"""
+
+import sys
+import numpy as np
+
+from harvesting_tools.pair_finder import find_pairs, count_tertiaries
+from harvesting_tools.vector_correction import vectorCorrection as vector
+
+boxsize = 75000.
+max_sep = 3000.
+
+
+def random_subhalos(nsubs, seed=0):
+    """float32 positions and masses, with edge cases on the box edges"""
+    rng = np.random.default_rng(seed)
+    pos = rng.uniform(0, boxsize, (nsubs, 3)).astype(np.float32)
+    mass = 10**rng.uniform(-2, 1, nsubs)
+    # subhalos at 0, just below 0 and at boxsize, next to one another
+    # across the edge
+    edges = [0., -1e-5, -1e-30, boxsize, np.float32(boxsize) - np.float32(1e-2)]
+    for i, edge in enumerate(edges):
+        pos[i] = pos[len(edges)+i]
+        pos[i, i % 3] = edge
+        pos[len(edges)+i, i % 3] = 10.
+    return pos, mass
+
+
+def brute_force(pos, mass, lower, upper):
+    """all pairs (primary, secondary, separation) with every separation"""
+    pos = pos.astype(np.float64)
+    nsubs = len(mass)
+    i, j = np.meshgrid(np.arange(nsubs), np.arange(nsubs), indexing='ij')
+    i, j = i.ravel(), j.ravel()
+    separation = np.linalg.norm(vector(pos[i], pos[j], boxsize), axis=1)
+    ratio = mass[j]/mass[i]
+    keep = (i != j) & (separation < max_sep) & (ratio > lower) & (ratio <= upper)
+    return i[keep], j[keep], separation[keep]
+
+
+if __name__ == "__main__":
+    nsubs = int(sys.argv[1]) if len(sys.argv) > 1 else 1500
+    pos, mass = random_subhalos(nsubs)
+    lower, upper = 0.1, 1.
+
+    pairs = find_pairs(pos, mass, max_sep, (lower, upper), boxsize=boxsize, chunksize=97)
+    found = set(zip(pairs["Primary"].tolist(), pairs["Secondary"].tolist()))
+    prim, sec, separation = brute_force(pos, mass, lower, upper)
+    expected = dict(zip(zip(prim.tolist(), sec.tolist()), separation))
+    assert found == set(expected), (len(found), len(expected))
+    for p, s, sep in zip(pairs["Primary"], pairs["Secondary"], pairs["Separation"]):
+        assert sep == expected[(p, s)]
+    edge_pairs = sum(p < 10 or s < 10 for p, s in found)
+
+    ntertiary = count_tertiaries(pos, mass, pairs["Primary"], pairs["Secondary"], max_sep,
+                                 boxsize=boxsize, chunksize=97)
+    near, other, _ = brute_force(pos, mass, 0, np.inf)
+    for n, p, s in zip(ntertiary, pairs["Primary"], pairs["Secondary"]):
+        companions = other[(near == p) & (other != s)]
+        assert n == (mass[companions] >= 0.1*mass[s]).sum()
+
+    print(f"identical: {len(found)} pairs ({edge_pairs} with a subhalo on the box edge), "
+          f"{int((ntertiary > 0).sum())} with tertiaries")
@@ -0,0 +1,51 @@
+"""
+Checks that orbits collected with the branches read ahead in a background
+thread (build_orbits(..., prefetch=N)) are identical to those collected
+without, and reports the time of both.
+
+Usage:
+------
+    python check_prefetch.py <path-to-harvest> <path-to-tng> <mass> <ratio> <snapshot> [<snapshot> ...]
+"""
+
+import sys
+import time
+import numpy as np
+
+from harvesting_tools.harvest_paths import SetupPaths
+from harvesting_tools.readtreeHDF5_public import TreeDB
+from harvesting_tools.orbits import build_orbits
+from harvesting_tools.orbit_pool import read_pairs, read_snapdata
+
+chunksize = 400
+depths = [1, 2, 4]
+
+
+if __name__ == "__main__":
+    paths = SetupPaths(sys.argv[1])
+    paths.tng(sys.argv[2])
+    masstype, pairtype = sys.argv[3], sys.argv[4]
+    snapshots = [int(snap) for snap in sys.argv[5:]]
+    snapdata = read_snapdata(paths)
+    tree = TreeDB(paths.tng_trees)
+
+    t_direct, t_prefetch = 0., {depth: 0. for depth in depths}
+    for snapshot in snapshots:
+        pairs = read_pairs(paths, snapshot, masstype, pairtype)
+        t0 = time.perf_counter()
+        direct = build_orbits(tree, pairs, snapshot, snapdata)
+        t_direct += time.perf_counter() - t0
+        for depth in depths:
+            t0 = time.perf_counter()
+            prefetched = build_orbits(tree, pairs, snapshot, snapdata, prefetch=depth, chunksize=chunksize)
+            t_prefetch[depth] += time.perf_counter() - t0
+            for key, val in direct.items():
+                if key == "PairKey":
+                    assert val == prefetched[key], key
+                else:
+                    val = np.asarray(val)
+                    assert np.array_equal(val, np.asarray(prefetched[key]), equal_nan=(val.dtype.kind == 'f')), key
+
+    print(f"identical for prefetch depths {depths} ({chunksize} pairs per chunk)")
+    print(f"no prefetch {t_direct:.2f} s, "
+          + ", ".join(f"prefetch={depth} {t:.2f} s" for depth, t in t_prefetch.items()))
@@ -0,0 +1,59 @@
+"""
+Checks the streamed realization statistics (harvesting_tools.realization_stats)
+against the full (pair x realization) stellar mass matrix, for random
+pairs.
+
+Usage:
+------
+    python check_realization_stats.py [npairs] [nrealizations]
+"""
+
+import sys
+import time
+import numpy as np
+
+from harvesting_tools.abundance_matching import AbundanceMatching
+from harvesting_tools.realization_stats import (RealizationReducer, stream_realizations,
+                                                sample_masks, default_bins)
+
+
+if __name__ == "__main__":
+    npairs = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    nreal = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    chunksize = 64
+    g = np.random.default_rng(3)
+    maxmass1 = 10**g.uniform(11, 12.8, npairs)
+    maxmass2 = maxmass1*g.uniform(0.05, 1, npairs)
+    groupmass = 10**g.uniform(0.5, 3, npairs)
+
+    t0 = time.perf_counter()
+    stats = stream_realizations(RealizationReducer(npairs), maxmass1, maxmass2, groupmass,
+                                0.5, nreal, np.random.default_rng(7), chunksize=chunksize).result()
+    t_stream = time.perf_counter() - t0
+
+    # the same parameter draws, all realizations in memory
+    rng = np.random.default_rng(7)
+    stellar = []
+    for lo in range(0, nreal, chunksize):
+        am = AbundanceMatching(np.concatenate([maxmass1, maxmass2]), 0.5,
+                               min(chunksize, nreal - lo), rng=rng)
+        stellar.append(am.realizations(params=am.draw_parameters())/1e10)
+    stellar = np.concatenate(stellar, axis=1)
+    stell1 = np.maximum(stellar[:npairs], stellar[npairs:])
+    stell2 = np.minimum(stellar[:npairs], stellar[npairs:])
+
+    for sample, mask in sample_masks(stell1, stell2, groupmass).items():
+        assert np.allclose(mask.mean(axis=1), stats["Fraction"][sample]), sample
+        assert np.array_equal(mask.sum(axis=0), stats["Count"][sample]), sample
+        edges = default_bins["Sub1 Stellar Mass"]
+        values = np.clip(np.log10(stell1[mask]), edges[0], np.nextafter(edges[-1], -np.inf))
+        assert np.array_equal(np.histogram(values, edges)[0],
+                              stats["Histogram"][sample]["Sub1 Stellar Mass"]), sample
+
+    # quantiles agree to the bin width
+    for key, values in [("Sub1 Stellar Mass", np.log10(stell1)),
+                        ("Stellar Mass Ratio", np.log10(stell2/stell1))]:
+        exact = np.quantile(values, [0.16, 0.5, 0.84], axis=1).T
+        width = np.diff(default_bins[key])[0]
+        assert np.nanmax(np.abs(exact - stats["Quantiles"][key])) <= width, key
+    print(f"{npairs} pairs x {nreal} realizations agree (streamed in {t_stream:.2f} s)")
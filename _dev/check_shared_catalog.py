@@ -0,0 +1,71 @@
+"""
+Checks that worker processes see the same fields through a SharedCatalog
+as through subfind_catalog, and reports the private (RssAnon) resident
+memory of each worker after it has touched every field, next to that of
+workers that read their own copy with subfind_catalog.
+
+Usage:
+------
+    python check_shared_catalog.py <basedir> <snapshot> [<nworkers>]
+"""
+
+import sys
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from harvesting_tools.readsubfHDF5_Py3 import subfind_catalog
+from harvesting_tools.shared_catalog import SharedCatalog, attach_catalog, default_fields
+
+_worker = {}
+
+
+def memory():
+    """resident memory of this process in MB, from /proc/self/status"""
+    out = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            key = line.split(":")[0]
+            if key in ["RssAnon", "RssFile", "RssShmem"]:
+                out[key] = int(line.split()[1])/1024
+    return out
+
+
+def _init_worker(spec):
+    _worker['cat'] = attach_catalog(spec)
+
+
+def _init_copy(basedir, snapshot):
+    _worker['cat'] = subfind_catalog(basedir, snapshot, keysel=default_fields)
+
+
+def _checksum(i):
+    cat = _worker['cat']
+    keys = cat.keys() if hasattr(cat, "keys") else default_fields
+    sums = {key: float(np.asarray(getattr(cat, key), dtype=np.float64).sum()) for key in keys}
+    return sums, memory()
+
+
+if __name__ == "__main__":
+    basedir, snapshot = sys.argv[1], int(sys.argv[2])
+    nworkers = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+
+    cat = subfind_catalog(basedir, snapshot, keysel=default_fields)
+    expected = {key: float(np.asarray(getattr(cat, key), dtype=np.float64).sum()) for key in default_fields}
+    nbytes = sum(getattr(cat, key).nbytes for key in default_fields)
+    del cat
+
+    with SharedCatalog(basedir, snapshot, default_fields) as shared:
+        view = shared.view()
+        for key in default_fields:
+            assert not getattr(view, key).flags.writeable
+        with ProcessPoolExecutor(nworkers, initializer=_init_worker, initargs=(shared.spec,)) as pool:
+            results = list(pool.map(_checksum, range(nworkers)))
+    for sums, mem in results:
+        assert sums == expected, (sums, expected)
+    with ProcessPoolExecutor(nworkers, initializer=_init_copy, initargs=(basedir, snapshot)) as pool:
+        copies = list(pool.map(_checksum, range(nworkers)))
+
+    anon = max(mem["RssAnon"] for sums, mem in results)
+    anon_copy = max(mem["RssAnon"] for sums, mem in copies)
+    print(f"identical in {nworkers} workers; catalog {nbytes/2**20:.1f} MB")
+    print(f"private memory per worker: shared {anon:.1f} MB, own copy {anon_copy:.1f} MB")
@@ -0,0 +1,40 @@
+"""
+Checks the interpolated stellar mass - halo mass table
+(harvesting_tools.smhm_table) against direct evaluation of
+AbundanceMatching at random halo masses and redshifts, and times both.
+
+Usage:
+------
+    python check_smhm_table.py <cachedir> [npoints]
+"""
+
+import sys
+import time
+import numpy as np
+
+from harvesting_tools.smhm_table import load_smhm_table, direct_stellar_mass
+
+
+if __name__ == "__main__":
+    npoints = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    table = load_smhm_table(sys.argv[1])
+    g = np.random.default_rng(0)
+    mhalo = 10**g.uniform(9.5, 15, npoints)
+    redshift = g.uniform(0, 6, npoints)
+
+    t0 = time.perf_counter()
+    exact = np.array([direct_stellar_mass(m, z, table.params)[0] for m, z in zip(mhalo, redshift)])
+    t_direct = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    mstar = table.stellar_mass(mhalo, redshift)
+    t_table = time.perf_counter() - t0
+
+    # the cell-centre errors of the table bound the error anywhere in the
+    # cell up to the curvature of the relation
+    error = np.max(np.abs(np.log10(mstar/exact)))
+    inverse_error = np.max(np.abs(np.log10(table.halo_mass(exact, redshift)/mhalo)))
+    assert error <= 1.05*table.error, (error, table.error)
+    assert inverse_error <= 1.05*table.inverse_error, (inverse_error, table.inverse_error)
+    print(f"forward error {error:.2e} dex (bound {table.error:.2e}), "
+          f"inverse error {inverse_error:.2e} dex (bound {table.inverse_error:.2e})")
+    print(f"{npoints} stellar masses: direct {t_direct:.2f} s, table {t_table:.4f} s")
@@ -11,6 +11,16 @@ To get stellar mass:
         - med=True yields one individual value for the given max mass and
             redshift and is calculated by setting errors to 0
 
+To get many realizations for an array of halos:
+    rng = numpy.random.default_rng(seed)
+    AbundanceMatching(maxmass,redshift,#samples,rng=rng).realizations()
+    -- NOTE:
+        - returns an array of shape (len(maxmass), samples); realization j
+            of every halo uses the same parameters (row j of
+            draw_parameters)
+        - dtype=numpy.float32 halves the memory, chunksize bounds the
+            number of halos evaluated at a time
+
 Details:
 --------
 Follows Moster, Naab, and White (2012)
@@ -22,11 +32,12 @@ __author__ = "Katie Chamberlain"
 __status__ = "Beta - forever~"
 __date__   = "May 2019 - edited Oct. 2021"
 
+import numpy as np
 from numpy.random import normal
 from numpy import where
 
 class AbundanceMatching:
-    def __init__(self, maxmass, redshift, samples):
+    def __init__(self, maxmass, redshift, samples, rng=None):
         """
         Samples from gaussian distributed abundance matching relation 
 
@@ -40,11 +51,15 @@ class AbundanceMatching:
             NOTE - not the snapshot at max mass
         samples: int
             number of realizations to sample from relationship  
+        rng: numpy.random.Generator or None
+            random number generator to draw the parameters with
+            (default: the global numpy.random functions)
         """
         
         self.maxmass = maxmass
         self.z = redshift
         self.samples = samples
+        self.rng = rng
 
         # values from table 1
         self.M10vec = [11.59, 0.236]
@@ -56,6 +71,10 @@ class AbundanceMatching:
         self.gamma10vec = [0.608, 0.059]
         self.gamma11vec = [0.329, 0.173]
 
+        # parameter order of draw_parameters
+        self.paramvecs = [self.M10vec, self.M11vec, self.N10vec, self.N11vec,
+                          self.beta10vec, self.beta11vec, self.gamma10vec, self.gamma11vec]
+
     def getvals(self, vec, med=False):
         """ 
         if asking for median (med=True):
@@ -66,6 +85,8 @@ class AbundanceMatching:
         """
         if med:
             return normal(vec[0], 0)
+        elif self.rng is not None:
+            return self.rng.normal(vec[0], vec[1], self.samples)
         else:
             return normal(vec[0], vec[1], self.samples)
 
@@ -115,4 +136,61 @@ class AbundanceMatching:
         """
         return self.maxmass*self.mass_ratio(med)
 
- 
+    def draw_parameters(self, med=False):
+        """
+        All eight relation parameters for every realization, drawn at once
+
+        Returns:
+        --------
+            array of shape (samples, 8), columns M10, M11, N10, N11,
+            beta10, beta11, gamma10, gamma11 (one row if med=True)
+        """
+        means = np.array([vec[0] for vec in self.paramvecs])
+        if med:
+            return means[np.newaxis, :]
+        sigmas = np.array([vec[1] for vec in self.paramvecs])
+        rng = self.rng if self.rng is not None else np.random
+        return rng.normal(means, sigmas, (self.samples, len(means)))
+
+    def realizations(self, params=None, med=False, dtype=np.float64, chunksize=100000):
+        """
+        stellar mass of every halo in every realization
+
+        Parameters:
+        -----------
+        params: array of shape (nrealizations, 8) or None
+            relation parameters (default: draw_parameters(med))
+        dtype: numpy dtype
+            precision of the calculation and of the result
+        chunksize: int
+            number of halos evaluated at a time; peak memory is a few
+            chunksize x nrealizations arrays
+
+        Returns:
+        --------
+            stellar masses in Msun, array of shape (nhalos, nrealizations)
+        """
+        if params is None:
+            params = self.draw_parameters(med)
+        params = np.asarray(params, dtype=np.float64)
+        M10, M11, N10, N11, beta10, beta11, gamma10, gamma11 = params.T
+
+        # per realization
+        logM = self.func(M10, M11)
+        Nany = self.func(N10, N11)
+        Nmed = self.func(self.N10vec[0], self.N11vec[0])
+        Npos = where(Nany < 0, Nmed, Nany).astype(dtype)
+        beta = self.func(beta10, beta11).astype(dtype)
+        gamma = self.func(gamma10, gamma11).astype(dtype)
+        M1 = (10**logM).astype(dtype)
+
+        # per halo and realization
+        maxmass = np.atleast_1d(np.asarray(self.maxmass, dtype=dtype))
+        stellar = np.empty((len(maxmass), len(params)), dtype=dtype)
+        for lo in range(0, len(maxmass), chunksize):
+            mass = maxmass[lo:lo+chunksize, np.newaxis]
+            x = mass/M1
+            A = x**(-beta)
+            B = x**(gamma)
+            np.multiply(mass, 2*Npos*(A+B)**-1, out=stellar[lo:lo+chunksize])
+        return stellar
@@ -0,0 +1,409 @@
+"""
+Compact, snapshot-indexed cache of the merger tree branches of the
+subhalos used in the pair and orbit analysis.
+
+The full branch (future + main branch) of every cached subhalo is
+stored as dense (subhalo x snapshot) columns, so that looking up a
+branch is a single slice of a memory-mapped array instead of a
+traversal of the tree_extended.*.hdf5 files.
+
+Usage:
+------
+To build the cache (once per simulation):
+    subhalos = {snapshot: array of subfind IDs, ...}
+    build_branch_cache(paths.tng_trees, f"{paths.path_misc}branch_cache.hdf5", subhalos)
+
+To read branches:
+    cache = BranchCache(f"{paths.path_misc}branch_cache.hdf5")
+    branch = cache.get_branch(snapshot, subfindID)
+    -- NOTE:
+        - branch is a dict with the same keys and ordering (increasing
+            SnapNum) as TraceMergerTree.fullbranch, for the cached fields
+        - TraceMergerTree(treepath, snapshot, subfindID, cache=cache) uses
+            the cache transparently and falls back to the trees otherwise
+
+To trace each lineage once when many subhalos are requested from the
+trees (e.g. the same pairs at many snapshots):
+    lineages = LineageRegistry(TreeDB(paths.tng_trees))
+    dense = lineages.get_dense(snapshot, subfind_ids)
+    -- NOTE:
+        - subhalos with the same (tree file, RootDescendantID, main leaf
+            progenitor row) have the same full branch, which is read from
+            the trees only the first time any of them is requested
+        - build_orbits(lineages, ...) uses it like a TreeDB or BranchCache
+
+File layout:
+------------
+/Header                      attrs: NumSnaps, Fields
+/Snapshots/<snap>/SubfindID  sorted Subfind IDs of the cached subhalos
+/Snapshots/<snap>/<field>    (nsubhalos, NumSnaps[, dim]) -- NaN (floats)
+                             or -1 (integers) where the branch has no entry
+"""
+
+__date__   = "October 2026"
+
+import numpy as np
+import h5py
+
+from harvesting_tools.readtreeHDF5_public import TreeDB
+
+cache_fields = ['SnapNum', 'SubhaloID', 'DescendantID', 'RootDescendantID',
+                'SubhaloPos', 'SubhaloVel', 'SubhaloGrNr', 'Group_R_TopHat200',
+                'SubhaloMass']
+
+
+def _fill_value(dtype):
+    """NaN for floating point columns, -1 otherwise"""
+    if np.issubdtype(dtype, np.floating):
+        return np.nan
+    return -1
+
+
+def dense_branches(tree, snapshot, subfind_ids, nsnaps=100, keysel=cache_fields):
+    """
+    Full branches of many subhalos at one snapshot, read from the trees
+    and scattered into dense arrays indexed by snapshot number
+
+    Parameters:
+    -----------
+    tree: TreeDB
+        merger tree database
+    snapshot: int
+        snapshot of the given Subfind IDs
+    subfind_ids: array of int
+        Subfind IDs at that snapshot
+    nsnaps: int
+        number of snapshots in the simulation
+    keysel: list of str
+        tree fields to read; must include SnapNum
+
+    Returns:
+    --------
+    dense: dict
+        {field: (len(subfind_ids), nsnaps[, dim]) array}, NaN (floats)
+        or -1 (integers) where the branch has no entry
+    """
+    past = tree.get_main_branches(snapshot, subfind_ids, keysel=keysel)
+    future = tree.get_future_branches(snapshot, subfind_ids, keysel=keysel)
+    dense = {}
+    for key in keysel:
+        values = getattr(past, key)
+        dense[key] = np.full((len(past), nsnaps) + values.shape[1:],
+                             _fill_value(values.dtype), dtype=values.dtype)
+
+    # scatter past and future branches by snapshot number
+    for branches in [past, future]:
+        which = np.repeat(np.arange(len(branches)), np.diff(branches.offsets))
+        snaps = branches.SnapNum
+        for key in keysel:
+            dense[key][which, snaps] = getattr(branches, key)
+    return dense
+
+
+def build_branch_cache(treepath, cachepath, subhalos, nsnaps=100,
+                       keysel=cache_fields, chunksize=20000):
+    """
+    Extracts the full branch of every requested subhalo from the merger
+    trees and writes it to a branch cache file
+
+    Parameters:
+    -----------
+    treepath: str
+        directory with the tree_extended.*.hdf5 and offsets/ files
+    cachepath: str
+        path of the cache file to create (overwritten if it exists)
+    subhalos: dict
+        {snapshot: array of Subfind IDs at that snapshot}
+    nsnaps: int
+        number of snapshots in the simulation
+    keysel: list of str
+        tree fields to cache; must include SnapNum
+    chunksize: int
+        number of subhalos extracted from the trees at a time
+    """
+    tree = TreeDB(treepath)
+    f = h5py.File(cachepath, 'w')
+    header = f.create_group('/Header')
+    header.attrs['NumSnaps'] = nsnaps
+    header.attrs['Fields'] = np.array(keysel, dtype=h5py.string_dtype())
+
+    # shape and dtype of each field, read once: the tree files are in an
+    # LRU pool, so a handle kept across the dense_branches calls below
+    # could be closed under us
+    treefile = tree._get_tree_file(0)
+    specs = {key: (treefile[key].shape[1:], treefile[key].dtype) for key in keysel}
+    del treefile
+    for snapshot, subfind_ids in subhalos.items():
+        subfind_ids = np.unique(np.asarray(subfind_ids, dtype=np.int64))
+        nsubs = len(subfind_ids)
+        group = f.create_group(f'/Snapshots/{snapshot}')
+        group.create_dataset('SubfindID', data=subfind_ids)
+        # contiguous, uncompressed datasets, so that they can be memory-mapped
+        columns = {}
+        for key, (shape, dtype) in specs.items():
+            columns[key] = group.create_dataset(
+                key, shape=(nsubs, nsnaps) + shape, dtype=dtype,
+                fillvalue=_fill_value(dtype))
+
+        for lo in range(0, nsubs, chunksize):
+            ids = subfind_ids[lo:lo+chunksize]
+            dense = dense_branches(tree, snapshot, ids, nsnaps, keysel)
+            for key in keysel:
+                columns[key][lo:lo+len(ids)] = dense[key]
+
+    f.close()
+
+
+class _CachedBranch:
+    """
+    Branch read from the cache, with one attribute per cached field
+    (the same attributes as the branches returned by TreeDB)
+    """
+    def __init__(self, fields):
+        for key, val in fields.items():
+            setattr(self, key, val)
+
+
+class BranchCache:
+
+    def __init__(self, cachepath):
+        """
+        Reader for a branch cache file made by build_branch_cache
+
+        Parameters:
+        -----------
+        cachepath: str
+            path of the cache file
+        """
+        self.cachepath = cachepath
+        self._file = h5py.File(cachepath, 'r')
+        self.nsnaps = int(self._file['Header'].attrs['NumSnaps'])
+        self.fields = [str(key) for key in self._file['Header'].attrs['Fields']]
+        self.snapshots = sorted(int(snap) for snap in self._file['Snapshots'].keys())
+        self._index = {}
+        self._columns = {}
+
+    def _get_index(self, snapshot):
+        """sorted Subfind IDs cached at the given snapshot"""
+        if snapshot not in self._index:
+            if snapshot in self.snapshots:
+                self._index[snapshot] = self._file[f'Snapshots/{snapshot}/SubfindID'][:]
+            else:
+                self._index[snapshot] = np.zeros(0, dtype=np.int64)
+        return self._index[snapshot]
+
+    def locate(self, snapshot, subfind_ids):
+        """
+        Row of each subhalo in the columns of the given snapshot
+
+        Returns:
+        --------
+        rows: array of int
+            row numbers (meaningless where present is False)
+        present: array of bool
+            True if the subhalo is in the cache
+        """
+        index = self._get_index(snapshot)
+        subfind_ids = np.asarray(subfind_ids)
+        if len(index) == 0:
+            return (np.zeros(subfind_ids.shape, dtype=np.int64),
+                    np.zeros(subfind_ids.shape, dtype=bool))
+        rows = np.minimum(np.searchsorted(index, subfind_ids), len(index)-1)
+        return rows, index[rows] == subfind_ids
+
+    def __contains__(self, key):
+        snapshot, subfind_id = key
+        return bool(self.locate(snapshot, subfind_id)[1])
+
+    def get_column(self, snapshot, key):
+        """
+        Full (nsubhalos, nsnaps[, dim]) column of one field at the given
+        snapshot, memory-mapped from the cache file when possible
+        """
+        if (snapshot, key) not in self._columns:
+            dset = self._file[f'Snapshots/{snapshot}/{key}']
+            offset = dset.id.get_offset()
+            if offset is None or dset.chunks is not None:
+                # not allocated (no subhalos) or not contiguous
+                column = dset[()]
+            else:
+                column = np.memmap(self.cachepath, mode='r', dtype=dset.dtype,
+                                   offset=offset, shape=dset.shape)
+            self._columns[(snapshot, key)] = column
+        return self._columns[(snapshot, key)]
+
+    def get_dense(self, snapshot, subfind_ids, key):
+        """
+        Dense (len(subfind_ids), nsnaps[, dim]) array of one field for
+        many subhalos, indexed by snapshot number
+        """
+        rows, present = self.locate(snapshot, subfind_ids)
+        if not np.all(present):
+            raise KeyError(f"Subhalos not in branch cache at snapshot {snapshot}")
+        return np.asarray(self.get_column(snapshot, key)[rows])
+
+    def get_branch(self, snapshot, subfind_id):
+        """
+        Full branch of one subhalo, in order of increasing SnapNum
+
+        Returns:
+        --------
+        branch: dict
+            {field: values at the snapshots where the branch exists}
+        """
+        rows, present = self.locate(snapshot, subfind_id)
+        if not present:
+            raise KeyError(f"Subhalo {subfind_id} not in branch cache at snapshot {snapshot}")
+        snaps = np.asarray(self.get_column(snapshot, 'SnapNum')[rows])
+        valid = snaps >= 0
+        branch = {}
+        for key in self.fields:
+            branch[key] = np.asarray(self.get_column(snapshot, key)[rows])[valid]
+        return branch
+
+    def get_past_future(self, snapshot, subfind_id):
+        """
+        Main (past) and future branches of one subhalo, ordered as in
+        TreeDB.get_main_branch and TreeDB.get_future_branch
+        """
+        branch = self.get_branch(snapshot, subfind_id)
+        past = branch['SnapNum'] <= snapshot
+        future = branch['SnapNum'] >= snapshot
+        pastbranch = _CachedBranch({key: val[past][::-1] for key, val in branch.items()})
+        futurebranch = _CachedBranch({key: val[future][::-1] for key, val in branch.items()})
+        return pastbranch, futurebranch
+
+    def close(self):
+        self._columns = {}
+        self._file.close()
+
+
+class LineageRegistry:
+
+    def __init__(self, tree, nsnaps=100, keysel=cache_fields, max_lineages=None):
+        """
+        Full branches read from the merger trees, stored once per lineage
+
+        Parameters:
+        -----------
+        tree: TreeDB
+            merger tree database
+        nsnaps: int
+            number of snapshots in the simulation
+        keysel: list of str
+            tree fields to keep; must include SnapNum
+        max_lineages: int or None
+            the registry is emptied before a request that could make it
+            hold more lineages than this (default: no limit); each lineage
+            takes nsnaps x (size of a row of keysel) bytes
+        """
+        self.tree = tree
+        self.nsnaps = nsnaps
+        self.keysel = list(keysel)
+        self.max_lineages = max_lineages
+        self.clear()
+
+    def clear(self):
+        """forgets all lineages"""
+        self._slot_of_key = {}
+        self._slot_of_subhalo = {}
+        self._columns = {}
+        self.nlineages = 0
+        self.nrequests = 0
+
+    def __len__(self):
+        return self.nlineages
+
+    def _store(self, dense):
+        """appends the dense branches of new lineages, returns their slots"""
+        nnew = len(dense['SnapNum'])
+        capacity = len(self._columns['SnapNum']) if self._columns else 0
+        if self.nlineages + nnew > capacity:
+            capacity = max(2*capacity, self.nlineages + nnew, 1024)
+            for key, val in dense.items():
+                column = np.full((capacity,) + val.shape[1:], _fill_value(val.dtype), dtype=val.dtype)
+                if key in self._columns:
+                    column[:self.nlineages] = self._columns[key][:self.nlineages]
+                self._columns[key] = column
+        slots = np.arange(self.nlineages, self.nlineages + nnew)
+        for key, val in dense.items():
+            self._columns[key][slots] = val
+        self.nlineages += nnew
+        return slots
+
+    def resolve(self, snapshot, subfind_ids):
+        """
+        Slot of the lineage of each subhalo (-1 if the subhalo is not in
+        the trees), reading the lineages that are not registered yet
+
+        Parameters:
+        -----------
+        snapshot: int
+            snapshot of the Subfind IDs
+        subfind_ids: array of int
+            Subfind IDs at that snapshot
+        """
+        subfind_ids = np.atleast_1d(np.asarray(subfind_ids, dtype=np.int64))
+        if (self.max_lineages is not None) and (self.nlineages + len(subfind_ids) > self.max_lineages):
+            self.clear()
+        self.nrequests += len(subfind_ids)
+        slots = np.array([self._slot_of_subhalo.get((snapshot, sub), -2) for sub in subfind_ids],
+                         dtype=np.int64)
+        unknown = np.flatnonzero(slots == -2)
+        if len(unknown) == 0:
+            return slots
+
+        # lineage keys of the subhalos not seen before
+        found, keys = self.tree.get_lineage_keys(snapshot, subfind_ids[unknown])
+        keys = [tuple(key) for key in keys.tolist()]
+        new = {}
+        for i, key, isfound in zip(unknown, keys, found):
+            if isfound and (key not in self._slot_of_key) and (key not in new):
+                new[key] = i
+
+        # one bulk read for all new lineages, from one subhalo of each
+        if len(new) > 0:
+            dense = dense_branches(self.tree, snapshot, subfind_ids[list(new.values())],
+                                   self.nsnaps, self.keysel)
+            for key, slot in zip(new.keys(), self._store(dense)):
+                self._slot_of_key[key] = slot
+
+        for i, key, isfound in zip(unknown, keys, found):
+            slots[i] = self._slot_of_key[key] if isfound else -1
+            self._slot_of_subhalo[(snapshot, subfind_ids[i])] = slots[i]
+        return slots
+
+    def get_dense(self, snapshot, subfind_ids, keysel=None):
+        """
+        Dense branches of many subhalos, as returned by dense_branches
+
+        Returns:
+        --------
+        dense: dict
+            {field: (len(subfind_ids), nsnaps[, dim]) array}, NaN (floats)
+            or -1 (integers) where the branch has no entry
+        """
+        keysel = self.keysel if keysel is None else keysel
+        slots = self.resolve(snapshot, subfind_ids)
+        dense = {}
+        for key in keysel:
+            column = self._columns[key] if self._columns else None
+            if column is None:
+                dset = self.tree._get_tree_file(0)[key]
+                dense[key] = np.full((len(slots), self.nsnaps) + dset.shape[1:],
+                                     _fill_value(dset.dtype), dtype=dset.dtype)
+                continue
+            dense[key] = column[np.maximum(slots, 0)]
+            dense[key][slots < 0] = _fill_value(column.dtype)
+        return dense
+
+    def get_branch(self, snapshot, subfind_id):
+        """
+        Full branch of one subhalo, in order of increasing SnapNum (as
+        BranchCache.get_branch)
+        """
+        slot = self.resolve(snapshot, subfind_id)[0]
+        if slot < 0:
+            raise KeyError(f"Subhalo {subfind_id} not found in the trees at snapshot {snapshot}")
+        valid = self._columns['SnapNum'][slot] >= 0
+        return {key: self._columns[key][slot][valid] for key in self.keysel}
@@ -0,0 +1,252 @@
+"""
+Builds pair catalogs from the FoF groups of a group catalog: in every
+group, the primary is the subhalo with the largest stellar mass and the
+secondary the one with the second largest.
+
+The subhalos of each group are the contiguous range
+[GroupFirstSub, GroupFirstSub + GroupNsubs), so the ranking by stellar
+mass is done for all groups at once by sorting those segments, instead
+of looping over the groups.
+
+Usage:
+------
+    cat = subfind_catalog(paths.tng_base, snapshot, lazy=True)
+    pairs = group_pairs(cat, stellar_mass, scale)
+    mask = pair_mask(pairs, "high", "major")
+    write_pairs(f"{paths.path_pairs}highmass_major_{snapshot}.hdf5",
+                pairs, mask, header)
+
+    -- NOTE:
+        - stellar_mass is the (nsubs,) stellar mass of every subhalo,
+            e.g. from AbundanceMatching, in 1e10 Msun
+        - the columns and units are those of the pairs/*.hdf5 files
+"""
+
+__date__   = "October 2026"
+
+import numpy as np
+import h5py
+
+from harvesting_tools.vector_correction import vectorCorrection as vector
+
+units_dict = {"Group ID":"Group Number in Subfind Catalogs",
+              "Group Mass":"Physical mass from Group_M_TopHat200 -- 1e10 Msun",
+              "Group Radius":"Physical radius from Group_R_TopHat200 -- kpc",
+              "Group Nsubs":"Number of subhalos in group",
+              "Sub1 ID":"Subhalo ID at current snapshot",
+              "Sub2 ID":"Subhalo ID at current snapshot",
+              "Sub1 Mass":"Subhalo mass at current snapshot -- 1e10 Msun",
+              "Sub2 Mass":"Subhalo mass at current snapshot -- 1e10 Msun",
+              "Sub1 Stellar Mass":"Stellar masses from abundance matching -- 1e10 Msun",
+              "Sub2 Stellar Mass":"Stellar masses from abundance matching -- 1e10 Msun",
+              "Sub1 Pos":"Subhalo physical position in box x,y,z -- kpc",
+              "Sub2 Pos":"Subhalo physical position in box x,y,z -- kpc",
+              "Sub1 Vel":"Subhalo velocity in vx, vy, vz -- km/s",
+              "Sub2 Vel":"Subhalo velocity in vx, vy, vz -- km/s",
+              "Sub1 MassType":"Mass of bound particles - gas, DM, empty, tracers, stars, BHs -- in 1e10 Msun",
+              "Sub2 MassType":"Mass of bound particles - gas, DM, empty, tracers, stars, BHs -- in 1e10 Msun",
+              "Separation":"Physical separation between primary and secondary in kpc",
+              "Comoving Separation":"Comoving separation between primary and secondary in ckpc",
+              "RelVel":"Relative velocity between primary and secondary in km/s",
+              "Stellar Mass Ratio":"Stellar mass ratio of secondary over primary",
+              "Realization":"Stellar mass realization (0-1000)",
+              "Sub1 BHMass":"Sum of the masses of all blackholes -- 1e10 Msun",
+              "Sub2 BHMass":"Sum of the masses of all blackholes -- 1e10 Msun",
+              "Sub1 BHMdot":"Instantaneous accretion rates of all blackholes -- 1e10 Msun / 0.978Gyr",
+              "Sub2 BHMdot":"Instantaneous accretion rates of all blackholes -- 1e10 Msun / 0.978Gyr",
+              "Sub1 SFR":"Sum of the individual SFRs of all gas cells in subhalo -- Msun / yr",
+              "Sub2 SFR":"Sum of the individual SFRs of all gas cells in subhalo -- Msun / yr",
+              "Sub1 SFRinRad":"Sum of SFRs of all gas cells within twice the stellar half mass radius -- Msun / yr",
+              "Sub2 SFRinRad":"Sum of SFRs of all gas cells within twice the stellar half mass radius -- Msun / yr",
+              "Sub1 GasMetallicity":"Mz/Mtot, where Z = any element above He within 2x stellar half mass radius -- unitless",
+              "Sub2 GasMetallicity":"Mz/Mtot, where Z = any element above He within 2x stellar half mass radius -- unitless",
+              "TripleFlag":"0 if no tertiary with mass ratio > 1:10 of secondary, 1 if large tertiary, 2 if other problem occurred"}
+
+
+def get_primmask(primstells, size):
+    """primary stellar mass cut of the low and high mass samples"""
+    if size == "low":
+        mask = (primstells > 0.01) & (primstells < 0.5)
+    elif size == "high":
+        mask = (primstells > 0.5) & (primstells < 10)
+    return mask
+
+
+def get_groupmask(groupmass, size):
+    """group mass cut of the low and high mass samples"""
+    if size == "low":
+        mask = (groupmass > 8) & (groupmass < 50)
+    elif size == "high":
+        mask = (groupmass > 100) & (groupmass < 650)
+    return mask
+
+
+def top_subhalos(first_sub, nsubs, mass, k=3):
+    """
+    The k subhalos with the largest mass in each group
+
+    Parameters:
+    -----------
+    first_sub, nsubs: arrays of int
+        GroupFirstSub and GroupNsubs of the groups
+    mass: (nsubs_total,) array
+        mass to rank the subhalos by
+    k: int
+        number of subhalos to keep per group
+
+    Returns:
+    --------
+    top: (ngroups, k) array of int
+        subhalo indices, by decreasing mass (ties: lower index first);
+        -1 where a group has fewer than k subhalos
+    """
+    first_sub = np.asarray(first_sub, dtype=np.int64)
+    nsubs = np.asarray(nsubs, dtype=np.int64)
+    ngroups = len(nsubs)
+    start = np.cumsum(nsubs) - nsubs
+
+    # every subhalo of every group, and its group
+    segment = np.repeat(np.arange(ngroups), nsubs)
+    sub = np.arange(nsubs.sum()) - start[segment] + first_sub[segment]
+
+    # sort by group, then by decreasing mass
+    order = np.lexsort((sub, -np.asarray(mass)[sub], segment))
+    sub, segment = sub[order], segment[order]
+    rank = np.arange(len(sub)) - start[segment]
+
+    top = np.full((ngroups, k), -1, dtype=np.int64)
+    keep = rank < k
+    top[segment[keep], rank[keep]] = sub[keep]
+    return top
+
+
+def group_pairs(cat, stellar_mass, scale, little_h=0.6774, groups=None,
+                tertiary_ratio=0.1, realization=-1):
+    """
+    Primary-secondary pair of every group with at least two subhalos
+
+    Parameters:
+    -----------
+    cat: subfind_catalog
+        group catalog of the snapshot (the datablocks used are read on
+        demand if the catalog is lazy)
+    stellar_mass: (nsubs,) array
+        stellar mass of every subhalo in 1e10 Msun
+    scale: float
+        scale factor of the snapshot
+    little_h: float
+        Hubble parameter
+    groups: array of int or None
+        group numbers to consider (default: all)
+    tertiary_ratio: float
+        TripleFlag is 1 if the third most massive subhalo has more than
+        this fraction of the stellar mass of the secondary
+    realization: int
+        stellar mass realization stored with the pairs (-1: median)
+
+    Returns:
+    --------
+    pairs: dict
+        the columns of a pairs/*.hdf5 file (without the Header)
+    """
+    if groups is None:
+        groups = np.arange(cat.ngroups)
+    groups = np.asarray(groups, dtype=np.int64)
+    groups = groups[cat.GroupNsubs[groups] >= 2]
+    stellar_mass = np.asarray(stellar_mass)
+
+    top = top_subhalos(cat.GroupFirstSub[groups], cat.GroupNsubs[groups], stellar_mass, k=3)
+    sub1, sub2, sub3 = top[:, 0], top[:, 1], top[:, 2]
+    stell1, stell2 = stellar_mass[sub1], stellar_mass[sub2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = stell2 / stell1
+    stell3 = np.where(sub3 >= 0, stellar_mass[np.maximum(sub3, 0)], 0)
+    triple = (stell3 > tertiary_ratio*stell2).astype(np.int64)
+    triple[~np.isfinite(ratio) | (stell1 <= 0)] = 2
+
+    # physical units
+    boxsize = cat.boxsize*scale/little_h
+    pos1 = cat.SubhaloPos[sub1].astype(np.float64)*scale/little_h
+    pos2 = cat.SubhaloPos[sub2].astype(np.float64)*scale/little_h
+    vel1 = cat.SubhaloVel[sub1].astype(np.float64)
+    vel2 = cat.SubhaloVel[sub2].astype(np.float64)
+    separation = np.linalg.norm(vector(pos1, pos2, boxsize), axis=1)
+
+    pairs = {"Group ID":groups.astype(np.int32),
+             "Group Mass":cat.Group_M_TopHat200[groups].astype(np.float64)/little_h,
+             "Group Radius":cat.Group_R_TopHat200[groups].astype(np.float64)*scale/little_h,
+             "Group Nsubs":cat.GroupNsubs[groups].astype(np.int64),
+             "Sub1 ID":sub1,
+             "Sub2 ID":sub2,
+             "Sub1 Mass":cat.SubhaloMass[sub1].astype(np.float64)/little_h,
+             "Sub2 Mass":cat.SubhaloMass[sub2].astype(np.float64)/little_h,
+             "Sub1 Stellar Mass":stell1.astype(np.float64),
+             "Sub2 Stellar Mass":stell2.astype(np.float64),
+             "Sub1 Pos":pos1,
+             "Sub2 Pos":pos2,
+             "Sub1 Vel":vel1,
+             "Sub2 Vel":vel2,
+             "Sub1 MassType":cat.SubhaloMassType[sub1].astype(np.float64)/little_h,
+             "Sub2 MassType":cat.SubhaloMassType[sub2].astype(np.float64)/little_h,
+             "Separation":separation,
+             "Comoving Separation":separation/scale,
+             "RelVel":np.linalg.norm(vel1 - vel2, axis=1),
+             "Stellar Mass Ratio":ratio.astype(np.float64),
+             "Realization":np.full(len(groups), realization, dtype=np.int64),
+             "Sub1 BHMass":cat.SubhaloBHMass[sub1].astype(np.float64)/little_h,
+             "Sub2 BHMass":cat.SubhaloBHMass[sub2].astype(np.float64)/little_h,
+             # (1e10 Msun/h) / (0.978 Gyr/h): no factor of h
+             "Sub1 BHMdot":cat.SubhaloBHMdot[sub1].astype(np.float64),
+             "Sub2 BHMdot":cat.SubhaloBHMdot[sub2].astype(np.float64),
+             "Sub1 SFR":cat.SubhaloSFR[sub1].astype(np.float64),
+             "Sub2 SFR":cat.SubhaloSFR[sub2].astype(np.float64),
+             "Sub1 SFRinRad":cat.SubhaloSFRinRad[sub1].astype(np.float64),
+             "Sub2 SFRinRad":cat.SubhaloSFRinRad[sub2].astype(np.float64),
+             "Sub1 GasMetallicity":cat.SubhaloGasMetallicity[sub1].astype(np.float64),
+             "Sub2 GasMetallicity":cat.SubhaloGasMetallicity[sub2].astype(np.float64),
+             "TripleFlag":triple}
+    return pairs
+
+
+def pair_mask(pairs, size, massratio):
+    """
+    Pairs of the low/high mass, major/minor samples: group mass and
+    primary stellar mass cuts of the size, and stellar mass ratio above
+    1/4 (major) or between 1/10 and 1/4 (minor)
+    """
+    group_mask = get_groupmask(pairs['Group Mass'], size)
+    primary_mask = get_primmask(pairs['Sub1 Stellar Mass'], size)
+    major_mask = (pairs['Sub2 Stellar Mass']/pairs['Sub1 Stellar Mass'] > 1/4)
+    minor_mask = (pairs['Sub2 Stellar Mass']/pairs['Sub1 Stellar Mass'] > 1/10) & ~major_mask
+    if massratio == "major":
+        return group_mask & primary_mask & major_mask
+    elif massratio == "minor":
+        return group_mask & primary_mask & minor_mask
+
+
+def write_pairs(path, pairs, mask, header_dict):
+    """
+    Saves the selected pairs in the format of the pairs/*.hdf5 files
+
+    Parameters:
+    -----------
+    pairs: dict
+        output of group_pairs
+    mask: array of bool
+        pairs to save (e.g. from pair_mask)
+    header_dict: dict
+        attributes of /Header (Details, Snapshot, Scale, Redshift, Simulation)
+    """
+    f = h5py.File(path, 'w')
+    dset = f.create_group('/Header')
+    for key in header_dict.keys():
+        dset.attrs[key] = header_dict[key]
+
+    for key, val in pairs.items():
+        val = np.array(val)[mask]
+        dset = f.create_dataset(f'/{key}',
+                                shape=val.shape,
+                                dtype=val.dtype)
+        dset.attrs[key] = units_dict[key]
+        dset[:] = val
+    f.close()
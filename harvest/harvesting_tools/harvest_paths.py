@@ -5,6 +5,10 @@ Collection of all paths used in analysis
 __author__ = "Katie Chamberlain"
 __date__   = "September 2021 - May 2024"
 
+import os
+
+from harvesting_tools.sim_manifest import SimManifest, manifest_path, register
+
 class SetupPaths:
 
     def __init__(
@@ -27,9 +31,24 @@ class SetupPaths:
         self.path_orbits = self.path_data + "orbits/"
         self.path_misc = self.path_data + "misc/"
 
-    def tng(self, tng_path):
+    def tng(self, tng_path, manifest=None):
+        """
+        manifest: path of the file manifest of the simulation (see
+            sim_manifest), None for data/misc/manifest_<simulation>.json
+            if it exists, or False to not use one. A loaded manifest is
+            kept as self.tng_manifest and used by the readers.
+        """
         self.tng_base = tng_path
         self.tng_trees = self.tng_base + "postprocessing/"
+
+        self.tng_manifest = None
+        if manifest is None:
+            manifest = manifest_path(self.path_misc, self.tng_base)
+            if not os.path.exists(manifest):
+                manifest = False
+        if manifest is not False:
+            self.tng_manifest = SimManifest.load(manifest)
+            register(self.tng_manifest)
         # self.tng_trees = self.tng_base + "postprocessing/"
 
         # # directories for illustris data
@@ -33,6 +33,7 @@
 #
 # Mark Vogelsberger (mvogelsb@cfa.harvard.edu)
 import sys
+import harvesting_tools.io_stats as io_stats
 # import hdf5lib_param # KC removed in 2024 and just set hdf5libname to h5py
 
 #try:
@@ -60,7 +61,7 @@ def OpenFile(fname, mode = "r"):
         if use_tables:
                 return tables.openFile(fname, mode = mode)
         else:
-                return h5py.File(fname, mode)
+                return io_stats.open_file(fname, mode)
 
 def GetData(f, dname):
         if use_tables:
@@ -78,7 +79,7 @@ def GetAttr(f, gname, aname):
         if use_tables:
                 return f.root._f_getChild(gname)._f_getAttr(aname)
         else:
-                return f[gname].attrs[aname]
+                return io_stats.read_attr(f[gname], aname)
 
 
 def Contains(f, gname, cname):
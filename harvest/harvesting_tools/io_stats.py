@@ -0,0 +1,209 @@
+"""
+Opt-in instrumentation of the HDF5 reads of the tree and group catalog
+readers (readtreeHDF5_public, readsubfHDF5_Py3, hdf5lib_Py3): number of
+reads, bytes read and time spent per kind of read, and the files opened.
+
+The readers go through read, read_direct, read_selection and open_file
+of this module. While no IOStats is being tracked these only check an
+empty list before doing the plain h5py call.
+
+Kinds of reads:
+    tree      rows of the tree_extended.N.hdf5 files
+    offsets   offsets_NNN.hdf5 (SubLink offsets and FileOffsets)
+    catalog   datablocks of the fof_subhalo_tab chunks
+    attr      header attributes (through hdf5lib_Py3.GetAttr)
+    open      files opened
+    catalog_chunk
+              one chunk read by subfind_catalog, from open to close (a
+              span: its time includes the reads and opens inside it)
+
+Usage:
+------
+    with io_stats.track() as stats:
+        TraceMergerTree(paths.tng_trees, 99, 0)
+    print(stats.report())
+
+To keep every read for a timeline:
+    with io_stats.track(events=True) as stats:
+        cat = subfind_catalog(basedir, 99, keysel=None, nworkers=4)
+    stats.to_json("catalog_io.json")
+    stats.to_chrome_trace("catalog_io.trace.json")
+    -- NOTE:
+        - the trace opens in chrome://tracing or https://ui.perfetto.dev,
+            one row per thread
+        - reads in threads are recorded; reads in worker processes
+            (subfind_catalog(use_processes=True), orbit_pool) are not
+        - trackers can be nested: every active tracker records every read
+        - spans contain reads, so their time is not added to the reads
+"""
+
+__date__   = "October 2026"
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+import h5py
+
+# active trackers; reads are only timed while this is not empty
+_trackers = []
+_lock = threading.Lock()
+
+
+class IOStats:
+    def __init__(self, events=False):
+        """
+        Counts, bytes and wall time of the reads made while tracked
+
+        Parameters:
+        -----------
+        events: bool
+            also keep every read and open (needed for to_chrome_trace)
+        """
+        self.totals = {}
+        self.files = {}
+        self.events = [] if events else None
+        self._origin = time.perf_counter()
+        self.elapsed = 0.
+
+    def record(self, kind, nbytes, start, end, path=None, span=False):
+        """adds one read (or open, or span) of nbytes between start and end"""
+        with _lock:
+            total = self.totals.setdefault(kind, {"count": 0, "bytes": 0, "seconds": 0.})
+            total["count"] += 1
+            total["bytes"] += int(nbytes)
+            total["seconds"] += end - start
+            if path is not None:
+                perfile = self.files.setdefault(path, {"opens": 0, "reads": 0, "bytes": 0})
+                if kind == "open":
+                    perfile["opens"] += 1
+                elif not span:
+                    perfile["reads"] += 1
+                    perfile["bytes"] += int(nbytes)
+            if self.events is not None:
+                self.events.append((kind, start - self._origin, end - start, int(nbytes),
+                                    path, threading.get_ident()))
+
+    def summary(self):
+        """totals per kind, per file, and the tracked wall time, as a dict"""
+        return {"elapsed": self.elapsed, "totals": self.totals, "files": self.files}
+
+    def report(self):
+        """totals per kind as a table"""
+        lines = [f"{'kind':>14s} {'count':>9s} {'MB':>10s} {'seconds':>9s}"]
+        for kind, total in sorted(self.totals.items()):
+            lines.append(f"{kind:>14s} {total['count']:9d} {total['bytes']/2**20:10.3f} "
+                         f"{total['seconds']:9.4f}")
+        lines.append(f"{len(self.files)} files, {self.elapsed:.4f} s tracked")
+        return "\n".join(lines)
+
+    def to_json(self, path):
+        """writes summary() (and the events, if kept) to a json file"""
+        out = self.summary()
+        if self.events is not None:
+            out["events"] = [{"kind": kind, "start": start, "duration": duration,
+                              "bytes": nbytes, "file": fname, "thread": tid}
+                             for kind, start, duration, nbytes, fname, tid in self.events]
+        with open(path, "w") as f:
+            json.dump(out, f, indent=1)
+
+    def to_chrome_trace(self, path):
+        """writes the events in the Chrome trace event format"""
+        if self.events is None:
+            raise ValueError("IOStats was created without events=True")
+        pid = os.getpid()
+        trace = [{"name": kind if fname is None else f"{kind} {os.path.basename(fname)}",
+                  "cat": kind, "ph": "X", "ts": start*1e6, "dur": duration*1e6,
+                  "pid": pid, "tid": tid, "args": {"bytes": nbytes, "file": fname}}
+                 for kind, start, duration, nbytes, fname, tid in self.events]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+
+
+@contextmanager
+def track(events=False):
+    """
+    Records the reads made inside the with block into a new IOStats
+    """
+    stats = IOStats(events)
+    with _lock:
+        _trackers.append(stats)
+    start = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        stats.elapsed = time.perf_counter() - start
+        with _lock:
+            _trackers.remove(stats)
+
+
+def _record(kind, nbytes, start, end, path, span=False):
+    for stats in list(_trackers):
+        stats.record(kind, nbytes, start, end, path, span)
+
+
+def _filename(obj):
+    return obj.file.filename if isinstance(obj, (h5py.Dataset, h5py.Group)) else None
+
+
+def read(dset, sel, kind):
+    """dset[sel], recorded as a read of the given kind if dset is an HDF5 dataset"""
+    if not _trackers or not isinstance(dset, h5py.Dataset):
+        return dset[sel]
+    start = time.perf_counter()
+    out = dset[sel]
+    _record(kind, getattr(out, "nbytes", 0), start, time.perf_counter(), _filename(dset))
+    return out
+
+
+def read_direct(dset, dest, dest_sel, kind):
+    """dset.read_direct(dest, dest_sel=dest_sel), recorded as a read"""
+    if not _trackers:
+        return dset.read_direct(dest, dest_sel=dest_sel)
+    start = time.perf_counter()
+    dset.read_direct(dest, dest_sel=dest_sel)
+    _record(kind, dest[dest_sel].nbytes, start, time.perf_counter(), _filename(dset))
+
+
+def read_selection(dset, mspace, fspace, buf, kind):
+    """low level dset.id.read of a file space selection into buf, recorded as a read"""
+    if not _trackers:
+        return dset.id.read(mspace, fspace, buf)
+    start = time.perf_counter()
+    dset.id.read(mspace, fspace, buf)
+    _record(kind, buf.nbytes, start, time.perf_counter(), _filename(dset))
+
+
+def read_attr(obj, aname, kind="attr"):
+    """obj.attrs[aname], recorded as a read"""
+    if not _trackers:
+        return obj.attrs[aname]
+    start = time.perf_counter()
+    out = obj.attrs[aname]
+    _record(kind, getattr(out, "nbytes", 0), start, time.perf_counter(), _filename(obj))
+    return out
+
+
+def open_file(path, mode="r", **kwargs):
+    """h5py.File(path, mode, **kwargs), recorded as an open"""
+    if not _trackers:
+        return h5py.File(path, mode, **kwargs)
+    start = time.perf_counter()
+    f = h5py.File(path, mode, **kwargs)
+    _record("open", 0, start, time.perf_counter(), f.filename)
+    return f
+
+
+@contextmanager
+def span(kind, path=None):
+    """records the wall time of the with block (e.g. one catalog chunk)"""
+    if not _trackers:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(kind, 0, start, time.perf_counter(), path, span=True)
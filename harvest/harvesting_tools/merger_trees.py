@@ -1,5 +1,6 @@
 import numpy as np
 from harvesting_tools.readtreeHDF5_public import TreeDB
+from harvesting_tools.branch_cache import BranchCache
 
 
 class TraceMergerTree:
@@ -8,7 +9,8 @@ class TraceMergerTree:
         self, 
         treepath,
         snapshot,
-        subfindID
+        subfindID,
+        cache=None
         ):
         """
         Identifies and pulls merger tree for a single subhalo
@@ -19,24 +21,32 @@ class TraceMergerTree:
             the number of the snapshot with the corresponding subhalo ID
         subfindID: int
             the ID number of the subhalo at the corresponding snapshot
+        cache: BranchCache, str or None
+            branch cache (or path to one) made by branch_cache.build_branch_cache;
+            if the subhalo is in the cache, its branch is read from there
+            instead of the merger trees (only the cached fields are available)
         """
         self.snapshot = snapshot
         self.subfindID = subfindID
 
         self.treeDirectory = treepath
 
-        tree = TreeDB(self.treeDirectory)
-        pastbranch = tree.get_main_branch( 
-            self.snapshot, 
-            self.subfindID
-            # keysel=['SnapNum', 'SubhaloMass', 'SubhaloPos', 'SubhaloVel', 'SubhaloID', 'SubfindID']
-            )
-        futurebranch = tree.get_future_branch(
-                               self.snapshot,
-                               self.subfindID)
+        if isinstance(cache, str):
+            cache = BranchCache(cache)
 
-        self.pastbranch = pastbranch
-        self.futurebranch = futurebranch
+        if (cache is not None) and ((self.snapshot, self.subfindID) in cache):
+            self.pastbranch, self.futurebranch = cache.get_past_future(
+                self.snapshot, self.subfindID)
+        else:
+            tree = TreeDB(self.treeDirectory)
+            self.pastbranch = tree.get_main_branch( 
+                self.snapshot, 
+                self.subfindID
+                # keysel=['SnapNum', 'SubhaloMass', 'SubhaloPos', 'SubhaloVel', 'SubhaloID', 'SubfindID']
+                )
+            self.futurebranch = tree.get_future_branch(
+                                   self.snapshot,
+                                   self.subfindID)
         
         self.pastkeys = np.array(list(self.pastbranch.__dict__.keys()))
         self.futurekeys = np.array(list(self.futurebranch.__dict__.keys()))
@@ -0,0 +1,396 @@
+"""
+Process-pool driver for the orbit collection.
+
+Every (snapshot, mass, ratio) pair catalog is cut into fixed-size chunks
+of pairs, and the chunks are handed out to a pool of worker processes,
+a couple of catalogs at a time (the next catalog is submitted once the
+oldest one is written, so the parent does not hold the pairs and orbits
+of every catalog at once). Each worker opens the merger trees (or a branch cache)
+once and keeps the handles open for all the chunks it processes. The
+chunks of each catalog are merged in order and written to the same
+orbits/*.hdf5 file as pull_orbitdata-collection.py would write.
+
+The chunk boundaries only depend on the number of pairs and chunksize,
+not on the number of workers, so the output does not depend on how the
+work was scheduled.
+
+Usage:
+------
+From the command line (e.g. on a 64-core node, or a laptop with the
+sample data in data/):
+    python -m harvesting_tools.orbit_pool <path-to-harvest> <path-to-tng> \
+        --snapshots 50 99 --samples high-major high-minor --workers 64
+
+From python:
+    paths = SetupPaths(path_to_harvest)
+    paths.tng(path_to_tng)
+    jobs = [(99, "high", "major"), (99, "low", "minor")]
+    written = run_orbit_pool(paths, jobs, workers=4)
+
+    -- NOTE:
+        - existing orbit files are skipped unless overwrite=True
+        - a branch cache (branch_cache.build_branch_cache) can be used
+            instead of the trees with cachepath=...
+        - with lineages=True (--lineages), each worker reads the branch of
+            every lineage once and reuses it for the same subhalos at other
+            snapshots (branch_cache.LineageRegistry)
+        - with prefetch=N (--prefetch N), each worker reads the branches of
+            the next N sub-chunks of its task in a background thread while
+            it collects the orbits of the current one (orbits.build_orbits)
+
+Incremental builds (incremental=True, or --incremental):
+    Every finished chunk is written to
+    orbits/checkpoints/<mass>mass_<ratio>_<snap>/<hash>.hdf5, where hash
+    identifies the pairs of the chunk and the build settings, and recorded
+    in state.json in the same directory. A restarted build only computes
+    the chunks that are missing, and the orbit file is assembled from the
+    checkpoints once all its chunks are done. If a pair file changes (size
+    or modification time), only the chunks whose pairs changed are
+    recomputed; orbit files whose pair file did not change are skipped.
+    -- NOTE:
+        - existing orbit files without checkpoints (written without
+            incremental=True) are skipped, as in other builds, unless
+            overwrite=True
+        - the checkpoints are kept after the orbit file is written, so that
+            a changed pair file costs only the changed chunks; they can be
+            deleted to save space
+"""
+
+__date__   = "October 2026"
+
+import os
+import json
+import hashlib
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import h5py
+
+from harvesting_tools.harvest_paths import SetupPaths
+from harvesting_tools.readtreeHDF5_public import TreeDB
+from harvesting_tools.branch_cache import BranchCache, LineageRegistry
+from harvesting_tools.orbits import build_orbits, write_orbits, merge_chunks
+
+samples = [("high", "major"), ("high", "minor"), ("low", "major"), ("low", "minor")]
+
+# pair catalogs submitted to the pool at a time (see run_orbit_pool)
+max_pending_jobs = 2
+
+# per-process state, set up once by _init_worker
+_worker = {}
+
+
+def pair_chunks(npairs, chunksize):
+    """
+    (lo, hi) row ranges that split a pair catalog into chunks of at most
+    chunksize pairs; an empty catalog gives a single empty chunk
+    """
+    if npairs == 0:
+        return [(0, 0)]
+    return [(lo, min(lo+chunksize, npairs)) for lo in range(0, npairs, chunksize)]
+
+
+def read_pairs(paths, snapshot, masstype, pairtype):
+    """pair catalog pairs/<mass>mass_<ratio>_<snapshot>.hdf5 as a dict"""
+    f = h5py.File(f"{paths.path_pairs}{masstype}mass_{pairtype}_{snapshot}.hdf5", 'r')
+    pairs = {}
+    for key, val in f.items():
+        if key != "Header":
+            pairs[key] = np.array(val)
+    f.close()
+    return pairs
+
+
+def read_snapdata(paths):
+    """snapshot information from misc/snapshot_data.hdf5 as a dict"""
+    f = h5py.File(f"{paths.path_misc}snapshot_data.hdf5", 'r')
+    snapdata = {key: np.array(val) for key, val in f.items()}
+    f.close()
+    return snapdata
+
+
+def file_signature(path):
+    """size and modification time of a file, to detect changed inputs"""
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def chunk_hash(chunk, config):
+    """
+    Hash of the pairs of a chunk and of the build settings: a checkpoint
+    with the same hash has the orbits of the same pairs
+    """
+    digest = hashlib.sha1(json.dumps(config, sort_keys=True).encode("utf-8"))
+    for key in sorted(chunk.keys()):
+        val = np.ascontiguousarray(chunk[key])
+        digest.update(key.encode("utf-8"))
+        digest.update(str((val.dtype.str, val.shape)).encode("utf-8"))
+        digest.update(val.tobytes())
+    return digest.hexdigest()
+
+
+def read_state(checkdir):
+    """build state of an incremental build (empty if there is none)"""
+    path = os.path.join(checkdir, "state.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_state(checkdir, state):
+    """saves the build state, replacing the old one only once it is complete"""
+    path = os.path.join(checkdir, "state.json")
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(state, f, indent=1)
+    os.replace(f"{path}.tmp", path)
+
+
+def read_collection(path):
+    """orbit collection of an orbits/*.hdf5 file (or checkpoint) as a dict"""
+    f = h5py.File(path, 'r')
+    collection = {key: np.array(val) for key, val in f.items()}
+    f.close()
+    collection["PairKey"] = list(collection["PairKey"])
+    return collection
+
+
+def write_atomic(path, collection):
+    """write_orbits to a temporary file that replaces path when complete"""
+    tmppath = f"{path}.tmp"
+    write_orbits(tmppath, collection)
+    os.replace(tmppath, path)
+
+
+def _init_worker(treepath, cachepath, snapdata, boxsize, little_h, lineages=False,
+                 prefetch=0):
+    """
+    opens the trees (or branch cache) once per worker process; with
+    lineages=True, the branches read from the trees are kept in a
+    LineageRegistry for all the chunks of the worker
+    """
+    if cachepath is not None:
+        _worker['source'] = BranchCache(cachepath)
+    elif lineages:
+        _worker['source'] = LineageRegistry(TreeDB(treepath), nsnaps=len(snapdata['Snapshot']))
+    else:
+        _worker['source'] = TreeDB(treepath)
+    _worker['snapdata'] = snapdata
+    _worker['boxsize'] = boxsize
+    _worker['little_h'] = little_h
+    _worker['prefetch'] = prefetch
+
+
+def _collect_chunk(snapshot, pairs):
+    """orbit collection of one chunk of pairs, run in a worker process"""
+    return build_orbits(_worker['source'], pairs, snapshot, _worker['snapdata'],
+                        _worker['boxsize'], _worker['little_h'], prefetch=_worker['prefetch'])
+
+
+def run_orbit_pool(paths, jobs, workers=None, chunksize=2000, cachepath=None,
+                   overwrite=False, boxsize=75000, little_h=0.6774, incremental=False,
+                   lineages=False, prefetch=0):
+    """
+    Collects the orbits of several pair catalogs with a pool of worker
+    processes and writes one orbits/*.hdf5 file per catalog
+
+    Parameters:
+    -----------
+    paths: SetupPaths
+        paths of the harvest data, with paths.tng(...) set up
+    jobs: list of tuples
+        (snapshot, masstype, pairtype) of each pair catalog, e.g. (50, "high", "major")
+    workers: int or None
+        number of worker processes (default: os.cpu_count())
+    chunksize: int
+        number of pairs per task
+    cachepath: str or None
+        branch cache to read the branches from instead of the trees
+    overwrite: bool
+        recompute orbit files that already exist (with incremental=True:
+        reassemble them, recomputing only stale chunks)
+    incremental: bool
+        checkpoint every chunk and resume from the checkpoints (see the
+        module docstring)
+    lineages: bool
+        read each lineage from the trees once per worker, for pairs that
+        appear in several catalogs (see branch_cache.LineageRegistry)
+    prefetch: int
+        number of sub-chunks of each task whose branches are read ahead in
+        a background thread of the worker, while the orbits of the current
+        sub-chunk are collected (see orbits.build_orbits)
+
+    Returns:
+    --------
+    written: list of str
+        orbit files written, in the order of jobs
+    """
+    snapdata = read_snapdata(paths)
+    treepath = getattr(paths, "tng_trees", None)
+    if (treepath is None) and (cachepath is None):
+        raise ValueError("No merger trees or branch cache given. Call paths.tng(...) or pass cachepath.")
+
+    written = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(treepath, cachepath, snapdata,
+                                       boxsize, little_h, lineages, prefetch)) as pool:
+        if incremental:
+            config = {"chunksize": chunksize, "boxsize": boxsize, "little_h": little_h,
+                      "source": cachepath if cachepath is not None else treepath}
+            return _run_incremental(pool, paths, jobs, chunksize, config, overwrite)
+
+        # the catalogs are submitted in a window: the next one only once the
+        # oldest is written, keeping max_pending_jobs catalogs in flight (more
+        # only while their chunks cannot keep every worker busy), so that
+        # the parent holds the pairs and orbits of a few catalogs, not of
+        # the whole run; the files are written in the order of jobs
+        nworkers = workers if workers is not None else os.cpu_count()
+        todo = iter(jobs)
+        pending = deque()
+        npending = 0
+        while True:
+            while len(pending) < max_pending_jobs or npending < nworkers:
+                job = next(todo, None)
+                if job is None:
+                    break
+                submitted = _submit_job(pool, paths, job, chunksize, overwrite)
+                if submitted is not None:
+                    pending.append(submitted)
+                    npending += len(submitted[1])
+            if not pending:
+                break
+            outpath, futures = pending.popleft()
+            npending -= len(futures)
+            collection = merge_chunks([future.result() for future in futures])
+            del futures
+            write_orbits(outpath, collection)
+            written.append(outpath)
+            print(f"wrote {outpath} ({len(collection['PairKey'])} pairs)")
+    return written
+
+
+def _submit_job(pool, paths, job, chunksize, overwrite):
+    """
+    submits the chunks of one pair catalog; returns the orbit file and
+    the futures of its chunks, or None if the orbit file already exists
+    """
+    snapshot, masstype, pairtype = job
+    outpath = f"{paths.path_orbits}{masstype}mass_{pairtype}_{snapshot}.hdf5"
+    if os.path.exists(outpath) and not overwrite:
+        print(f"{outpath} already exists")
+        return None
+    pairs = read_pairs(paths, snapshot, masstype, pairtype)
+    futures = []
+    for lo, hi in pair_chunks(len(pairs['Sub1 ID']), chunksize):
+        chunk = {key: val[lo:hi] for key, val in pairs.items()}
+        futures.append(pool.submit(_collect_chunk, snapshot, chunk))
+    return outpath, futures
+
+
+def _run_incremental(pool, paths, jobs, chunksize, config, overwrite):
+    """
+    run_orbit_pool with checkpoints: submits the chunks that have no
+    checkpoint, writes each chunk as it finishes, and assembles every
+    orbit file as soon as all of its chunks are done
+    """
+    builds = []
+    pending = {}
+    for snapshot, masstype, pairtype in jobs:
+        name = f"{masstype}mass_{pairtype}_{snapshot}"
+        outpath = f"{paths.path_orbits}{name}.hdf5"
+        pairpath = f"{paths.path_pairs}{name}.hdf5"
+        checkdir = f"{paths.path_orbits}checkpoints/{name}/"
+        state = read_state(checkdir)
+        # orbit files written without checkpoints (by a build without
+        # incremental=True, or by pull_orbitdata-collection.py)
+        if os.path.exists(outpath) and not overwrite and not state:
+            print(f"{outpath} already exists")
+            continue
+        os.makedirs(checkdir, exist_ok=True)
+        signature = file_signature(pairpath)
+        if (os.path.exists(outpath) and not overwrite and state.get("complete")
+                and state.get("input") == signature and state.get("config") == config):
+            print(f"{outpath} is up to date")
+            continue
+
+        pairs = read_pairs(paths, snapshot, masstype, pairtype)
+        chunks = [{key: val[lo:hi] for key, val in pairs.items()}
+                  for lo, hi in pair_chunks(len(pairs['Sub1 ID']), chunksize)]
+        hashes = [chunk_hash(chunk, config) for chunk in chunks]
+        state = {"input": signature, "config": config, "chunks": hashes,
+                 "done": [h for h in hashes if os.path.exists(f"{checkdir}{h}.hdf5")],
+                 "complete": False}
+        write_state(checkdir, state)
+
+        build = {"outpath": outpath, "checkdir": checkdir, "state": state, "remaining": 0}
+        builds.append(build)
+        for chunk, h in zip(chunks, hashes):
+            if h not in state["done"]:
+                pending[pool.submit(_collect_chunk, snapshot, chunk)] = (build, h)
+                build["remaining"] += 1
+        print(f"{outpath}: {len(hashes) - build['remaining']} of {len(hashes)} chunks already done")
+
+    written = []
+    for build in builds:
+        if build["remaining"] == 0:
+            written.append(_assemble(build))
+    for future in as_completed(pending):
+        build, h = pending[future]
+        write_atomic(f"{build['checkdir']}{h}.hdf5", future.result())
+        build["state"]["done"].append(h)
+        write_state(build["checkdir"], build["state"])
+        build["remaining"] -= 1
+        if build["remaining"] == 0:
+            written.append(_assemble(build))
+    return [build["outpath"] for build in builds if build["outpath"] in written]
+
+
+def _assemble(build):
+    """writes an orbit file from its checkpoints and drops stale checkpoints"""
+    state, checkdir = build["state"], build["checkdir"]
+    collection = merge_chunks([read_collection(f"{checkdir}{h}.hdf5") for h in state["chunks"]])
+    write_atomic(build["outpath"], collection)
+    state["complete"] = True
+    write_state(checkdir, state)
+    for filename in os.listdir(checkdir):
+        stale = filename.endswith(".hdf5") and filename[:-5] not in state["chunks"]
+        if stale or filename.endswith(".hdf5.tmp"):
+            os.remove(os.path.join(checkdir, filename))
+    print(f"wrote {build['outpath']} ({len(collection['PairKey'])} pairs)")
+    return build["outpath"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collect the orbits of pair catalogs in parallel")
+    parser.add_argument("harvest", help="path to the harvest base directory")
+    parser.add_argument("tng", help="path to the TNG simulation directory (with postprocessing/)")
+    parser.add_argument("--snapshots", type=int, nargs="+", default=list(range(100)))
+    parser.add_argument("--samples", nargs="+", default=[f"{m}-{r}" for m, r in samples],
+                        help="mass-ratio samples, e.g. high-major low-minor")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: all cores)")
+    parser.add_argument("--chunksize", type=int, default=2000, help="pairs per task")
+    parser.add_argument("--cache", default=None, help="branch cache file to use instead of the trees")
+    parser.add_argument("--overwrite", action="store_true")
+    parser.add_argument("--incremental", action="store_true",
+                        help="checkpoint every chunk and resume from the checkpoints")
+    parser.add_argument("--lineages", action="store_true",
+                        help="read each subhalo lineage from the trees once per worker")
+    parser.add_argument("--prefetch", type=int, default=0,
+                        help="sub-chunks of pairs read ahead while orbits are collected")
+    args = parser.parse_args()
+
+    paths = SetupPaths(args.harvest)
+    paths.tng(args.tng)
+    jobs = []
+    for snapshot in args.snapshots:
+        for sample in args.samples:
+            masstype, pairtype = sample.split("-")
+            if os.path.exists(f"{paths.path_pairs}{masstype}mass_{pairtype}_{snapshot}.hdf5"):
+                jobs.append((snapshot, masstype, pairtype))
+    run_orbit_pool(paths, jobs, workers=args.workers, chunksize=args.chunksize,
+                   cachepath=args.cache, overwrite=args.overwrite,
+                   incremental=args.incremental, lineages=args.lineages,
+                   prefetch=args.prefetch)
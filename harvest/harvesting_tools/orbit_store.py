@@ -0,0 +1,410 @@
+"""
+Consolidated store of the orbit collections of all snapshots, one group
+per mass-ratio sample, with lazy access by pair and snapshot.
+
+The orbits/<mass>mass_<ratio>_<snap>.hdf5 files store every trajectory
+as a dense (npairs, 100) array that is empty (NaN or 0) at the snapshots
+where the pair does not exist. The store compresses every dataset (lzf +
+shuffle, chunked along the pairs), and keeps the trajectories of each
+sample in one of two layouts, chosen from the fraction of the dense
+elements where the pairs exist (the occupancy):
+    dense   (npairs, nsnaps[, 3]) as in the orbit files, in chunks of
+            (dense_chunk, nsnaps[, 3]); used when the occupancy is at
+            least dense_occupancy, as in the TNG samples (~97%), where
+            dropping the empty elements saves little and scattering the
+            values back into dense arrays costs more than the read
+    ragged  for each pair, only the snapshots between the first and last
+            snapshot where both subhalos exist, concatenated for all
+            pairs (with offsets); used for sparse samples
+
+File layout:
+------------
+/Header                        attrs: NumSnaps, Float32
+/Snapshots/<key>               Redshift, Scale, Snapshot of snapdata
+/<mass>mass_<ratio>            attrs: Layout (dense or ragged)
+/<mass>mass_<ratio>/<key>      (npairs,) per-pair datasets of the orbit
+                               files, plus CatalogSnapshot (snapshot of
+                               the pair catalog the pair comes from)
+/<mass>mass_<ratio>/First      first snapshot of the stored range
+/<mass>mass_<ratio>/Count      number of snapshots in the stored range
+/<mass>mass_<ratio>/Offset     (npairs+1,) offsets into the ragged arrays
+                               (ragged layout only)
+/<mass>mass_<ratio>/<key>      (npairs, nsnaps[, 3]) dense or (ntotal[, 3])
+                               ragged trajectory datasets,
+                               attrs: Fill (value outside the range)
+
+Usage:
+------
+To build the store from the orbit files:
+    build_orbit_store(paths, f"{paths.path_orbits}orbit_store.hdf5",
+                      snapshots=range(100), float32=True)
+
+To read:
+    store = OrbitStore(f"{paths.path_orbits}orbit_store.hdf5")
+    sample = store["highmass_major"]
+    seps = sample.get("Separations", pairs=slice(0, 1000), snapshots=slice(50, 100))
+    keys = sample["PairKey"]
+    -- NOTE:
+        - get returns dense (npairs, nsnapshots[, 3]) arrays as in the orbit
+            files, filled outside the stored range, in either layout; only
+            the rows of the selected pairs are read
+        - layout="dense" or "ragged" in build_orbit_store forces a layout
+            (default: from the occupancy of each sample)
+        - float32=True stores the trajectories in single precision (the
+            positions and velocities are single precision in the trees)
+        - sample.load() reads everything back into a dict in the format of
+            build_orbits
+"""
+
+__date__   = "October 2026"
+
+import os
+
+import numpy as np
+import h5py
+
+from harvesting_tools.orbits import info_dict
+
+# per-snapshot datasets of the orbit files, and their value where the pair
+# does not exist
+trajectory_fill = {"GroupFlag": False,
+                   "GroupRvir": 0.,
+                   "Separations": np.nan,
+                   "SeparationsComoving": np.nan,
+                   "SeparationsScaled": np.nan,
+                   "RelativeVelocity": np.nan,
+                   "SubhaloPos1": 0.,
+                   "SubhaloPos2": 0.,
+                   "SubhaloVel1": 0.,
+                   "SubhaloVel2": 0.}
+
+snapshot_keys = ["Redshift", "Scale", "Snapshot"]
+
+store_info = {"CatalogSnapshot":"Snapshot of the pair catalog the pair was selected at",
+              "First":"First snapshot of the stored trajectory",
+              "Count":"Number of snapshots of the stored trajectory",
+              "Offset":"Offset of the trajectory of each pair in the ragged datasets"}
+
+# rows per chunk along the pair axis, pairs per chunk of the dense
+# trajectories, and elements per ragged chunk
+pair_chunk = 4096
+dense_chunk = 1024
+ragged_chunk = 65536
+
+# occupancy from which the trajectories of a sample are stored dense
+dense_occupancy = 0.5
+
+
+def stored_range(collection):
+    """
+    First snapshot and number of snapshots from the first to the last
+    snapshot where both subhalos of each pair exist (0 snapshots if never)
+    """
+    exists = ~np.isnan(np.asarray(collection["SeparationsComoving"]))
+    nsnaps = exists.shape[1]
+    any_exists = exists.any(axis=1)
+    first = np.where(any_exists, np.argmax(exists, axis=1), 0)
+    last = np.where(any_exists, nsnaps - 1 - np.argmax(exists[:, ::-1], axis=1), -1)
+    return first.astype(np.int32), (last - first + 1).clip(0).astype(np.int32)
+
+
+def _ragged(dense, first, count):
+    """the values of dense[p, first[p]:first[p]+count[p]] of all pairs, concatenated"""
+    pair = np.repeat(np.arange(len(first)), count)
+    snap = np.repeat(first, count) + (np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count))
+    return dense[pair, snap]
+
+
+def _append(group, key, val, chunk):
+    """appends val along the first axis of a resizable dataset"""
+    if key not in group:
+        group.create_dataset(key, shape=(0,) + val.shape[1:], maxshape=(None,) + val.shape[1:],
+                             dtype=val.dtype, chunks=(chunk,) + val.shape[1:],
+                             compression='lzf', shuffle=True)
+    dset = group[key]
+    n = dset.shape[0]
+    dset.resize(n + len(val), axis=0)
+    if len(val) > 0:
+        dset[n:] = val
+
+
+def occupancy(collection):
+    """fraction of the dense trajectory elements in the stored ranges"""
+    first, count = stored_range(collection)
+    return count.sum()/max(count.size*len(collection["Snapshot"]), 1)
+
+
+def append_collection(group, collection, snapshot, float32=False):
+    """
+    Appends the pairs of one orbit collection (as returned by build_orbits
+    or read from an orbits/*.hdf5 file) to a sample group of the store, in
+    the layout of the group (attrs["Layout"], dense if not set); snapshot
+    is the snapshot of the pair catalog, or an array with one per pair
+    """
+    npairs = len(collection["PairKey"])
+    first, count = stored_range(collection)
+    layout = group.attrs.setdefault("Layout", "dense")
+    if layout == "ragged":
+        offset0 = group["Offset"][-1] if "Offset" in group else 0
+        if "Offset" not in group:
+            _append(group, "Offset", np.zeros(1, dtype=np.int64), pair_chunk)
+        _append(group, "Offset", offset0 + np.cumsum(count, dtype=np.int64), pair_chunk)
+    _append(group, "First", first, pair_chunk)
+    _append(group, "Count", count, pair_chunk)
+    _append(group, "CatalogSnapshot", np.broadcast_to(np.asarray(snapshot, dtype=np.int32), (npairs,)),
+            pair_chunk)
+
+    for key, val in collection.items():
+        if key in snapshot_keys:
+            continue
+        if key == "PairKey":
+            val = np.array([pk.decode("utf-8") if isinstance(pk, bytes) else pk for pk in val],
+                           dtype=object)
+            if key not in group:
+                group.create_dataset(key, shape=(0,), maxshape=(None,), chunks=(pair_chunk,),
+                                     dtype=h5py.string_dtype(encoding='utf-8', length=None),
+                                     compression='lzf')
+            dset = group[key]
+            n = dset.shape[0]
+            dset.resize(n + npairs, axis=0)
+            if npairs > 0:
+                dset[n:] = val
+        elif key in trajectory_fill:
+            val = np.asarray(val)
+            if layout == "ragged":
+                val = _ragged(val, first, count)
+            if float32 and val.dtype == np.float64:
+                val = val.astype(np.float32)
+            _append(group, key, val, ragged_chunk if layout == "ragged" else dense_chunk)
+            group[key].attrs["Fill"] = trajectory_fill[key]
+        else:
+            _append(group, key, np.asarray(val), pair_chunk)
+
+    for key in group:
+        group[key].attrs[key] = store_info.get(key, info_dict.get(key, ""))
+
+
+def build_orbit_store(paths, storepath, snapshots=range(100), samples=None, float32=False,
+                      layout=None):
+    """
+    Writes the orbit files of the given snapshots and samples into one
+    store, reading one orbit file at a time and appending the pairs in
+    whole multiples of dense_chunk (so that the compressed chunks are
+    written once, not rewritten for every orbit file)
+
+    Parameters:
+    -----------
+    paths: SetupPaths
+        paths of the harvest data
+    storepath: str
+        store file to write
+    snapshots: iterable of int
+        snapshots to include (missing orbit files are skipped)
+    samples: list of tuples or None
+        (masstype, pairtype) samples (default: all four)
+    float32: bool
+        store the trajectories in single precision
+    layout: str or None
+        "dense" or "ragged" trajectories; None chooses for each sample from
+        its occupancy (dense from dense_occupancy), which costs one pass
+        over the SeparationsComoving of its orbit files
+    """
+    if samples is None:
+        samples = [("high", "major"), ("high", "minor"), ("low", "major"), ("low", "minor")]
+    tmppath = f"{storepath}.{os.getpid()}.tmp"
+    f = h5py.File(tmppath, 'w')
+    header = f.create_group("Header")
+    header.attrs["Float32"] = float32
+    for masstype, pairtype in samples:
+        group = f.create_group(f"{masstype}mass_{pairtype}")
+        orbitpaths = [(snapshot, f"{paths.path_orbits}{masstype}mass_{pairtype}_{snapshot}.hdf5")
+                      for snapshot in snapshots]
+        orbitpaths = [(snapshot, orbitpath) for snapshot, orbitpath in orbitpaths
+                      if os.path.exists(orbitpath)]
+        group.attrs["Layout"] = layout if layout is not None else _choose_layout(orbitpaths)
+        pending, npending = [], 0
+        for snapshot, orbitpath in orbitpaths:
+            orbit_file = h5py.File(orbitpath, 'r')
+            collection = {key: np.array(val) for key, val in orbit_file.items()}
+            orbit_file.close()
+            if "Snapshots" not in f:
+                snapgroup = f.create_group("Snapshots")
+                for key in snapshot_keys:
+                    snapgroup.create_dataset(key, data=collection[key])
+                header.attrs["NumSnaps"] = len(collection["Snapshot"])
+            pending.append((snapshot, collection))
+            npending += len(collection["PairKey"])
+            if npending >= dense_chunk:
+                catalog_snapshot, merged = _concatenate(pending)
+                nwhole = npending - npending % dense_chunk
+                append_collection(group, _rows(merged, 0, nwhole), catalog_snapshot[:nwhole], float32)
+                pending = [(catalog_snapshot[nwhole:], _rows(merged, nwhole, npending))]
+                npending -= nwhole
+        if len(pending) > 0:
+            catalog_snapshot, merged = _concatenate(pending)
+            append_collection(group, merged, catalog_snapshot, float32)
+    f.close()
+    os.replace(tmppath, storepath)
+
+
+def _concatenate(pending):
+    """
+    one collection of the pairs of several (snapshot, collection), with
+    the snapshot of each pair
+    """
+    snapshot = np.concatenate([np.broadcast_to(np.asarray(snapshot, dtype=np.int32),
+                                               (len(collection["PairKey"]),))
+                               for snapshot, collection in pending])
+    collection = {key: val if key in snapshot_keys else
+                  np.concatenate([np.asarray(other[key]) for _, other in pending])
+                  for key, val in pending[0][1].items()}
+    return snapshot, collection
+
+
+def _rows(collection, lo, hi):
+    """pairs lo to hi of a collection"""
+    return {key: val if key in snapshot_keys else val[lo:hi] for key, val in collection.items()}
+
+
+def _choose_layout(orbitpaths):
+    """dense or ragged, from the occupancy of the orbit files of a sample"""
+    stored, total = 0., 0
+    for snapshot, orbitpath in orbitpaths:
+        orbit_file = h5py.File(orbitpath, 'r')
+        collection = {key: orbit_file[key][()] for key in ["SeparationsComoving", "Snapshot"]}
+        orbit_file.close()
+        npairs = len(collection["SeparationsComoving"])
+        stored += occupancy(collection)*npairs
+        total += npairs
+    return "dense" if total == 0 or stored/total >= dense_occupancy else "ragged"
+
+
+class OrbitStore:
+    def __init__(self, path):
+        """
+        Lazy reader of an orbit store; the file stays open until close()
+        """
+        self.path = path
+        self._file = h5py.File(path, 'r')
+        self.nsnaps = int(self._file["Header"].attrs.get("NumSnaps", 0))
+        self.snapdata = ({key: np.array(val) for key, val in self._file["Snapshots"].items()}
+                         if "Snapshots" in self._file else {})
+
+    def samples(self):
+        """names of the samples in the store, e.g. highmass_major"""
+        return [key for key in self._file.keys() if key not in ["Header", "Snapshots"]]
+
+    def __getitem__(self, sample):
+        return OrbitSample(self._file[sample], self.nsnaps, self.snapdata)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class OrbitSample:
+    def __init__(self, group, nsnaps, snapdata):
+        """
+        One sample of an orbit store; datasets are read when requested
+        """
+        self._group = group
+        self.nsnaps = nsnaps
+        self.snapdata = snapdata
+        self.npairs = group["First"].shape[0] if "First" in group else 0
+        self.layout = group.attrs.get("Layout", "ragged")
+
+    def keys(self):
+        return list(self._group.keys())
+
+    def __getitem__(self, key):
+        """a full per-pair dataset, or the dense array of a trajectory"""
+        if key in trajectory_fill:
+            return self.get(key)
+        return self._group[key][()]
+
+    def _pair_index(self, pairs):
+        if pairs is None:
+            return np.arange(self.npairs)
+        if isinstance(pairs, slice):
+            return np.arange(self.npairs)[pairs]
+        return np.atleast_1d(np.asarray(pairs, dtype=np.int64))
+
+    def get(self, key, pairs=None, snapshots=None):
+        """
+        Dense (npairs, nsnapshots[, 3]) trajectory of the selected pairs
+        at the selected snapshots, or the selected rows of a per-pair
+        dataset
+
+        Parameters:
+        -----------
+        key: str
+            dataset name, e.g. Separations
+        pairs: slice, array of int or None
+            pairs (rows) to read (default: all)
+        snapshots: slice, array of int or None
+            snapshot numbers (columns) to return (default: all)
+        """
+        index = self._pair_index(pairs)
+        dset = self._group[key]
+        if key not in trajectory_fill:
+            if len(index) == 0:
+                return dset[0:0]
+            lo, hi = index.min(), index.max() + 1
+            return dset[lo:hi][index - lo]
+
+        if len(index) == 0:
+            shape = dset.shape[1:] if self.layout == "ragged" else dset.shape[2:]
+            out = np.full((0, self.nsnaps) + shape, dset.attrs["Fill"], dtype=dset.dtype)
+        elif self.layout == "dense":
+            lo, hi = index.min(), index.max() + 1
+            out = dset[lo:hi]
+            if not _is_range(index, lo, hi):
+                out = out[index - lo]
+        else:
+            out = self._densify(dset, index)
+        if snapshots is None:
+            return out
+        return out[:, np.atleast_1d(np.arange(self.nsnaps)[snapshots])]
+
+    def _densify(self, dset, index):
+        """dense (npairs, nsnaps[, 3]) rows of a ragged trajectory"""
+        # the ragged rows of all selected pairs lie between the offsets of
+        # the first and last pair, so they are read in one slice
+        lo, hi = index.min(), index.max() + 1
+        offset = self._group["Offset"][lo:hi+1]
+        first = self._group["First"][lo:hi][index - lo]
+        count = np.diff(offset)[index - lo]
+        values = dset[offset[0]:offset[-1]]
+        if not _is_range(index, lo, hi):
+            start = offset[index - lo] - offset[0]
+            within = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+            values = values[np.repeat(start, count) + within]
+
+        # the stored range of every row; values are in the row-major order
+        # of these elements, so they are filled in with one boolean mask
+        snap = np.arange(self.nsnaps)
+        stored = (snap >= first[:, np.newaxis]) & (snap < (first + count)[:, np.newaxis])
+        out = np.full((len(index), self.nsnaps) + dset.shape[1:], dset.attrs["Fill"], dtype=dset.dtype)
+        out[stored] = values
+        return out
+
+    def load(self):
+        """all datasets of the sample as a dict, in the format of build_orbits"""
+        collection = dict(self.snapdata)
+        for key in self.keys():
+            if key in ["First", "Count", "Offset"]:
+                continue
+            collection[key] = self[key]
+        collection["PairKey"] = [pk.encode("utf-8") if isinstance(pk, str) else pk
+                                 for pk in collection["PairKey"]]
+        return collection
+
+
+def _is_range(index, lo, hi):
+    """whether index is lo, lo+1, ..., hi-1"""
+    return len(index) == hi - lo and np.array_equal(index, np.arange(lo, hi))
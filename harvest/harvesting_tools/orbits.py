@@ -0,0 +1,367 @@
+"""
+Builds the orbit quantities of a whole pair catalog at once.
+
+The branches of the primaries and secondaries are scattered into dense
+(npairs, nsnaps) arrays indexed by snapshot number, and separations,
+velocities, group flags, infall and merger snapshots are computed with
+array operations over all pairs and snapshots, instead of looping over
+pairs and snapshots in Python.
+
+The output is the same as the per-pair loop in
+_dev/pull_orbitdata-collection.py, dataset by dataset.
+
+Usage:
+------
+    tree = TreeDB(paths.tng_trees)
+    collection = build_orbits(tree, pairs, snapshot, snapdata)
+    write_orbits(f"{paths.path_orbits}{size}mass_{type}_{snapshot}.hdf5", collection)
+
+    -- NOTE:
+        - pairs is the dict read from a pairs/*.hdf5 file
+        - snapdata is the dict read from misc/snapshot_data.hdf5
+        - a BranchCache or a LineageRegistry can be passed to build_orbits
+            instead of a TreeDB
+        - PairID holds the two SubhaloIDs that make up PairKey as integers,
+            so that pairs can be compared with array operations
+            (pair_key_view)
+        - build_orbits(..., prefetch=2) reads the branches of the next
+            chunks of pairs while the current chunk is collected
+"""
+
+__date__   = "October 2026"
+
+import numpy as np
+import h5py
+
+from harvesting_tools.vector_correction import vectorCorrection as vector
+from harvesting_tools.branch_cache import BranchCache, LineageRegistry, dense_branches
+from harvesting_tools.prefetch import prefetched
+
+orbit_fields = ['SnapNum', 'SubhaloID', 'DescendantID', 'RootDescendantID',
+                'SubhaloPos', 'SubhaloVel', 'SubhaloGrNr', 'Group_R_TopHat200']
+
+# datasets that are the same for every chunk of a catalog
+snapshot_keys = ["Redshift", "Scale", "Snapshot"]
+
+info_dict = {"Redshift":"Redshift of snapshot",
+             "Scale":"Scale of snapshot",
+             "Snapshot":"Snapshot number",
+             "GroupNum":"FoF group number at snapshot",
+             "SubfindID1":"Subhalo ID of primary at selected redshift",
+             "SubfindID2":"Subhalo ID of secondary at selected redshift",
+             "SubhaloMass1":"Subhalo mass at selected redshift in 1e10*Msun",
+             "SubhaloMass2":"Subhalo mass at selected redshift in 1e10*Msun",
+             "StellarMass1":"Stellar mass from median AM at selected redshift",
+             "StellarMass2":"Stellar mass from median AM at selected redshift",
+             "StellarMassRatio":"Stellar mass ratio at selected redshift",
+             "MergeFlag":"True if subhalos will merge",
+             "MergeRedshift":"Redshift of 'merger'",
+             "MergeSnapshot":"Snapshot at which 'merger' has occured",
+             "InfallRedshift":"First redshift where Group is the same",
+             "InfallSnapshot":"First snapshot where Group is the same",
+             "PairKey":"Unique identifying key for each pair (same between snapshots for same pair)",
+             "PairID":"SubhaloIDs of the earliest progenitors of primary and secondary (integer PairKey)",
+             "GroupFlag":"True if subhalos are in the same group",
+             "GroupRvir":"Radius of primary group in kpc",
+             "Separations":"Physical separation between pair in kpc",
+             "SeparationsComoving":"Comoving separation between pair in ckpc/h",
+             "SeparationsScaled":"Separation scaled by radius of primary group, dimensionless",
+             "RelativeVelocity":"Relative velocity between pair in km/s",
+             "SubhaloPos1":"Position of subhalo in ckpc/h",
+             "SubhaloPos2":"Position of subhalo in ckpc/h",
+             "SubhaloVel1":"Velocity of subhalo in km/s",
+             "SubhaloVel2":"Velocity of subhalo in km/s"}
+
+
+def _norm3(vec):
+    """
+    Length of 3-vectors along the last axis, with the squares summed in
+    a fixed order ((x*x + z*z) + y*y).
+
+    np.linalg.norm sums in an order that depends on the BLAS library, so
+    the original per-pair loop is not reproducible to the last bit in
+    general. This order reproduces every finite SeparationsComoving,
+    Separations and RelativeVelocity value of the data/orbits files, given
+    the float32 periodic wrap of collect_orbits; on other BLAS builds the
+    loop can differ from it in the last bit (see _dev/check_orbits.py).
+    """
+    return np.sqrt((vec[..., 0]*vec[..., 0] + vec[..., 2]*vec[..., 2])
+                   + vec[..., 1]*vec[..., 1])
+
+
+def pair_ids(leaf1, leaf2):
+    """
+    Fixed-width integer pair key: (npairs, 2) uint64 array of the
+    SubhaloIDs of the earliest progenitors of primary and secondary
+    (the two halves of the PairKey string)
+    """
+    return np.stack([np.asarray(leaf1), np.asarray(leaf2)], axis=1).astype(np.uint64)
+
+
+def pair_key_view(pairid):
+    """
+    (npairs,) view of a (npairs, 2) PairID array with one element per
+    pair, for np.unique, np.isin, sorting and comparisons of whole keys
+    """
+    pairid = np.ascontiguousarray(pairid, dtype=np.uint64)
+    return pairid.view([('SubhaloID1', np.uint64), ('SubhaloID2', np.uint64)])[:, 0]
+
+
+def get_branches(source, snapshot, subfind_ids, nsnaps=100, keysel=orbit_fields):
+    """
+    Dense (len(subfind_ids), nsnaps[, dim]) branch arrays for many subhalos
+
+    Parameters:
+    -----------
+    source: TreeDB, BranchCache or LineageRegistry
+        where to read the branches from
+    snapshot: int
+        snapshot of the given Subfind IDs
+    subfind_ids: array of int
+        Subfind IDs at that snapshot
+    """
+    if isinstance(source, BranchCache):
+        return {key: source.get_dense(snapshot, subfind_ids, key) for key in keysel}
+    if isinstance(source, LineageRegistry):
+        return source.get_dense(snapshot, subfind_ids, keysel)
+    return dense_branches(source, snapshot, subfind_ids, nsnaps, keysel)
+
+
+def merge_snapshots(branch1, branch2, chunksize=1024):
+    """
+    Snapshot immediately after the merger of each pair (-1 if the
+    subhalos do not merge, 0 if it cannot be determined)
+
+    Parameters:
+    -----------
+    branch1, branch2: dict
+        dense branches of the primaries and secondaries
+    chunksize: int
+        number of merging pairs compared at a time; memory use is
+        chunksize * nsnaps**2 booleans
+    """
+    valid1 = branch1['SnapNum'] >= 0
+    valid2 = branch2['SnapNum'] >= 0
+    npairs, nsnaps = valid1.shape
+
+    # subhalos merge if their trees have the same root descendant
+    root1 = np.where(valid1, branch1['RootDescendantID'], np.iinfo(np.int64).min).max(axis=1)
+    root2 = np.where(valid2, branch2['RootDescendantID'], np.iinfo(np.int64).min).max(axis=1)
+    merge_flag = root1 == root2
+
+    merge_snap = np.full(npairs, -1, dtype=np.int32)
+    merging = np.flatnonzero(merge_flag)
+    merge_snap[merging] = 0
+    for lo in range(0, len(merging), chunksize):
+        rows = merging[lo:lo+chunksize]
+        desc1 = branch1['DescendantID'][rows]
+        desc2 = branch2['DescendantID'][rows]
+
+        # snapshots where the descendant of one subhalo is also the
+        # descendant of the other at any snapshot
+        same = ((desc1[:, :, np.newaxis] == desc2[:, np.newaxis, :])
+                & valid1[rows, :, np.newaxis] & valid2[rows, np.newaxis, :])
+        overlap1 = same.any(axis=2)
+        overlap2 = same.any(axis=1)
+        overlap_both = overlap1 & overlap2
+        first1 = np.argmax(overlap1, axis=1)
+        first2 = np.argmax(overlap2, axis=1)
+        first_both = np.argmax(overlap_both, axis=1)
+        found = overlap1.any(axis=1) & overlap2.any(axis=1)
+
+        # no snapshots skipped: merged at the snapshot after the last
+        # shared descendant; secondary temporarily entering the primary
+        # (skipping a snapshot): first snapshot shared by both
+        calc = np.where(first1 == first2, first1 + 1,
+                        np.where((np.abs(first1 - first2) == 1) & overlap_both.any(axis=1),
+                                 first_both, 0))
+        merge_snap[rows] = np.where(found, calc, 0)
+    return merge_flag, merge_snap
+
+
+def collect_orbits(pairs, branch1, branch2, snapdata, boxsize=75000, little_h=0.6774,
+                   chunksize=1024):
+    """
+    Orbit quantities of every pair in a pair catalog
+
+    Parameters:
+    -----------
+    pairs: dict
+        pair catalog, as read from a pairs/*.hdf5 file
+    branch1, branch2: dict
+        dense branches of the primaries and secondaries (see get_branches)
+    snapdata: dict
+        snapshot information, as read from misc/snapshot_data.hdf5
+    boxsize: float
+        comoving box size in ckpc/h
+    little_h: float
+        Hubble parameter
+
+    Returns:
+    --------
+    collection: dict
+        the datasets of an orbits/*.hdf5 file
+    """
+    npairs, nsnaps = branch1['SnapNum'].shape
+    redshifts = np.asarray(snapdata['Redshift'])
+    scale = np.asarray(snapdata['Scale'])[:nsnaps]
+
+    # both subhalos have data at the snapshot
+    both = (branch1['SnapNum'] >= 0) & (branch2['SnapNum'] >= 0)
+
+    # group flag, infall snapshot
+    group_flag = both & (branch1['SubhaloGrNr'] == branch2['SubhaloGrNr'])
+    has_infall = group_flag.any(axis=1)
+    infall_snap = np.where(has_infall, np.argmax(group_flag, axis=1), -1).astype(np.int32)
+    infall_redshift = np.where(has_infall, redshifts[infall_snap], -1.)
+
+    # separations: the periodic wrap is done in the precision of the tree
+    # positions (float32), and the length in double precision, as in the
+    # original collection
+    subpos1 = np.where(both[..., np.newaxis], branch1['SubhaloPos'], 0)
+    subpos2 = np.where(both[..., np.newaxis], branch2['SubhaloPos'], 0)
+    comoving_dist = _norm3(vector(subpos1, subpos2, boxsize).astype(np.float64))
+    subpos1, subpos2 = subpos1.astype(np.float64), subpos2.astype(np.float64)
+    seps_comov = np.where(both, comoving_dist, np.nan)
+    seps = np.where(both, comoving_dist*scale/little_h, np.nan)
+
+    # scaled separations and group radii are computed in the precision of
+    # the tree field, as the original loop did, and stored in double
+    rvir_comov = branch1['Group_R_TopHat200']
+    rtype = rvir_comov.dtype.type
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scaled = comoving_dist.astype(rtype)/rvir_comov
+        rvir_phys = rvir_comov*scale.astype(rtype)/rtype(little_h)
+    seps_scaled = np.where(both, scaled, np.nan).astype(np.float64)
+    rvir = np.where(both, rvir_phys, 0.).astype(np.float64)
+
+    # velocities
+    vel1 = np.where(both[..., np.newaxis], branch1['SubhaloVel'], 0).astype(np.float64)
+    vel2 = np.where(both[..., np.newaxis], branch2['SubhaloVel'], 0).astype(np.float64)
+    vels = np.where(both, _norm3(vel1 - vel2), np.nan)
+
+    # mergers
+    merge_flag, merge_snap = merge_snapshots(branch1, branch2, chunksize)
+    merge_redshift = np.full(npairs, -1, dtype=np.int32)
+    in_range = merge_flag & (merge_snap > 0) & (merge_snap < len(redshifts))
+    merge_redshift[merge_flag] = 0
+    merge_redshift[in_range] = redshifts[merge_snap[in_range]]
+
+    # pair key from the SubhaloID of the earliest progenitor of each subhalo
+    leaf1 = branch1['SubhaloID'][np.arange(npairs), np.argmax(branch1['SnapNum'] >= 0, axis=1)]
+    leaf2 = branch2['SubhaloID'][np.arange(npairs), np.argmax(branch2['SnapNum'] >= 0, axis=1)]
+    pairkey = [(str(k1)+str(k2)).encode("utf-8") for k1, k2 in zip(leaf1, leaf2)]
+    pairid = pair_ids(leaf1, leaf2)
+
+    collection = {"Redshift":snapdata['Redshift'],
+                  "Scale":snapdata['Scale'],
+                  "Snapshot":snapdata['Snapshot'],
+                  "GroupNum":np.asarray(pairs['Group ID'], dtype="int32"),
+                  "SubfindID1":np.asarray(pairs['Sub1 ID'], dtype="int32"),
+                  "SubfindID2":np.asarray(pairs['Sub2 ID'], dtype="int32"),
+                  "SubhaloMass1":np.asarray(pairs['Sub1 Mass'], dtype=np.float64),
+                  "SubhaloMass2":np.asarray(pairs['Sub2 Mass'], dtype=np.float64),
+                  "StellarMass1":np.asarray(pairs['Sub1 Stellar Mass'], dtype=np.float64),
+                  "StellarMass2":np.asarray(pairs['Sub2 Stellar Mass'], dtype=np.float64),
+                  "StellarMassRatio":np.asarray(pairs['Stellar Mass Ratio'], dtype=np.float64),
+                  "MergeFlag":merge_flag,
+                  "MergeRedshift":merge_redshift,
+                  "MergeSnapshot":merge_snap,
+                  "InfallRedshift":infall_redshift,
+                  "InfallSnapshot":infall_snap,
+                  "PairKey":pairkey,
+                  "PairID":pairid,
+                  "GroupFlag":group_flag,
+                  "GroupRvir":rvir,
+                  "Separations":seps,
+                  "SeparationsComoving":seps_comov,
+                  "SeparationsScaled":seps_scaled,
+                  "RelativeVelocity":vels,
+                  "SubhaloPos1":subpos1,
+                  "SubhaloPos2":subpos2,
+                  "SubhaloVel1":vel1,
+                  "SubhaloVel2":vel2}
+    return collection
+
+
+def build_orbits(source, pairs, snapshot, snapdata, boxsize=75000, little_h=0.6774,
+                 prefetch=0, chunksize=1000):
+    """
+    Reads the branches of every pair in a pair catalog and collects
+    their orbits (see collect_orbits)
+
+    Parameters:
+    -----------
+    source: TreeDB, BranchCache or LineageRegistry
+        where to read the branches from
+    pairs: dict
+        pair catalog at the given snapshot
+    snapshot: int
+        snapshot of the pair catalog
+    snapdata: dict
+        snapshot information, as read from misc/snapshot_data.hdf5
+    prefetch: int
+        with prefetch > 0, the pairs are collected in chunks of chunksize
+        pairs, and the branches of the next prefetch chunks are read in a
+        background thread while the orbits of the current chunk are
+        collected (see harvesting_tools.prefetch); the output is the same
+    chunksize: int
+        number of pairs per chunk with prefetch > 0 (smaller chunks
+        overlap more, but read the trees in smaller pieces)
+    """
+    nsnaps = len(snapdata['Snapshot'])
+    npairs = len(pairs['Sub1 ID'])
+    if prefetch <= 0 or npairs <= chunksize:
+        branch1 = get_branches(source, snapshot, np.asarray(pairs['Sub1 ID']), nsnaps)
+        branch2 = get_branches(source, snapshot, np.asarray(pairs['Sub2 ID']), nsnaps)
+        return collect_orbits(pairs, branch1, branch2, snapdata, boxsize, little_h)
+
+    chunks = [{key: val[lo:lo+chunksize] for key, val in pairs.items()}
+              for lo in range(0, npairs, chunksize)]
+
+    def read(chunk):
+        return (get_branches(source, snapshot, np.asarray(chunk['Sub1 ID']), nsnaps),
+                get_branches(source, snapshot, np.asarray(chunk['Sub2 ID']), nsnaps))
+
+    collections = []
+    for chunk, (branch1, branch2) in zip(chunks, prefetched(read, chunks, prefetch)):
+        collections.append(collect_orbits(chunk, branch1, branch2, snapdata, boxsize, little_h))
+    return merge_chunks(collections)
+
+
+def merge_chunks(collections):
+    """
+    Concatenates the orbit collections of consecutive chunks of one pair
+    catalog, in the order given
+    """
+    merged = {}
+    for key, val in collections[0].items():
+        if key in snapshot_keys:
+            merged[key] = val
+        elif key == "PairKey":
+            merged[key] = [pk for collection in collections for pk in collection[key]]
+        else:
+            merged[key] = np.concatenate([collection[key] for collection in collections])
+    return merged
+
+
+def write_orbits(path, collection):
+    """
+    Saves a collection of orbits in the format of the orbits/*.hdf5 files
+    """
+    f = h5py.File(path, 'w')
+    for key, val in collection.items():
+        if key=='PairKey':
+            dset = f.create_dataset(f'/{key}',
+                                    shape=(len(val),),
+                                    dtype=h5py.string_dtype(encoding='utf-8', length=None))
+            dset.attrs[key] = info_dict[key]
+            dset[:] = np.array(val)
+        else:
+            valv = np.array(val)
+            dset = f.create_dataset(f'/{key}',
+                                    shape=valv.shape,
+                                    dtype=valv.dtype)
+            dset.attrs[key] = info_dict[key]
+            dset[:] = valv
+    f.close()
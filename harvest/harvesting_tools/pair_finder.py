@@ -0,0 +1,202 @@
+"""
+Finds subhalo pairs (and tertiary companions) in the periodic
+simulation box with a k-d tree over the subhalo positions, instead of
+computing the separations between all subhalos.
+
+Pairs are returned in compressed sparse row (CSR) form: the secondaries
+of the p-th primary are pairs["Secondary"][pairs["Offsets"][p]:pairs["Offsets"][p+1]].
+
+Usage:
+------
+    cat = subfind_catalog(paths.tng_base, snapshot, keysel=["SubhaloPos", "SubhaloMass"])
+    pairs = find_pairs(cat.SubhaloPos, stellar_mass, max_sep=1000,
+                       ratio_range=(1/4, 1), primaries=primary_ids)
+    tertiaries = count_tertiaries(cat.SubhaloPos, stellar_mass,
+                                  pairs['Primary'], pairs['Secondary'], max_sep=1000)
+    -- NOTE:
+        - positions and max_sep in comoving ckpc/h
+        - secondaries have mass ratio (secondary / primary) in
+            ratio_range = (lower, upper], with upper <= 1
+        - a pair has a tertiary if another subhalo within max_sep of the
+            primary has at least 1/10 of the mass of the secondary
+"""
+
+__date__   = "October 2026"
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from harvesting_tools.vector_correction import vectorCorrection as vector
+
+
+def _wrap(pos, boxsize):
+    """
+    Positions wrapped into [0, boxsize), as cKDTree requires: np.mod
+    returns boxsize itself for tiny negative coordinates and keeps
+    coordinates equal to boxsize
+    """
+    wrapped = np.mod(pos, boxsize)
+    wrapped[wrapped >= boxsize] -= boxsize
+    return wrapped
+
+
+def _neighbours(tree, pos, max_sep, chunksize):
+    """
+    For chunks of chunksize positions, yields (lo, hi, row, index): the
+    tree points within max_sep of positions lo...hi-1, as the position
+    (row, between lo and hi-1) and the tree point index of each neighbour
+    """
+    for lo in range(0, len(pos), chunksize):
+        found = tree.query_ball_point(pos[lo:lo+chunksize], max_sep, return_sorted=True)
+        counts = np.array([len(nbrs) for nbrs in found], dtype=np.int64)
+        row = np.repeat(np.arange(lo, lo+len(found)), counts)
+        if counts.sum() > 0:
+            index = np.concatenate([np.asarray(nbrs, dtype=np.int64) for nbrs in found])
+        else:
+            index = np.zeros(0, dtype=np.int64)
+        yield lo, lo+len(found), row, index
+
+
+def find_pairs(pos, mass, max_sep, ratio_range=(0, 1), primaries=None,
+               boxsize=75000, chunksize=2000):
+    """
+    All pairs of subhalos closer than max_sep whose mass ratio is in
+    ratio_range
+
+    Parameters:
+    -----------
+    pos: (nsubs, 3) array
+        subhalo positions in ckpc/h
+    mass: (nsubs,) array
+        mass used for the ratio (e.g. stellar mass)
+    max_sep: float
+        maximum comoving separation in ckpc/h
+    ratio_range: tuple
+        (lower, upper]: allowed mass ratios secondary/primary, upper <= 1;
+        subhalos of equal mass are paired once (if both can be
+        primaries, the one with the lower index is the primary)
+    primaries: array of int or None
+        indices of the subhalos that can be primaries (default: all)
+    boxsize: float
+        comoving box size in ckpc/h
+    chunksize: int
+        number of primaries searched at a time (bounds the memory use)
+
+    Returns:
+    --------
+    pairs: dict
+        "Offsets": (nprimaries+1,) CSR offsets into the pair arrays
+        "Primaries": (nprimaries,) the primaries, in the order given
+        "Primary", "Secondary": (npairs,) subhalo indices of each pair
+        "Separation": (npairs,) comoving separation in ckpc/h
+        "MassRatio": (npairs,) mass of secondary / mass of primary
+    """
+    pos = np.asarray(pos, dtype=np.float64)
+    mass = np.asarray(mass)
+    if primaries is None:
+        primaries = np.arange(len(mass))
+    primaries = np.asarray(primaries, dtype=np.int64)
+    lower, upper = ratio_range
+
+    # only subhalos heavy enough to be the secondary of some primary
+    # go into the tree
+    if len(primaries) > 0:
+        candidates = np.flatnonzero(mass > lower*mass[primaries].min())
+    else:
+        candidates = np.zeros(0, dtype=np.int64)
+    tree = cKDTree(_wrap(pos[candidates], boxsize), boxsize=boxsize)
+    is_primary = np.zeros(len(mass), dtype=bool)
+    is_primary[primaries] = True
+
+    # the cuts are applied chunk by chunk, so that only the pairs found
+    # (not all the neighbours) are kept in memory
+    found = {"Row":[], "Secondary":[], "Separation":[], "MassRatio":[]}
+    for lo, hi, row, nbrs in _neighbours(tree, _wrap(pos[primaries], boxsize), max_sep, chunksize):
+        primary = primaries[row]
+        secondary = candidates[nbrs]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = mass[secondary] / mass[primary]
+        # equal masses: only one of the two can be the primary
+        keep = ((ratio > lower) & (ratio <= upper) & (secondary != primary)
+                & ((ratio < 1) | (secondary > primary) | ~is_primary[secondary]))
+        row, primary, secondary, ratio = row[keep], primary[keep], secondary[keep], ratio[keep]
+        # cKDTree includes points at exactly max_sep; keep the strict cut
+        separation = np.linalg.norm(vector(pos[primary], pos[secondary], boxsize), axis=1)
+        keep = separation < max_sep
+        for key, val in [("Row", row), ("Secondary", secondary),
+                         ("Separation", separation), ("MassRatio", ratio)]:
+            found[key].append(val[keep])
+
+    for key, dtype in [("Row", np.int64), ("Secondary", np.int64),
+                       ("Separation", np.float64), ("MassRatio", np.float64)]:
+        found[key] = np.concatenate(found[key]) if found[key] else np.zeros(0, dtype=dtype)
+    offsets = np.zeros(len(primaries)+1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(found["Row"], minlength=len(primaries)))
+    return {"Offsets": offsets,
+            "Primaries": primaries,
+            "Primary": primaries[found["Row"]],
+            "Secondary": found["Secondary"],
+            "Separation": found["Separation"],
+            "MassRatio": found["MassRatio"]}
+
+
+def count_tertiaries(pos, mass, primary, secondary, max_sep, min_ratio=0.1,
+                     boxsize=75000, chunksize=2000):
+    """
+    Number of other subhalos within max_sep of the primary of each pair
+    with at least min_ratio times the mass of the secondary
+
+    Parameters:
+    -----------
+    pos, mass: arrays
+        subhalo positions (ckpc/h) and masses, as in find_pairs
+    primary, secondary: arrays of int
+        subhalo indices of each pair
+    max_sep: float
+        search radius around the primary in ckpc/h
+    min_ratio: float
+        minimum mass of a tertiary relative to the secondary
+
+    Returns:
+    --------
+    ntertiary: (npairs,) array of int
+        TripleFlag is ntertiary > 0
+    """
+    pos = np.asarray(pos, dtype=np.float64)
+    mass = np.asarray(mass)
+    primary = np.asarray(primary, dtype=np.int64)
+    secondary = np.asarray(secondary, dtype=np.int64)
+    if len(primary) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    threshold = min_ratio * mass[secondary]
+    candidates = np.flatnonzero(mass >= threshold.min())
+    tree = cKDTree(_wrap(pos[candidates], boxsize), boxsize=boxsize)
+    uprim, pair_prim = np.unique(primary, return_inverse=True)
+    pair_order = np.argsort(pair_prim, kind='stable')
+    pair_bounds = np.searchsorted(pair_prim[pair_order], np.arange(len(uprim)+1))
+
+    ntertiary = np.zeros(len(primary), dtype=np.int64)
+    for lo, hi, nbr_prim, nbrs in _neighbours(tree, _wrap(pos[uprim], boxsize), max_sep, chunksize):
+        nbr = candidates[nbrs]
+        separation = np.linalg.norm(vector(pos[uprim[nbr_prim]], pos[nbr], boxsize), axis=1)
+        inside = (separation < max_sep) & (nbr != uprim[nbr_prim])
+        nbr, nbr_prim = nbr[inside], nbr_prim[inside]
+
+        # count, for each pair, the neighbours of its primary with mass
+        # >= threshold: sort the neighbours by (primary, mass rank) and
+        # search for (primary, rank of threshold)
+        pairs = pair_order[pair_bounds[lo]:pair_bounds[hi]]
+        values = np.unique(np.concatenate([mass[nbr], threshold[pairs]]))
+        nvalues = len(values) + 1
+        keys = np.sort(nbr_prim * nvalues + np.searchsorted(values, mass[nbr]))
+        first = np.searchsorted(keys, pair_prim[pairs] * nvalues
+                                + np.searchsorted(values, threshold[pairs]))
+        end = np.searchsorted(keys, (pair_prim[pairs] + 1) * nvalues)
+        ntertiary[pairs] = end - first
+
+    # the secondary itself is a neighbour of the primary above the threshold
+    sep_secondary = np.linalg.norm(vector(pos[primary], pos[secondary], boxsize), axis=1)
+    ntertiary -= ((sep_secondary < max_sep) & (mass[secondary] >= threshold)
+                  & (secondary != primary))
+    return ntertiary
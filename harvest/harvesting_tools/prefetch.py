@@ -0,0 +1,82 @@
+"""
+Reads ahead in a background thread: the reads of the next items of a
+sequence are done while the current item is being processed.
+
+The orbit collection alternates blocking HDF5 reads (the offsets and
+tree rows of the branches of a chunk of pairs) with numpy work on the
+branches. build_orbits(..., prefetch=N) splits a pair catalog into
+chunks and reads the branches of the next N chunks with prefetched while
+collect_orbits runs on the current one.
+
+Usage:
+------
+    def read(chunk):
+        return get_branches(tree, snapshot, chunk['Sub1 ID'], nsnaps)
+
+    for chunk, branches in zip(chunks, prefetched(read, chunks, depth=2)):
+        ...
+    -- NOTE:
+        - the results come in the order of the items
+        - at most depth results are held that have not been handed out,
+            so memory is capped at depth+1 chunks
+        - func runs in a single background thread: h5py serializes all
+            HDF5 calls, and TreeDB keeps its open files in an unlocked
+            pool, so more reading threads would not read faster. The
+            source must not be used by other threads until the loop ends
+        - an exception in func is raised by the loop, at its item
+        - it pays off when the reads wait on storage (e.g. trees on a
+            network file system) with a free core for the numpy work;
+            with the trees in the page cache, or on a single core, the
+            smaller reads of the chunks make the build slower
+"""
+
+__date__   = "October 2026"
+
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+
+
+def prefetched(func, items, depth=2):
+    """
+    func(item) for every item, computed up to depth items ahead in a
+    background thread
+
+    Parameters:
+    -----------
+    func: callable
+        reads one item (e.g. the branches of a chunk of pairs)
+    items: iterable
+        items in the order they are needed
+    depth: int
+        number of items read ahead (the queue depth); 0 calls func in the
+        calling thread, without a background thread
+
+    Returns:
+    --------
+    results: generator
+        func(item), in the order of items
+    """
+    if depth <= 0:
+        for item in items:
+            yield func(item)
+        return
+
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch") as pool:
+        pending = deque(pool.submit(func, item) for item in islice(items, depth))
+        try:
+            while pending:
+                result = pending.popleft().result()
+                # refill the queue before handing out the result, so that
+                # the next read overlaps with the work on this one
+                for item in islice(items, 1):
+                    pending.append(pool.submit(func, item))
+                yield result
+                # do not hold this result while waiting for the next one
+                del result
+        finally:
+            # stopped early (break, or an exception): drop the reads that
+            # have not started
+            for future in pending:
+                future.cancel()
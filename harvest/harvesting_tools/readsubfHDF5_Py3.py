@@ -2,7 +2,13 @@
 """ routines for reading subfind data from cosmo sims.
     
     Example Usage:
-    
+      cat = subfind_catalog(basedir, snapnum, keysel=["SubhaloPos", "GroupFirstSub"])
+      cat = subfind_catalog(basedir, snapnum, lazy=True)  # blocks read on first access
+      pos = cat.SubhaloPos
+      mass = cat.field("SubhaloMass", rows=subhalo_ids)  # reads only these rows
+      chunk, local_row = cat.locate(subhalo_ids)
+      cat = subfind_catalog(basedir, snapnum, manifest=manifest)  # files and headers from a sim_manifest
+
     Dependencies:
       hdf5lib.py
 
@@ -26,8 +32,13 @@ __status__ = "Beta -- forever."
 import os
 import sys
 import numpy as np
+import h5py
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import shared_memory
 import harvesting_tools.hdf5lib_Py3 as hdf5lib
 import harvesting_tools.naming_Py3 as naming
+import harvesting_tools.io_stats as io_stats
+import harvesting_tools.sim_manifest as sim_manifest
 
 
 ####################
@@ -115,139 +126,314 @@ galprop_datablocks = {
 
 
 
+def _read_subfind_header(curfile):
+    """
+    Number of groups and subhalos in one chunk of a group catalog, and the
+    header attributes that describe the whole catalog.
+    """
+    f=hdf5lib.OpenFile(curfile)
+    header = {}
+    for attr in ["Ngroups_ThisFile", "Nsubgroups_ThisFile", "NumFiles", "Ngroups_Total",
+                 "Nids_Total", "Nsubgroups_Total", "Redshift", "BoxSize"]:
+        header[attr] = hdf5lib.GetAttr(f, "Header", attr)
+    f.close()
+    return header
+
+
+def _read_subfind_chunk(curfile, reads):
+    """
+    Read the datablocks of one chunk of a group catalog, each with a single
+    read_direct into its slice of the destination array.
+
+    reads: list of (dataset name, destination, first row), where the
+    destination is an array, or (shared memory name, shape, dtype) of an
+    array in shared memory when called in a worker process.
+    """
+    with io_stats.span("catalog_chunk", curfile):
+        f=hdf5lib.OpenFile(curfile)
+        for dname, dest, skip in reads:
+            gname, key = dname.split("/")
+            if not hdf5lib.Contains(f, gname, key):
+                continue
+            shm = None
+            if isinstance(dest, tuple):
+                shm = shared_memory.SharedMemory(name=dest[0])
+                dest = np.ndarray(dest[1], dtype=dest[2], buffer=shm.buf)
+            a=hdf5lib.GetData(f, dname)
+            if a.shape[0] > 0:
+                io_stats.read_direct(a, dest, np.s_[skip:skip + a.shape[0]], "catalog")
+            if shm is not None:
+                del dest
+                shm.close()
+        f.close()
+
+
+def _read_subfind_rows(dset, local, dtype, max_gap=64):
+    """
+    Read the given rows of a dataset with a single HDF5 read: the sorted
+    rows are coalesced into blocks (rows at most max_gap apart share a
+    block) and the union of the blocks is selected as one hyperslab
+    selection. Returns the rows in the order given.
+    """
+    order = np.unique(local)
+    breaks = np.flatnonzero(np.diff(order) > max_gap + 1) + 1
+    starts = order[np.concatenate([[0], breaks])]
+    ends = order[np.concatenate([breaks - 1, [len(order) - 1]])] + 1
+
+    rest = dset.shape[1:]
+    fspace = dset.id.get_space()
+    fspace.select_none()
+    for lo, hi in zip(starts, ends):
+        fspace.select_hyperslab((int(lo),) + (0,)*len(rest), (int(hi - lo),) + rest,
+                                op=h5py.h5s.SELECT_OR)
+    nread = int(np.sum(ends - starts))
+    buf = np.empty((nread,) + rest, dtype=dtype)
+    mspace = h5py.h5s.create_simple((nread,) + rest)
+    io_stats.read_selection(dset, mspace, fspace, buf, "catalog")
+
+    # position of each requested row in the buffer
+    block = np.searchsorted(starts, local, side="right") - 1
+    before = np.concatenate([[0], np.cumsum(ends - starts)[:-1]])
+    return buf[before[block] + local - starts[block]]
+
+
 class subfind_catalog:
-    def __init__(self, basedir, snapnum, long_ids=False, double_output=False, grpcat=True, subcat=True, name="fof_subhalo_tab", keysel=[]):
+    def __init__(self, basedir, snapnum, long_ids=False, double_output=False, grpcat=True, subcat=True, name="fof_subhalo_tab", keysel=[], nworkers=1, use_processes=False, lazy=False, manifest=None):
+        """
+        Reads the requested datablocks of a group catalog (all chunks).
+
+        The headers of all chunks are read first, to find where each chunk
+        goes in the full arrays; then the chunks are read, each datablock
+        with a single read into its slice of the full array.
+
+        keysel: datablocks to read; None reads every group and subhalo block
+        nworkers: number of chunks read at the same time (1: one after another)
+        use_processes: read the chunks in worker processes (through shared
+            memory) instead of threads; h5py only runs one HDF5 call at a
+            time per process, so threads mostly help with slow file systems
+        lazy: only read the chunk headers; datablocks are read the first
+            time they are accessed (e.g. cat.SubhaloPos), see field()
+        manifest: sim_manifest.SimManifest (or path to one) with the chunk
+            files and headers of the catalog, used instead of looking for
+            the files and reading the headers; None uses the manifest
+            registered for basedir (e.g. by SetupPaths.tng), if any, and
+            False never uses one
+
+        Any datablock that was not read at start (e.g. not in keysel) is
+        read on first access in the same way.
+        """
 
         if long_ids: self.id_type = np.uint64
         else: self.id_type = np.uint32
         if double_output: self.double_type = np.float32
         else: self.double_type = np.float64
 
-        filenum = 0
-        doneflag = False
-        skip_gr = 0
-        skip_sub = 0
-        vardict = {}
+        self._grpcat = grpcat
+        self._subcat = subcat
+        self._block_names = {}
+        self._nworkers = nworkers
+        self._use_processes = use_processes
         if keysel is None:
-            keysel = grp_datablocks.items()
-
-        while not doneflag:
-            self.filebase, curfile = naming.return_subfind_filebase(basedir, snapnum, name, filenum)
-            self.firstfile = curfile
-
-            f=hdf5lib.OpenFile(curfile)
-            ngroups = hdf5lib.GetAttr(f, "Header", "Ngroups_ThisFile")
-            nsubs = hdf5lib.GetAttr(f, "Header", "Nsubgroups_ThisFile")
-            nfiles = hdf5lib.GetAttr(f, "Header", "NumFiles")
-            if filenum == 0:
-                self.ngroups = hdf5lib.GetAttr(f, "Header", "Ngroups_Total")
-                self.nids = hdf5lib.GetAttr(f, "Header", "Nids_Total")
-                self.nsubs = hdf5lib.GetAttr(f, "Header", "Nsubgroups_Total")
-                self.redshift = hdf5lib.GetAttr(f, "Header", "Redshift")
-                self.boxsize = hdf5lib.GetAttr(f, "Header", "BoxSize")
-                #GROUPS
-                if grpcat:
-                    for key in keysel:
-                        if hdf5lib.Contains(f, "Group", key):
-                            val = grp_datablocks[key]
-                            type = val[0]
-                            dim = val[1]
-                            
-                            # Notice: added if and elif to get rid of deprecation error:
-                            # Previously: 
-                            # if (type=='FLOAT'):
-                            #    vars(self)[key]=np.empty(self.ngroups, dtype=np.dtype((self.double_type,dim)))
-                            if (type=='FLOAT') and (dim ==1):
-                                vars(self)[key]=np.empty(self.ngroups, dtype=np.dtype((self.double_type)))
-                            elif (type=='FLOAT'):
-                                vars(self)[key]=np.empty(self.ngroups, dtype=np.dtype((self.double_type,dim)))
-
-                            if (type=='INT') and (dim==1):
-                                vars(self)[key]=np.empty(self.ngroups, dtype=np.dtype((np.int32)))
-                            elif (type=='INT'):
-                                vars(self)[key]=np.empty(self.ngroups, dtype=np.dtype((np.int32,dim)))
-
-                            if (type=='INT64') and (dim==1):
-                                vars(self)[key]=np.empty(self.ngroups, dtype=np.dtype((np.int64)))
-                            elif (type=='INT64'):
-                                vars(self)[key]=np.empty(self.ngroups, dtype=np.dtype((np.int64,dim)))
-
-                            if (type=='ID') and (dim==1):
-                                vars(self)[key]=np.empty(self.ngroups, dtype=np.dtype((self.id_type)))
-                            if (type=='ID'):
-                                vars(self)[key]=np.empty(self.ngroups, dtype=np.dtype((self.id_type,dim)))
-                            vardict[key]=vars(self)[key]
-
-
-                #SUBHALOS
-                if subcat:
-                    for key in keysel:
-                        if hdf5lib.Contains(f, "Subhalo", key):
-                            val = sub_datablocks[key]
-                            type = val[0]
-                            dim = val[1]
-                            # Notice: added if and elif to get rid of deprecation error
-                            if (type=='FLOAT') and (dim ==1):
-                                vars(self)[key]=np.empty(self.nsubs, dtype=np.dtype((self.double_type)))
-                            elif (type=='FLOAT'):
-                                vars(self)[key]=np.empty(self.nsubs, dtype=np.dtype((self.double_type,dim)))
-
-                            if (type=='INT') and (dim==1):
-                                vars(self)[key]=np.empty(self.nsubs, dtype=np.dtype((np.int32)))
-                            elif (type=='INT'):
-                                vars(self)[key]=np.empty(self.nsubs, dtype=np.dtype((np.int32,dim)))
-
-                            if (type=='INT64') and (dim==1):
-                                vars(self)[key]=np.empty(self.nsubs, dtype=np.dtype((np.int64)))
-                            elif (type=='INT64'):
-                                vars(self)[key]=np.empty(self.nsubs, dtype=np.dtype((np.int64,dim)))
-
-                            if (type=='ID') and (dim==1):
-                                vars(self)[key]=np.empty(self.nsubs, dtype=np.dtype((self.id_type)))
-                            if (type=='ID'):
-                                vars(self)[key]=np.empty(self.nsubs, dtype=np.dtype((self.id_type,dim)))
-                                
-                            vardict[key]=vars(self)[key]
-
-            #GROUPS
-            if grpcat:
-                if ngroups > 0:
-                    for key in keysel:
-                        if hdf5lib.Contains(f, "Group", key):
-                            val = grp_datablocks[key]
-                            type = val[0]
-                            dim = val[1]
-                            a=hdf5lib.GetData(f, "Group/"+key)
-                            if dim==1:
-                                vardict[key][skip_gr:skip_gr + ngroups]=a[:]
-                            else:
-                                for d in range(0,dim):
-                                    vardict[key][skip_gr:skip_gr + ngroups,d]=a[:,d]
-
-                    skip_gr += ngroups
-            #SUBHALOS
-            if subcat:
-                if nsubs > 0:
-                    for key in keysel:
-                        if hdf5lib.Contains(f, "Subhalo", key):
-                            val = sub_datablocks[key]
-                            type = val[0]
-                            dim = val[1]
-                            a=hdf5lib.GetData(f, "Subhalo/"+key)
-                            if dim==1:
-                                vardict[key][skip_sub:skip_sub + nsubs]=a[:]
-                            else:
-                                for d in range(0,dim):
-                                    vardict[key][skip_sub:skip_sub + nsubs,d]=a[:,d]
-
-                    skip_sub += nsubs
+            keysel = list(grp_datablocks.keys()) + list(sub_datablocks.keys())
 
+        manifest = sim_manifest.lookup(basedir, manifest)
+        entry = None if manifest is None else manifest.catalog(snapnum, name)
+        if entry is not None:
+            self._from_manifest(entry)
+        else:
+            # headers of all chunks -> global offset of each chunk
+            self.filebase, self.firstfile = naming.return_subfind_filebase(basedir, snapnum, name, 0)
+            header = _read_subfind_header(self.firstfile)
+            nfiles = header["NumFiles"]
+            self._set_header(header)
+
+            self._curfiles = [self.firstfile] + [naming.return_subfind_filebase(basedir, snapnum, name, filenum)[1]
+                                                 for filenum in range(1, nfiles)]
+            with ThreadPoolExecutor(max_workers=nworkers) as pool:
+                headers = [header] + list(pool.map(_read_subfind_header, self._curfiles[1:]))
+            self._nrows = {"Group": np.array([h["Ngroups_ThisFile"] for h in headers], dtype=np.int64),
+                           "Subhalo": np.array([h["Nsubgroups_ThisFile"] for h in headers], dtype=np.int64)}
+            self._skip = {gname: np.concatenate([[0], np.cumsum(nrows)[:-1]])
+                          for gname, nrows in self._nrows.items()}
+
+        if not lazy:
+            dnames = [self._block_name(key) for key in keysel]
+            self._read_blocks([dname for dname in dnames if dname is not None])
+
+    def _set_header(self, header):
+        self.ngroups = header["Ngroups_Total"]
+        self.nids = header["Nids_Total"]
+        self.nsubs = header["Nsubgroups_Total"]
+        self.redshift = header["Redshift"]
+        self.boxsize = header["BoxSize"]
+
+    def _from_manifest(self, entry):
+        """chunk files, row counts and datablock names from a manifest entry"""
+        self.filebase = entry["filebase"]
+        self._curfiles = list(entry["files"])
+        self.firstfile = self._curfiles[0]
+        self._set_header(entry["header"])
+        self._nrows = {"Group": np.array(entry["ngroups"], dtype=np.int64),
+                       "Subhalo": np.array(entry["nsubs"], dtype=np.int64)}
+        self._skip = {"Group": np.array(entry["firstgroup"], dtype=np.int64),
+                      "Subhalo": np.array(entry["firstsub"], dtype=np.int64)}
+        blocks = set(entry["blocks"])
+        for gname, datablocks, wanted in [("Group", grp_datablocks, self._grpcat),
+                                          ("Subhalo", sub_datablocks, self._subcat)]:
+            for key in datablocks:
+                dname = gname + "/" + key
+                self._block_names[key] = dname if (wanted and dname in blocks) else None
+
+    def __getattr__(self, name):
+        # only called for attributes that are not set: read datablocks on demand
+        if name.startswith("_") or ((name not in grp_datablocks) and (name not in sub_datablocks)):
+            raise AttributeError(name)
+        if self._block_name(name) is None:
+            raise AttributeError("%s not in group catalog %s" % (name, self.filebase))
+        return self.field(name)
+
+    def field(self, key, rows=None, max_gap=64):
+        """
+        Datablock key of the catalog, read (and kept) on first access.
+
+        rows: global group or subhalo indices (e.g. Subfind IDs); if given,
+            only these rows are read, from the chunks that contain them
+            (the full block is not read or kept)
+        max_gap: requested rows of a chunk that are at most this many rows
+            apart are read as one hyperslab
+        """
+        dname = self._block_name(key)
+        if dname is None:
+            raise KeyError("%s not in group catalog %s" % (key, self.filebase))
+        if key in vars(self):
+            if rows is None:
+                return vars(self)[key]
+            return vars(self)[key][rows]
+        if rows is None:
+            self._read_blocks([dname])
+            return vars(self)[key]
+
+        gname = dname.split("/")[0]
+        rows = np.asarray(rows, dtype=np.int64)
+        chunk, local = self.locate(rows, gname)
+        out = np.empty(rows.shape, dtype=self._block_dtype(*self._block_info(key)))
+        for filenum in np.unique(chunk):
+            sel = np.flatnonzero(chunk == filenum)
+            f=hdf5lib.OpenFile(self._curfiles[filenum])
+            out[sel] = _read_subfind_rows(hdf5lib.GetData(f, dname), local[sel], out.dtype, max_gap)
             f.close()
-
-            filenum += 1
-            if filenum == nfiles: doneflag = True
-
-
+        return out
+
+    def locate(self, rows, kind="Subhalo"):
+        """
+        Chunk file number and row within that chunk of global group
+        (kind="Group") or subhalo (kind="Subhalo") indices, from the
+        Ngroups_ThisFile / Nsubgroups_ThisFile of the chunk headers.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        ntotal = self.ngroups if kind == "Group" else self.nsubs
+        if np.any((rows < 0) | (rows >= ntotal)):
+            raise IndexError("%s index out of range (%d %ss)" % (kind, ntotal, kind.lower()))
+        chunk = np.searchsorted(np.cumsum(self._nrows[kind]), rows, side="right")
+        return chunk, rows - self._skip[kind][chunk]
+
+    def _block_info(self, key):
+        """type and dimension of a datablock"""
+        if key in grp_datablocks:
+            return grp_datablocks[key][:2]
+        return sub_datablocks[key][:2]
+
+    def _block_name(self, key):
+        """
+        Name (Group/key or Subhalo/key) of a datablock in the chunk files,
+        or None if the catalog does not have it (or it was not requested
+        with grpcat/subcat).
+        """
+        if key in self._block_names:
+            return self._block_names[key]
+        self._block_names[key] = None
+        for gname, blocks, wanted in [("Group", grp_datablocks, self._grpcat),
+                                      ("Subhalo", sub_datablocks, self._subcat)]:
+            if wanted and (key in blocks):
+                # check a chunk that has rows of this kind (chunks
+                # without groups or subhalos have no datasets)
+                filenum = np.argmax(self._nrows[gname] > 0)
+                f=hdf5lib.OpenFile(self._curfiles[filenum])
+                contains = hdf5lib.Contains(f, gname, key)
+                f.close()
+                if contains:
+                    self._block_names[key] = gname + "/" + key
+                    break
+        return self._block_names[key]
+
+    def _read_blocks(self, dnames):
+        """
+        Reads full datablocks (Group/key or Subhalo/key) from all chunks
+        and sets them as attributes
+        """
+        vardict = {}
+        for dname in dnames:
+            gname, key = dname.split("/")
+            n = self.ngroups if gname == "Group" else self.nsubs
+            vardict[dname] = np.empty(n, dtype=self._block_dtype(*self._block_info(key)))
+
+        # shared memory destinations for worker processes
+        shms = {}
+        if self._use_processes and self._nworkers != 1:
+            for dname, arr in vardict.items():
+                shms[dname] = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+                vardict[dname] = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shms[dname].buf)
+
+        # what to read from each chunk
+        reads = []
+        for filenum in range(len(self._curfiles)):
+            reads.append([])
+            for dname, arr in vardict.items():
+                gname = dname.split("/")[0]
+                if self._nrows[gname][filenum] > 0:
+                    if dname in shms:
+                        dest = (shms[dname].name, arr.shape, arr.dtype)
+                    else:
+                        dest = arr
+                    reads[filenum].append((dname, dest, self._skip[gname][filenum]))
+
+        try:
+            if self._nworkers == 1:
+                for curfile, chunk_reads in zip(self._curfiles, reads):
+                    _read_subfind_chunk(curfile, chunk_reads)
+            else:
+                executor = ProcessPoolExecutor if shms else ThreadPoolExecutor
+                with executor(max_workers=self._nworkers) as pool:
+                    list(pool.map(_read_subfind_chunk, self._curfiles, reads))
+
+            for dname, arr in vardict.items():
+                if dname in shms:
+                    arr = arr.copy()
+                vars(self)[dname.split("/")[1]] = arr
+        finally:
+            vardict = None
+            arr = None
+            for shm in shms.values():
+                shm.close()
+                shm.unlink()
+
+    def _block_dtype(self, type, dim):
+        """dtype of one row of a datablock of the given type and dimension"""
+        # Notice: one-dimensional blocks are plain arrays, to get rid of deprecation error:
+        # Previously:
+        # if (type=='FLOAT'):
+        #    vars(self)[key]=np.empty(self.ngroups, dtype=np.dtype((self.double_type,dim)))
+        if (type=='FLOAT'):
+            base = self.double_type
+        elif (type=='INT'):
+            base = np.int32
+        elif (type=='INT64'):
+            base = np.int64
+        elif (type=='ID'):
+            base = self.id_type
+        if dim == 1:
+            return np.dtype(base)
+        return np.dtype((base, dim))
 
     def list_blocks(self, parttype=-1, verbose=False):
         curfile = self.firstfile
@@ -305,8 +491,22 @@ class galprop_catalog:
 
 
 
-# TODO: Improve this.
-def get_offsets(cat, part_types=[0, 1, 4, 5], snap=None, run=None):
+def get_offsets(cat, part_types=[0, 1, 4, 5], snap=None, run=None, offsets_file=None):
+    """
+    Offsets (index of the first particle of each type) of every group and
+    subhalo in the snapshot files.
+
+    If snap and run are given, pretabulated offsets are read when they
+    exist. Otherwise the offsets are computed from GroupLenType,
+    SubhaloLenType and GroupNsubs of the catalog: group offsets are the
+    cumulative sum of GroupLenType, and the subhalos of each group
+    start at the group offset and follow each other. Only the columns
+    of part_types are filled.
+
+    offsets_file: if given, computed offsets are saved there (as
+        Group/SnapByType and Subhalo/SnapByType, like the TNG offsets
+        files) and read back from there the next time
+    """
     if snap and run:
         group_file = "/n/ghernquist/Illustris/Runs/%s/postprocessing/offsets/snap_offsets_group_%s.hdf5" % (run, snap)
         halo_file = "/n/ghernquist/Illustris/Runs/%s/postprocessing/offsets/snap_offsets_subhalo_%s.hdf5" % (run, snap)
@@ -331,28 +531,49 @@ def get_offsets(cat, part_types=[0, 1, 4, 5], snap=None, run=None):
                 group_offsets = np.copy(hdf5lib.GetData(f, "Group/SnapByType"))
                 halo_offsets  = np.copy(hdf5lib.GetData(f, "Subhalo/SnapByType"))
                 return group_offsets, halo_offsets
-     
-   
+
+    if (offsets_file is not None) and os.path.isfile(offsets_file):
+        f = hdf5lib.OpenFile(offsets_file)
+        if list(hdf5lib.GetAttr(f, "Header", "PartTypes")) == list(part_types):
+            group_offsets = np.copy(hdf5lib.GetData(f, "Group/SnapByType"))
+            halo_offsets  = np.copy(hdf5lib.GetData(f, "Subhalo/SnapByType"))
+            f.close()
+            return group_offsets, halo_offsets
+        f.close()
+
     GroupOffset = np.zeros((cat.ngroups, 6), dtype="int64")
     HaloOffset  = np.zeros((cat.nsubs, 6), dtype="int64")
 
-    for parttype in part_types:
-        print("Calculating offsets for PartType: %d" % parttype)
-        k = 0
-        for i in range(0, cat.ngroups):
-                    if i > 0:
-                           GroupOffset[i, parttype] = GroupOffset[i-1, parttype] + cat.GroupLenType[i-1, parttype]
-                    if cat.GroupNsubs[i] > 0:
-                            HaloOffset[k, parttype] = GroupOffset[i, parttype]
-                            k += 1
-                            for j in range(1, cat.GroupNsubs[i]):
-                                    HaloOffset[k, parttype] =  HaloOffset[k-1, parttype] + cat.SubhaloLenType[k-1, parttype]
-                                    k += 1
-    if k != cat.nsubs:
-        print("READHALO: problem with offset table", k, cat.nsubs)
+    nsubs = np.asarray(cat.GroupNsubs, dtype="int64")
+    if nsubs.sum() != cat.nsubs:
+        print("READHALO: problem with offset table", nsubs.sum(), cat.nsubs)
         sys.exit()
 
-    return np.array(GroupOffset), np.array(HaloOffset)
+    print("Calculating offsets for PartTypes: %s" % str(list(part_types)))
+    part_types = list(part_types)
+    grouplen = np.asarray(cat.GroupLenType)[:, part_types].astype("int64")
+    GroupOffset[1:, part_types] = np.cumsum(grouplen[:-1], axis=0)
+
+    # cumulative sum of SubhaloLenType, restarted at the first subhalo of
+    # each group (the subhalos of a group are stored one after the other)
+    sublen = np.asarray(cat.SubhaloLenType)[:, part_types].astype("int64")
+    before = np.zeros_like(sublen)
+    np.cumsum(sublen[:-1], axis=0, out=before[1:])
+    has_subs = nsubs > 0
+    first_sub = (np.cumsum(nsubs) - nsubs)[has_subs]
+    shift = GroupOffset[has_subs][:, part_types] - before[first_sub]
+    before += np.repeat(shift, nsubs[has_subs], axis=0)
+    HaloOffset[:, part_types] = before
+
+    if offsets_file is not None:
+        f = hdf5lib.OpenFile(offsets_file, mode="w")
+        header = hdf5lib.CreateGroup(f, "Header")
+        hdf5lib.SetAttr(header, "PartTypes", np.array(part_types))
+        hdf5lib.CreateArray(f, hdf5lib.CreateGroup(f, "Group"), "SnapByType", GroupOffset)
+        hdf5lib.CreateArray(f, hdf5lib.CreateGroup(f, "Subhalo"), "SnapByType", HaloOffset)
+        f.close()
+
+    return GroupOffset, HaloOffset
 
 
 def subhalo_offsets(snap = 135, run='Illustris-1'):
@@ -1,7 +1,10 @@
 import numpy as np
-import h5py
 import sys
 import os
+from collections import OrderedDict
+
+import harvesting_tools.io_stats as io_stats
+import harvesting_tools.sim_manifest as sim_manifest
 
 """
 Simple Python script for reading merger tree HDF5 files
@@ -12,9 +15,17 @@ For convenience, there are some built-in functions to do
 simple tasks, such as:
 
     get_main_branch
+    get_main_branches
     get_all_progenitors
     get_direct_progenitors
     get_future_branch
+    get_future_branches
+    get_lineage_keys
+
+Subhalo lookups read the offsets_NNN.hdf5 files, unless the offset
+tables are loaded first with TreeDB.preload_offsets (optionally cached
+on disk as memory-mapped .npy files). The reads and file opens can be
+counted and timed with io_stats.track().
 
 The merger trees can also be loaded in "linked-list mode."
 This allows for more flexibility and faster tree traversal,
@@ -76,18 +87,278 @@ class _AdjacentRows(object):
 
         # Find out which fields to add
         if keysel is None:
-            self._fields = treefile.keys()
+            self._fields = list(treefile.keys())
         else:
             self._fields = keysel
 
         # Add them
         for field_name in self._fields:
-            setattr(self, field_name, treefile[field_name][locs])
+            setattr(self, field_name, io_stats.read(treefile[field_name], locs, 'tree'))
 
     def _get_subset(self, indices):
         return _Subset(self, indices)
 
 
+class _RaggedRows(object):
+    """
+    Used by TreeDB.get_main_branches. Stores many branches in
+    "compressed sparse row" form: for every field, the rows of all
+    branches are concatenated into a single flat array, and the rows
+    belonging to branch i are those between offsets[i] and offsets[i+1].
+    Subhalos that were not found in the merger trees have empty branches
+    and found[i] = False.
+    """
+    def __init__(self, fields, offsets, found):
+        self._fields = list(fields.keys())
+        for field_name, values in fields.items():
+            setattr(self, field_name, values)
+        self.offsets = offsets
+        self.found = found
+        self.nbranches = len(offsets) - 1
+        self.nrows = offsets[-1]
+
+    def __len__(self):
+        return self.nbranches
+
+    def get_branch(self, index):
+        """
+        Return branch number index as a _Subset, with the same
+        attributes as the object returned by TreeDB.get_main_branch.
+        """
+        return _Subset(self, slice(self.offsets[index], self.offsets[index+1]))
+
+
+def _plan_reads(rows, max_gap=0):
+    """
+    Group a set of row numbers (in any order, possibly repeated) into
+    contiguous blocks. Sorted rows separated by at most max_gap
+    unrequested rows are merged into the same block, so that many small
+    hyperslab selections become a few large contiguous reads.
+
+    Returns the sorting permutation of rows, the sorted rows and a list
+    of (row_lo, row_hi, i0, i1) tuples, where the sorted rows i0:i1
+    are covered by the read row_lo:row_hi.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    order = np.argsort(rows, kind='stable')
+    sorted_rows = rows[order]
+    breaks = np.flatnonzero(np.diff(sorted_rows) > max_gap + 1) + 1
+    first = np.concatenate([[0], breaks])
+    last = np.concatenate([breaks, [len(sorted_rows)]])
+    blocks = [(sorted_rows[i0], sorted_rows[i1-1] + 1, i0, i1)
+              for i0, i1 in zip(first, last) if i1 > i0]
+    return order, sorted_rows, blocks
+
+
+def _read_rows(dset, rows, max_gap=0, plan=None, kind='tree'):
+    """
+    Read the elements of an HDF5 dataset at the given row numbers,
+    returning them in the same order as rows. A plan returned by
+    _plan_reads can be passed to avoid sorting the rows again when
+    several fields are read at the same rows. kind labels the reads
+    for io_stats.
+    """
+    if plan is None:
+        plan = _plan_reads(rows, max_gap)
+    order, sorted_rows, blocks = plan
+    values = np.empty((len(order),) + dset.shape[1:], dtype=dset.dtype)
+    for row_lo, row_hi, i0, i1 in blocks:
+        block = io_stats.read(dset, slice(row_lo, row_hi), kind)
+        values[order[i0:i1]] = block[sorted_rows[i0:i1] - row_lo]
+    return values
+
+
+def _read_ranges(dset, row_lo, row_hi, max_gap=0):
+    """
+    Read the row ranges row_lo[k]:row_hi[k] of an HDF5 dataset, merging
+    overlapping or nearby ranges into single contiguous reads.
+    Returns a list with one array per range.
+    """
+    order = np.argsort(row_lo, kind='stable')
+    values = [None] * len(order)
+    k = 0
+    while k < len(order):
+        # Extend the block while the next range starts close enough
+        block_lo = row_lo[order[k]]
+        block_hi = row_hi[order[k]]
+        j = k + 1
+        while j < len(order) and row_lo[order[j]] <= block_hi + max_gap:
+            block_hi = max(block_hi, row_hi[order[j]])
+            j += 1
+        block = io_stats.read(dset, slice(block_lo, block_hi), 'tree')
+        for i in order[k:j]:
+            values[i] = block[row_lo[i]-block_lo:row_hi[i]-block_lo]
+        k = j
+    return values
+
+
+class _FilePool(object):
+    """
+    Used by the TreeDB class. Keeps at most max_open HDF5 files open,
+    closing the least recently used one when a new file is needed.
+    Handles opened by another process (i.e., inherited through fork)
+    are never used: they are dropped and the files are reopened.
+    """
+    def __init__(self, max_open=32, rdcc_nbytes=None):
+        if max_open < 1:
+            raise ValueError('max_open must be at least 1')
+        self.max_open = max_open
+        self.rdcc_nbytes = rdcc_nbytes
+        self._files = OrderedDict()
+        self._pid = os.getpid()
+
+    def __len__(self):
+        return len(self._files)
+
+    def __getstate__(self):
+        # Open handles cannot be pickled; the copy reopens files on demand
+        return {'max_open': self.max_open, 'rdcc_nbytes': self.rdcc_nbytes}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def get(self, key, path):
+        """
+        Return the open file for the given key, opening the file at
+        path (and closing the least recently used one) if necessary.
+        """
+        if self._pid != os.getpid():
+            # Forked: forget (without closing) the parent's handles
+            self._files = OrderedDict()
+            self._pid = os.getpid()
+        if key in self._files:
+            self._files.move_to_end(key)
+            return self._files[key]
+        while len(self._files) >= self.max_open:
+            self._files.popitem(last=False)[1].close()
+        if self.rdcc_nbytes is None:
+            f = io_stats.open_file(path, 'r')
+        else:
+            f = io_stats.open_file(path, 'r', rdcc_nbytes=self.rdcc_nbytes)
+        self._files[key] = f
+        return f
+
+    def close(self):
+        """
+        Close all files opened by this process.
+        """
+        if self._pid == os.getpid():
+            for f in self._files.values():
+                f.close()
+        self._files = OrderedDict()
+
+
+class _DescendantWalker(object):
+    """
+    Used by TreeDB.get_future_branch. Follows DescendantID links
+    within a chunk of rows (e.g. the rows between RootDescendantID and
+    a given subhalo) without searching the chunk once per step.
+
+    A SubhaloID -> row index is built once for the chunk. Since subhalo
+    IDs are assigned in a depth-first fashion, they are normally
+    contiguous within a chunk and the index is just an offset; otherwise
+    a sorted index is used. Any number of start rows can be walked at
+    the same time. For many start rows, the number of steps from every
+    row to the root descendant is found by pointer jumping, which takes
+    log2(branch length) vectorized passes over the chunk.
+    """
+    def __init__(self, subhalo_id, descendant_id, root_descendant_id):
+        self._subhalo_id = subhalo_id
+        self._descendant_id = descendant_id
+        self._root_descendant_id = root_descendant_id
+        self.nrows = len(subhalo_id)
+
+        # SubhaloID -> row index
+        self._first_id = subhalo_id[0] if self.nrows > 0 else 0
+        self._contiguous = (self.nrows == 0 or
+                            subhalo_id[-1] - subhalo_id[0] == self.nrows - 1)
+        if not self._contiguous:
+            self._sorter = np.argsort(subhalo_id, kind='stable')
+        self._steps = None
+
+    def _rows_of(self, ids):
+        """
+        Row numbers of the given subhalo IDs (-1 if not in the chunk).
+        """
+        if self._contiguous:
+            rows = ids - self._first_id
+            in_chunk = (rows >= 0) & (rows < self.nrows)
+        else:
+            pos = np.searchsorted(self._subhalo_id, ids, sorter=self._sorter)
+            rows = self._sorter[np.minimum(pos, self.nrows-1)]
+            in_chunk = self._subhalo_id[rows] == ids
+        return np.where(in_chunk, rows, -1)
+
+    def _next_rows(self, rows):
+        """
+        Row of the descendant of each of the given rows, or the row
+        itself if its descendant chain stops there.
+        """
+        desc_id = self._descendant_id[rows]
+        desc_row = self._rows_of(desc_id)
+        has_desc = (desc_id >= self._root_descendant_id[rows]) & (desc_row >= 0)
+        return np.where(has_desc, desc_row, rows)
+
+    @property
+    def steps(self):
+        """
+        Number of descendant links between every row and the end of
+        its chain, computed by pointer jumping: after k passes, jump[i]
+        is the 2**k-th descendant of row i (or the end of its chain).
+        """
+        if self._steps is None:
+            rows = np.arange(self.nrows)
+            jump = self._next_rows(rows)
+            steps = (jump != rows).astype(np.int64)
+            while True:
+                next_jump = jump[jump]
+                if np.array_equal(next_jump, jump):
+                    break
+                steps = steps + steps[jump]
+                jump = next_jump
+            self._steps = steps
+        return self._steps
+
+    def walk(self, start_rows):
+        """
+        Walk from every start row to the end of its descendant chain.
+
+        Returns the visited rows, ordered from the root descendant down
+        to the start row, for all start rows concatenated, together with
+        an offsets array: rows offsets[i]:offsets[i+1] belong to start_rows[i].
+        """
+        start_rows = np.atleast_1d(np.asarray(start_rows, dtype=np.int64))
+
+        # Visit every chain once to get its length, unless there are so
+        # many start rows that pointer jumping over the chunk is cheaper
+        if self._steps is None and 16*len(start_rows) < self.nrows:
+            path = [start_rows]
+            while True:
+                next_rows = self._next_rows(path[-1])
+                if np.array_equal(next_rows, path[-1]):
+                    break
+                path.append(next_rows)
+            path = np.array(path)
+            lengths = 1 + np.count_nonzero(path[1:] != path[:-1], axis=0)
+        else:
+            path = None
+            lengths = self.steps[start_rows] + 1
+        offsets = np.zeros(len(start_rows)+1, dtype=np.int64)
+        offsets[1:] = np.cumsum(lengths)
+
+        indices = np.empty(offsets[-1], dtype=np.int64)
+        last = offsets[1:] - 1
+        cur = start_rows
+        for step in range(lengths.max(initial=0)):
+            if path is not None:
+                cur = path[step]
+            active = step < lengths
+            indices[last[active] - step] = cur[active]
+            if path is None:
+                cur = self._next_rows(cur)
+        return indices, offsets
+
+
 class TreeDB:
     """
     Python class to extract information from merger tree files
@@ -103,7 +374,8 @@ class TreeDB:
     -----------------------------------------------------------------------
     """
 
-    def __init__(self, treedir, name='tree_extended', filenum=-1):
+    def __init__(self, treedir, name='tree_extended', filenum=-1,
+                 max_open_files=32, rdcc_nbytes=None, manifest=None):
         """
         Create a TreeDB object.
 
@@ -116,37 +388,63 @@ class TreeDB:
         filenum : int, optional
                File number of the tree file of interest; -1 loads data from
                all tree files (default).
+        max_open_files : int, optional
+               Maximum number of tree files and of offset files kept open
+               at the same time (the least recently used file is closed
+               when the limit is reached). Default 32 of each.
+        rdcc_nbytes : int or None, optional
+               Size in bytes of the HDF5 chunk cache of each open file;
+               None uses the h5py default (1 MB).
+        manifest : sim_manifest.SimManifest, string, None or False, optional
+               Manifest (or path to one) with the tree files and file
+               offsets, used instead of checking the paths and reading
+               offsets_000.hdf5. None uses the manifest registered for
+               treedir (e.g. by SetupPaths.tng), if any; False never
+               uses one.
         """
-
-        # Check that a few files/paths exist
-        for rel_path in ['%s.0.hdf5' % (name), 'offsets']:
-            if not os.path.exists(treedir + '/' + rel_path):
-                print('Path not found: ' + treedir + '/' + rel_path)
-                sys.exit()
         if filenum != -1:
             print('Currently no support for individual tree files.')
             sys.exit()
 
-        # Load file offsets
-        f = h5py.File('%s/offsets/offsets_000.hdf5' % (treedir), 'r')
-        self._file_offsets = f['FileOffsets']['SubLink'][()]
-        f.close()
+        manifest = sim_manifest.lookup(treedir, manifest)
+        trees = None if manifest is None else manifest.trees(name)
+        self._offset_snapshots = None
+        if trees is not None:
+            self._file_offsets = np.array(trees['file_offsets'], dtype=np.int64)
+            self._offset_snapshots = trees['offset_snapshots']
+        else:
+            # Check that a few files/paths exist
+            for rel_path in ['%s.0.hdf5' % (name), 'offsets']:
+                if not os.path.exists(treedir + '/' + rel_path):
+                    print('Path not found: ' + treedir + '/' + rel_path)
+                    sys.exit()
+
+            # Load file offsets
+            f = io_stats.open_file('%s/offsets/offsets_000.hdf5' % (treedir), 'r')
+            self._file_offsets = io_stats.read(f['FileOffsets']['SubLink'], (), 'offsets')
+            f.close()
 
         # Set some attributes
         self._treedir = treedir
         self._name = name
         self._filenum = filenum
-        self._tree_files = {} # open tree files "on demand"
-        self._offset_files = {} # same with offset files
+        self._tree_files = _FilePool(max_open_files, rdcc_nbytes) # open tree files "on demand"
+        self._offset_files = _FilePool(max_open_files, rdcc_nbytes) # same with offset files
+        self._offset_index = {} # preloaded SubLink offset columns (see preload_offsets)
 
     def __del__(self):
         """
         Close files. All open objects become invalid.
         """
-        for f in self._tree_files.values():
-            f.close()
-        for f in self._offset_files.values():
-            f.close()
+        self.close()
+
+    def close(self):
+        """
+        Close all open tree and offset files. They are reopened
+        on demand if the TreeDB object is used again.
+        """
+        self._tree_files.close()
+        self._offset_files.close()
 
     def _get_filenum(self, rownum):
         """
@@ -158,24 +456,81 @@ class TreeDB:
     def _get_tree_file(self, filenum):
         """
         Get tree file.
-        If necessary, add new entry to tree files dictionary.
+        If necessary, open it in the pool of tree files.
         Otherwise, return existing one.
         """
-        if filenum not in self._tree_files.keys():
-            self._tree_files[filenum] = h5py.File(
-                '%s/%s.%d.hdf5' % (self._treedir, self._name, filenum), 'r')
-        return self._tree_files[filenum]
+        return self._tree_files.get(
+            filenum, '%s/%s.%d.hdf5' % (self._treedir, self._name, filenum))
 
     def _get_offset_file(self, snapnum):
         """
         Get offsets file.
-        If necessary, add new entry to offset files dictionary.
+        If necessary, open it in the pool of offset files.
         Otherwise, return existing one.
         """
-        if snapnum not in self._offset_files.keys():
-            self._offset_files[snapnum] = h5py.File(
-                '%s/offsets/offsets_%s.hdf5' % (self._treedir, str(snapnum).zfill(3)), 'r')
-        return self._offset_files[snapnum]
+        return self._offset_files.get(
+            snapnum, '%s/offsets/offsets_%s.hdf5' % (self._treedir, str(snapnum).zfill(3)))
+
+    def _get_sublink_offsets(self, snapnum):
+        """
+        Get the SubLink offset columns (RowNum, SubhaloID, LastProgenitorID)
+        of a snapshot: the preloaded array if there is one, otherwise the
+        group in the offsets file. Both are indexed as
+        sublink['RowNum'][subfind_id].
+        """
+        if snapnum in self._offset_index:
+            return self._offset_index[snapnum]
+        return self._get_offset_file(snapnum)['Subhalo']['SubLink']
+
+    def preload_offsets(self, snapnums=None, cachedir=None):
+        """
+        Load the SubLink offset columns of the given snapshots into memory,
+        so that subhalo lookups index arrays instead of reading the
+        offsets files.
+
+        Parameters
+        ----------
+        snapnums : list of ints or None, optional
+                Snapshots to preload. By default, every snapshot with an
+                offsets file.
+        cachedir : string or None, optional
+                If given, the columns of each snapshot are stored in
+                cachedir/offsets_NNN.npy (a structured array, written
+                once and rebuilt if the offsets file is newer) and
+                memory-mapped from there instead of being read into memory.
+        """
+        if snapnums is None and self._offset_snapshots is not None:
+            snapnums = self._offset_snapshots
+        if snapnums is None:
+            snapnums = sorted(int(fname[8:11]) for fname in os.listdir(self._treedir + '/offsets')
+                              if fname.startswith('offsets_') and fname.endswith('.hdf5'))
+        if cachedir is not None:
+            os.makedirs(cachedir, exist_ok=True)
+
+        fields = ['RowNum', 'SubhaloID', 'LastProgenitorID']
+        for snapnum in snapnums:
+            path = '%s/offsets/offsets_%s.hdf5' % (self._treedir, str(snapnum).zfill(3))
+            if cachedir is not None:
+                cachepath = '%s/offsets_%s.npy' % (cachedir, str(snapnum).zfill(3))
+                if (os.path.exists(cachepath) and
+                        os.path.getmtime(cachepath) >= os.path.getmtime(path)):
+                    self._offset_index[snapnum] = np.load(cachepath, mmap_mode='r')
+                    continue
+
+            sublink = self._get_offset_file(snapnum)['Subhalo']['SubLink']
+            index = np.empty(sublink['RowNum'].shape[0],
+                             dtype=[(name, sublink[name].dtype) for name in fields])
+            for name in fields:
+                index[name] = io_stats.read(sublink[name], (), 'offsets')
+
+            if cachedir is not None:
+                # Write to a temporary file first, so that other processes
+                # never see a partially written cache file
+                tmppath = '%s.%d.tmp.npy' % (cachepath[:-4], os.getpid())
+                np.save(tmppath, index)
+                os.replace(tmppath, cachepath)
+                index = np.load(cachepath, mmap_mode='r')
+            self._offset_index[snapnum] = index
 
     def get_main_branch(self, snapnum, subfind_id, keysel=None):
         """
@@ -193,9 +548,9 @@ class TreeDB:
                 can be very time- and memory-expensive.
         """
         # Get row number and other info from offset tables
-        f = self._get_offset_file(snapnum)
-        rownum = f['Subhalo']['SubLink']['RowNum'][subfind_id]  # "global" row number
-        subhalo_id = f['Subhalo']['SubLink']['SubhaloID'][subfind_id]
+        sublink = self._get_sublink_offsets(snapnum)
+        rownum = io_stats.read(sublink['RowNum'], subfind_id, 'offsets')  # "global" row number
+        subhalo_id = io_stats.read(sublink['SubhaloID'], subfind_id, 'offsets')
         #main_leaf_progenitor_id = f['MainLeafProgenitorID'][subfind_id]
         ## MAIN LEAF PROGENETOR IS NOT STORED IN OFFSET FILES ##
         ## SO DEAL WITH IT LATER ##
@@ -212,12 +567,221 @@ class TreeDB:
 
         # Create branch instance
         treefile = self._get_tree_file(filenum)
-        main_leaf_progenitor_id = treefile['MainLeafProgenitorID'][row_start]
+        main_leaf_progenitor_id = io_stats.read(treefile['MainLeafProgenitorID'], row_start, 'tree')
         row_end = row_start + (main_leaf_progenitor_id - subhalo_id)
         
         branch = _AdjacentRows(treefile, row_start, row_end, keysel=keysel)
         return branch
 
+    def get_main_branches(self, snapnums, subfind_ids, keysel=None, max_gap=1024):
+        """
+        Bulk version of get_main_branch. For many subhalos specified by
+        their snapshot numbers and Subfind IDs, return all their main
+        branches at once. Offset and tree lookups are grouped by file,
+        sorted, and merged into large contiguous reads, instead of
+        reading a few rows per subhalo.
+
+        Parameters
+        ----------
+        snapnums : int or array of ints
+        subfind_ids : int or array of ints
+        keysel: list of strings or None, optional
+                This argument specifies which fields from the Subfind catalog
+                should be loaded. By default, all fields are loaded, which
+                can be very time- and memory-expensive.
+        max_gap : int, optional
+                Requested rows separated by at most this many unrequested
+                rows are read in a single contiguous block.
+
+        Returns
+        -------
+        branches : _RaggedRows
+                Flat array per field plus an offsets array; the main branch
+                of the i-th subhalo is branches.get_branch(i). Subhalos not
+                found in the trees have empty branches and found[i] = False.
+        """
+        found, filenum, row_start, subhalo_id = self._get_rows_bulk(
+            snapnums, subfind_ids, max_gap)
+        nbranches = len(found)
+
+        # Branch lengths from MainLeafProgenitorID
+        lengths = np.zeros(nbranches, dtype=np.int64)
+        for fnum in np.unique(filenum[found]):
+            sel = np.flatnonzero(filenum == fnum)
+            treefile = self._get_tree_file(fnum)
+            main_leaf_progenitor_id = _read_rows(
+                treefile['MainLeafProgenitorID'], row_start[sel], max_gap)
+            lengths[sel] = main_leaf_progenitor_id - subhalo_id[sel] + 1
+        offsets = np.zeros(nbranches+1, dtype=np.int64)
+        offsets[1:] = np.cumsum(lengths)
+
+        # Local row number and tree file of every output row
+        branch_of_row = np.repeat(np.arange(nbranches), lengths)
+        rows = row_start[branch_of_row] + np.arange(offsets[-1]) - offsets[branch_of_row]
+        return self._read_ragged(filenum[branch_of_row], rows, offsets, found,
+                                 keysel, max_gap)
+
+    def get_future_branches(self, snapnums, subfind_ids, keysel=None, max_gap=1024):
+        """
+        Bulk version of get_future_branch. For many subhalos specified by
+        their snapshot numbers and Subfind IDs, return all the subhalos
+        between SubhaloID and RootDescendantID, following DescendantID
+        links. Only the ID columns of the rows between the root descendant
+        and the given subhalos are read (once per tree, in merged blocks);
+        the other fields are read only for the rows on the future branches.
+
+        Parameters
+        ----------
+        snapnums : int or array of ints
+        subfind_ids : int or array of ints
+        keysel: list of strings or None, optional
+                This argument specifies which fields from the Subfind catalog
+                should be loaded. By default, all fields are loaded, which
+                can be very time- and memory-expensive.
+        max_gap : int, optional
+                Requested rows separated by at most this many unrequested
+                rows are read in a single contiguous block.
+
+        Returns
+        -------
+        branches : _RaggedRows
+                Same as get_main_branches; every branch is ordered from
+                the root descendant down to the given subhalo, as in
+                get_future_branch.
+        """
+        found, filenum, row_end, subhalo_id = self._get_rows_bulk(
+            snapnums, subfind_ids, max_gap)
+        nbranches = len(found)
+
+        lengths = np.zeros(nbranches, dtype=np.int64)
+        branch_rows = np.empty(nbranches, dtype=object)
+        for fnum in np.unique(filenum[found]):
+            sel = np.flatnonzero(filenum == fnum)
+            treefile = self._get_tree_file(fnum)
+            root_descendant_id = _read_rows(
+                treefile['RootDescendantID'], row_end[sel], max_gap)
+            row_start = row_end[sel] - (subhalo_id[sel] - root_descendant_id)
+
+            # One chunk of rows per tree, from the root descendant to the
+            # last requested subhalo in that tree
+            roots, tree_of_sel = np.unique(row_start, return_inverse=True)
+            tree_end = np.zeros(len(roots), dtype=np.int64)
+            np.maximum.at(tree_end, tree_of_sel, row_end[sel])
+            ids = {}
+            for field_name in ['SubhaloID', 'DescendantID', 'RootDescendantID']:
+                ids[field_name] = _read_ranges(treefile[field_name], roots, tree_end+1, max_gap)
+
+            for k in range(len(roots)):
+                in_tree = np.flatnonzero(tree_of_sel == k)
+                walker = _DescendantWalker(ids['SubhaloID'][k], ids['DescendantID'][k],
+                                           ids['RootDescendantID'][k])
+                indices, tree_offsets = walker.walk(row_end[sel[in_tree]] - roots[k])
+                for j, b in enumerate(sel[in_tree]):
+                    branch_rows[b] = roots[k] + indices[tree_offsets[j]:tree_offsets[j+1]]
+                    lengths[b] = len(branch_rows[b])
+        offsets = np.zeros(nbranches+1, dtype=np.int64)
+        offsets[1:] = np.cumsum(lengths)
+
+        branch_of_row = np.repeat(np.arange(nbranches), lengths)
+        if offsets[-1] > 0:
+            rows = np.concatenate(branch_rows[found])
+        else:
+            rows = np.zeros(0, dtype=np.int64)
+        return self._read_ragged(filenum[branch_of_row], rows, offsets, found,
+                                 keysel, max_gap)
+
+    def get_lineage_keys(self, snapnums, subfind_ids, max_gap=1024):
+        """
+        For many subhalos specified by their snapshot numbers and Subfind
+        IDs, return the key of their lineage: the tree file, the
+        RootDescendantID and the local row of the main leaf progenitor.
+        Subhalos with the same key have the same full (future + main)
+        branch, i.e. the descendant links from the main leaf progenitor
+        to the root descendant. Only two columns of the tree files are
+        read, at the rows of the given subhalos.
+
+        Parameters
+        ----------
+        snapnums : int or array of ints
+        subfind_ids : int or array of ints
+        max_gap : int, optional
+                Requested rows separated by at most this many unrequested
+                rows are read in a single contiguous block.
+
+        Returns
+        -------
+        found : array of bools
+        keys : (n, 3) array of ints
+                (filenum, RootDescendantID, main leaf row) of each subhalo;
+                -1 where found is False
+        """
+        found, filenum, row, subhalo_id = self._get_rows_bulk(
+            snapnums, subfind_ids, max_gap)
+        keys = np.full((len(found), 3), -1, dtype=np.int64)
+        keys[:, 0] = filenum
+        for fnum in np.unique(filenum[found]):
+            sel = np.flatnonzero(filenum == fnum)
+            treefile = self._get_tree_file(fnum)
+            plan = _plan_reads(row[sel], max_gap)
+            keys[sel, 1] = _read_rows(treefile['RootDescendantID'], None, plan=plan)
+            main_leaf_progenitor_id = _read_rows(treefile['MainLeafProgenitorID'], None, plan=plan)
+            keys[sel, 2] = row[sel] + (main_leaf_progenitor_id - subhalo_id[sel])
+        return found, keys
+
+    def _get_rows_bulk(self, snapnums, subfind_ids, max_gap):
+        """
+        Look up many subhalos in the offset tables, one snapshot at a time.
+        Returns whether each subhalo was found, its tree file number,
+        its "local" row number (i.e., in the given tree file) and its SubhaloID.
+        """
+        snapnums, subfind_ids = np.broadcast_arrays(
+            np.atleast_1d(snapnums), np.atleast_1d(subfind_ids))
+        nsubs = len(snapnums)
+
+        rownum = np.empty(nsubs, dtype=np.int64)
+        subhalo_id = np.empty(nsubs, dtype=np.int64)
+        for snapnum in np.unique(snapnums):
+            sel = np.flatnonzero(snapnums == snapnum)
+            sublink = self._get_sublink_offsets(snapnum)
+            if isinstance(sublink, np.ndarray):
+                rownum[sel] = sublink['RowNum'][subfind_ids[sel]]
+                subhalo_id[sel] = sublink['SubhaloID'][subfind_ids[sel]]
+                continue
+            plan = _plan_reads(subfind_ids[sel], max_gap)
+            rownum[sel] = _read_rows(sublink['RowNum'], None, plan=plan, kind='offsets')
+            subhalo_id[sel] = _read_rows(sublink['SubhaloID'], None, plan=plan, kind='offsets')
+        found = rownum != -1
+
+        filenum = np.full(nsubs, -1, dtype=np.int64)
+        filenum[found] = self._get_filenum(rownum[found])
+        local_row = np.zeros(nsubs, dtype=np.int64)
+        local_row[found] = rownum[found] - self._file_offsets[filenum[found]]
+        return found, filenum, local_row, subhalo_id
+
+    def _read_ragged(self, file_of_row, rows, offsets, found, keysel, max_gap):
+        """
+        Read the given local rows of each tree file into a _RaggedRows,
+        reading each tree file in as few blocks as possible.
+        """
+        # Find out which fields to add
+        treefile = self._get_tree_file(0)
+        if keysel is None:
+            keysel = list(treefile.keys())
+        fields = {}
+        for field_name in keysel:
+            dset = treefile[field_name]
+            fields[field_name] = np.empty((offsets[-1],) + dset.shape[1:], dtype=dset.dtype)
+
+        # Add them
+        for fnum in np.unique(file_of_row):
+            sel = np.flatnonzero(file_of_row == fnum)
+            treefile = self._get_tree_file(fnum)
+            plan = _plan_reads(rows[sel], max_gap)
+            for field_name in keysel:
+                fields[field_name][sel] = _read_rows(treefile[field_name], None, plan=plan)
+
+        return _RaggedRows(fields, offsets, found)
+
     def get_all_progenitors(self, snapnum, subfind_id, keysel=None):
         """
         For a subhalo specified by its snapshot number and Subfind ID,
@@ -236,10 +800,10 @@ class TreeDB:
         """
 
         # Get row number and other info from offset tables
-        f = self._get_offset_file(snapnum)
-        rownum = f['Subhalo']['SubLink']['RowNum'][subfind_id]  # "global" row number
-        subhalo_id = f['Subhalo']['SubLink']['SubhaloID'][subfind_id]
-        last_progenitor_id = f['Subhalo']['SubLink']['LastProgenitorID'][subfind_id]
+        sublink = self._get_sublink_offsets(snapnum)
+        rownum = io_stats.read(sublink['RowNum'], subfind_id, 'offsets')  # "global" row number
+        subhalo_id = io_stats.read(sublink['SubhaloID'], subfind_id, 'offsets')
+        last_progenitor_id = io_stats.read(sublink['LastProgenitorID'], subfind_id, 'offsets')
         if rownum == -1:
             print('Subhalo not found: snapnum = %d, subfind_id = %d.' % (snapnum, subfind_id))
             print('This object probably has zero DM or baryonic (stars + SF gas) elements.')
@@ -271,9 +835,9 @@ class TreeDB:
                 can be very time- and memory-expensive.
         """
         # Get row number and other info from offset tables
-        f = self._get_offset_file(snapnum)
-        rownum = f['Subhalo']['SubLink']['RowNum'][subfind_id]  # "global" row number
-        subhalo_id = f['Subhalo']['SubLink']['SubhaloID'][subfind_id]
+        sublink = self._get_sublink_offsets(snapnum)
+        rownum = io_stats.read(sublink['RowNum'], subfind_id, 'offsets')  # "global" row number
+        subhalo_id = io_stats.read(sublink['SubhaloID'], subfind_id, 'offsets')
         if rownum == -1:
             print('Subhalo not found: snapnum = %d, subfind_id = %d.' % (snapnum, subfind_id))
             print('This object probably has zero DM or baryonic (stars + SF gas) elements.')
@@ -283,7 +847,7 @@ class TreeDB:
         filenum = self._get_filenum(rownum)
         row_end = rownum - self._file_offsets[filenum]
         treefile = self._get_tree_file(filenum)
-        root_descendant_id = treefile['RootDescendantID'][row_end]
+        root_descendant_id = io_stats.read(treefile['RootDescendantID'], row_end, 'tree')
 
         # We know the row number of the root descendant without searching for it
         row_start = row_end - (subhalo_id - root_descendant_id)
@@ -349,15 +913,11 @@ class TreeDB:
             kwargs['keysel'] = tmp_list
 
         subtree = self._get_subhalos_between_root_and_given(snapnum, subfind_id, **kwargs)
-        # Unfortunately, there are no shortcuts in this case and we must
-        # proceed iteratively. This is almost at the limit of what one
-        # can do when reading trees in "database mode."
-        desc_id = subtree.DescendantID[subtree._index_given_sub]
-        root_desc_id = subtree.RootDescendantID[subtree._index_given_sub]
-        indices = [subtree._index_given_sub]
-        while desc_id >= root_desc_id:
-            cur_index = np.where(subtree.SubhaloID == desc_id)[0][0]
-            indices.append(cur_index)
-            desc_id = subtree.DescendantID[cur_index]
-        indices = indices[::-1]  # reverse
+        # There are no shortcuts in this case and we must follow the
+        # descendant links, but the SubhaloID -> row index is built once
+        # for the whole subtree (see _DescendantWalker) instead of
+        # searching the subtree at every step.
+        walker = _DescendantWalker(subtree.SubhaloID, subtree.DescendantID,
+                                   subtree.RootDescendantID)
+        indices, _ = walker.walk(subtree._index_given_sub)
         return subtree._get_subset(indices)
@@ -0,0 +1,216 @@
+"""
+Statistics of the pair samples over many abundance matching
+realizations, computed without storing the stellar masses of every pair
+in every realization.
+
+The realizations are generated in chunks (AbundanceMatching.realizations
+with one (nchunk, 8) parameter draw per chunk). Each chunk is cut into
+the low/high mass, major/minor samples with the same group mass, primary
+stellar mass and mass ratio cuts as the median pairs, and reduced to
+running counts before the next chunk is generated, so the memory use
+does not depend on the number of realizations.
+
+Usage:
+------
+    reducer = RealizationReducer(npairs)
+    stream_realizations(reducer, maxmass1, maxmass2, groupmass, redshift,
+                        nrealizations=1000, rng=numpy.random.default_rng(seed))
+    stats = reducer.result()
+
+    stats["Fraction"]["high-major"]       (npairs,) fraction of realizations
+                                          in which the pair is a high mass
+                                          major pair
+    stats["Count"]["high-major"]          (nrealizations,) number of high
+                                          mass major pairs per realization
+    stats["Histogram"]["high-major"][key] histogram of key over the selected
+                                          pairs of all realizations
+    stats["Quantiles"][key]               (npairs, nquantiles) quantiles of
+                                          key of each pair over realizations
+    -- NOTE:
+        - maxmass1, maxmass2 are the (peak) halo masses of Sub1 and Sub2 of
+            each pair in Msun, groupmass the Group Mass in 1e10 Msun
+        - stellar masses are in 1e10 Msun as in the pairs/*.hdf5 files;
+            in each realization the primary is the subhalo with the larger
+            stellar mass of the two
+        - histograms and quantiles are of log10(stellar mass) and
+            log10(stellar mass ratio); the quantiles are interpolated in
+            the per-pair histograms, so their resolution is the bin width
+            (values outside the bins are counted in the first/last bin)
+"""
+
+__date__   = "October 2026"
+
+import numpy as np
+
+from harvesting_tools.abundance_matching import AbundanceMatching
+from harvesting_tools.group_pairs import get_primmask, get_groupmask
+
+samples = [("high", "major"), ("high", "minor"), ("low", "major"), ("low", "minor")]
+
+# log10 bins of the reduced quantities
+default_bins = {"Sub1 Stellar Mass": np.linspace(-4, 2, 121),
+                "Sub2 Stellar Mass": np.linspace(-4, 2, 121),
+                "Stellar Mass Ratio": np.linspace(-3, 0, 121)}
+
+
+def sample_masks(stell1, stell2, groupmass):
+    """
+    Sample membership of each pair in each realization
+
+    Parameters:
+    -----------
+    stell1, stell2: (npairs, nrealizations) arrays
+        stellar masses of the primary and secondary in 1e10 Msun
+    groupmass: (npairs,) array
+        group mass in 1e10 Msun
+
+    Returns:
+    --------
+    masks: dict
+        "<mass>-<ratio>": (npairs, nrealizations) array of bool
+    """
+    ratio = stell2/stell1
+    major = ratio > 1/4
+    minor = (ratio > 1/10) & ~major
+    masks = {}
+    for size, massratio in samples:
+        group_mask = get_groupmask(groupmass, size)[:, np.newaxis]
+        primary_mask = get_primmask(stell1, size)
+        ratio_mask = major if massratio == "major" else minor
+        masks[f"{size}-{massratio}"] = group_mask & primary_mask & ratio_mask
+    return masks
+
+
+def _binned(values, edges):
+    """bin of each value, with values outside the edges in the end bins"""
+    return np.clip(np.searchsorted(edges, values, side='right') - 1, 0, len(edges) - 2)
+
+
+class RealizationReducer:
+    def __init__(self, npairs, bins=None, quantiles=(0.16, 0.5, 0.84)):
+        """
+        Running counts of the pair samples over chunks of realizations
+
+        Parameters:
+        -----------
+        npairs: int
+            number of pairs
+        bins: dict or None
+            log10 bin edges of each quantity (default: default_bins)
+        quantiles: tuple
+            quantiles returned by result()
+        """
+        self.npairs = npairs
+        self.bins = default_bins if bins is None else bins
+        self.quantiles = quantiles
+        self.nrealizations = 0
+        self.members = {f"{size}-{massratio}": np.zeros(npairs, dtype=np.int64)
+                        for size, massratio in samples}
+        self.counts = {sample: [] for sample in self.members}
+        self.histograms = {sample: {key: np.zeros(len(edges) - 1, dtype=np.int64)
+                                    for key, edges in self.bins.items()}
+                           for sample in self.members}
+        self.pair_histograms = {key: np.zeros((npairs, len(edges) - 1), dtype=np.int32)
+                                for key, edges in self.bins.items()}
+
+    def update(self, stell1, stell2, groupmass):
+        """
+        Adds a chunk of realizations
+
+        Parameters:
+        -----------
+        stell1, stell2: (npairs, nchunk) arrays
+            stellar masses of the primary and secondary in 1e10 Msun
+        groupmass: (npairs,) array
+            group mass in 1e10 Msun
+        """
+        nchunk = stell1.shape[1]
+        values = {"Sub1 Stellar Mass": np.log10(stell1),
+                  "Sub2 Stellar Mass": np.log10(stell2),
+                  "Stellar Mass Ratio": np.log10(stell2/stell1)}
+        binned = {key: _binned(values[key], edges) for key, edges in self.bins.items()}
+        nbins = {key: len(edges) - 1 for key, edges in self.bins.items()}
+
+        for sample, mask in sample_masks(stell1, stell2, groupmass).items():
+            self.members[sample] += mask.sum(axis=1)
+            self.counts[sample].append(mask.sum(axis=0))
+            for key, index in binned.items():
+                self.histograms[sample][key] += np.bincount(index[mask], minlength=nbins[key])
+
+        # per-pair histograms: one bincount over (pair, bin)
+        pair_offset = np.arange(self.npairs)[:, np.newaxis]
+        for key, index in binned.items():
+            flat = (pair_offset*nbins[key] + index).ravel()
+            self.pair_histograms[key] += np.bincount(
+                flat, minlength=self.npairs*nbins[key]).reshape(self.npairs, nbins[key]).astype(np.int32)
+        self.nrealizations += nchunk
+
+    def pair_quantiles(self, key):
+        """(npairs, nquantiles) quantiles of key for each pair, from its histogram"""
+        edges = self.bins[key]
+        hist = self.pair_histograms[key]
+        cdf = np.cumsum(hist, axis=1)/np.maximum(self.nrealizations, 1)
+        out = np.full((self.npairs, len(self.quantiles)), np.nan)
+        if self.nrealizations == 0:
+            return out
+        rows = np.arange(self.npairs)
+        for i, q in enumerate(self.quantiles):
+            # first bin in which the cdf reaches q, linear within the bin
+            b = np.minimum((cdf < q).sum(axis=1), len(edges) - 2)
+            below = np.where(b > 0, cdf[rows, np.maximum(b - 1, 0)], 0)
+            inbin = hist[rows, b]/self.nrealizations
+            with np.errstate(divide='ignore', invalid='ignore'):
+                frac = np.where(inbin > 0, (q - below)/inbin, 0)
+            out[:, i] = edges[b] + np.clip(frac, 0, 1)*(edges[b + 1] - edges[b])
+        return out
+
+    def result(self):
+        """fractions, counts, histograms and quantiles of the realizations so far"""
+        n = max(self.nrealizations, 1)
+        return {"Realizations": self.nrealizations,
+                "Fraction": {sample: members/n for sample, members in self.members.items()},
+                "Count": {sample: (np.concatenate(counts) if counts else np.zeros(0, dtype=np.int64))
+                          for sample, counts in self.counts.items()},
+                "Histogram": self.histograms,
+                "Bins": self.bins,
+                "Quantiles": {key: self.pair_quantiles(key) for key in self.bins}}
+
+
+def stream_realizations(reducer, maxmass1, maxmass2, groupmass, redshift, nrealizations,
+                        rng, chunksize=50, dtype=np.float64):
+    """
+    Generates the stellar masses of the pairs chunksize realizations at a
+    time and adds them to the reducer
+
+    Parameters:
+    -----------
+    reducer: RealizationReducer
+        running statistics, updated in place
+    maxmass1, maxmass2: (npairs,) arrays
+        halo masses of Sub1 and Sub2 in Msun (the abundance matching input)
+    groupmass: (npairs,) array
+        group mass in 1e10 Msun
+    redshift: float
+        redshift of the pairs
+    nrealizations: int
+        total number of realizations
+    rng: numpy.random.Generator
+        random number generator for the relation parameters
+    chunksize: int
+        realizations per chunk; the largest arrays are npairs x chunksize
+
+    Returns:
+    --------
+    reducer
+    """
+    halos = np.concatenate([np.asarray(maxmass1, dtype=np.float64),
+                            np.asarray(maxmass2, dtype=np.float64)])
+    npairs = len(halos)//2
+    groupmass = np.asarray(groupmass)
+    for lo in range(0, nrealizations, chunksize):
+        am = AbundanceMatching(halos, redshift, min(chunksize, nrealizations - lo), rng=rng)
+        stellar = am.realizations(params=am.draw_parameters(), dtype=dtype)/1e10
+        stell1 = np.maximum(stellar[:npairs], stellar[npairs:])
+        stell2 = np.minimum(stellar[:npairs], stellar[npairs:])
+        reducer.update(stell1, stell2, groupmass)
+    return reducer
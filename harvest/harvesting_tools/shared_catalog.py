@@ -0,0 +1,203 @@
+"""
+Group catalog fields loaded once into shared memory and read by any
+number of worker processes, instead of every worker reading its own copy
+with subfind_catalog.
+
+The owner reads the chunks of the catalog straight into memory-mapped
+.npy files in a RAM-backed directory (/dev/shm by default, or any
+scratch directory). Workers get a small picklable spec (file names and
+the header values) and map the same files read-only, so a job with many
+workers holds one copy of the catalog (in the page cache).
+
+Usage:
+------
+    with SharedCatalog(paths.tng_base, 99, ["SubhaloPos", "SubhaloGrNr",
+                                            "Group_R_TopHat200"]) as shared:
+        with ProcessPoolExecutor(64, initializer=_init_worker,
+                                 initargs=(shared.spec,)) as pool:
+            ...
+
+with, in the worker module:
+    def _init_worker(spec):
+        _worker['cat'] = attach_catalog(spec)
+
+    def _task(...):
+        pos = _worker['cat'].SubhaloPos   # read-only, shared between processes
+    -- NOTE:
+        - the owner keeps the files while its reference count is above
+            zero: one reference at creation, acquire() adds one, release()
+            (or leaving the with block) removes one; at zero the files
+            are removed. Processes that still use the arrays keep their
+            mapping until the arrays are garbage collected
+        - attach_catalog counts the attachments of each process, and
+            detach_catalog drops the views once the count reaches zero
+        - the views have the attributes of subfind_catalog (ngroups,
+            nsubs, redshift, boxsize and the fields), so they can be
+            given to e.g. group_pairs
+        - the files of a job that is killed stay in scratchdir, in a
+            harvest_catalog_<token> directory
+"""
+
+__date__   = "October 2026"
+
+import os
+import uuid
+import shutil
+import weakref
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from harvesting_tools.readsubfHDF5_Py3 import subfind_catalog, _read_subfind_chunk
+
+default_fields = ["SubhaloPos", "SubhaloGrNr", "Group_R_TopHat200"]
+
+header_keys = ["ngroups", "nsubs", "nids", "redshift", "boxsize"]
+
+# views attached in this process: token -> [CatalogView, number of attachments]
+_attached = {}
+
+
+def default_scratchdir():
+    """/dev/shm (memory, not disk) if there is one, otherwise the temporary directory"""
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+class SharedCatalog:
+    def __init__(self, basedir, snapnum, keys=default_fields, scratchdir=None,
+                 nworkers=1, **catalog_kwargs):
+        """
+        Reads the given fields of a group catalog into shared memory
+
+        Parameters:
+        -----------
+        basedir, snapnum:
+            group catalog, as for subfind_catalog
+        keys: list of str
+            datablocks to share
+        scratchdir: str or None
+            directory of the memory-mapped files (default: /dev/shm)
+        nworkers: int
+            chunks read at the same time (threads)
+        catalog_kwargs:
+            other arguments of subfind_catalog (e.g. manifest)
+        """
+        if scratchdir is None:
+            scratchdir = default_scratchdir()
+        cat = subfind_catalog(basedir, snapnum, lazy=True, **catalog_kwargs)
+        token = uuid.uuid4().hex[:16]
+        self.directory = os.path.join(scratchdir, f"harvest_catalog_{token}")
+        self._refs = 1
+        self.spec = {"token": token, "fields": {},
+                     "header": {key: getattr(cat, key) for key in header_keys}}
+        os.makedirs(self.directory)
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.directory, ignore_errors=True)
+
+        arrays = {}
+        for key in keys:
+            dname = cat._block_name(key)
+            if dname is None:
+                raise KeyError(f"{key} not in group catalog {cat.filebase}")
+            gname = dname.split("/")[0]
+            dtype = cat._block_dtype(*cat._block_info(key))
+            shape = (int(cat.ngroups if gname == "Group" else cat.nsubs),) + dtype.shape
+            path = os.path.join(self.directory, f"{key}.npy")
+            arrays[dname] = np.lib.format.open_memmap(path, mode="w+", dtype=dtype.base, shape=shape)
+            self.spec["fields"][key] = path
+
+        # what to read from each chunk, as in subfind_catalog._read_blocks
+        reads = []
+        for filenum in range(len(cat._curfiles)):
+            reads.append([(dname, arr, cat._skip[dname.split("/")[0]][filenum])
+                          for dname, arr in arrays.items()
+                          if cat._nrows[dname.split("/")[0]][filenum] > 0])
+        with ThreadPoolExecutor(max_workers=nworkers) as pool:
+            list(pool.map(_read_subfind_chunk, cat._curfiles, reads))
+        for arr in arrays.values():
+            arr.flush()
+        del arrays
+
+    @property
+    def refs(self):
+        return self._refs
+
+    def acquire(self):
+        """adds a reference: the files are kept until the matching release"""
+        if self._refs == 0:
+            raise RuntimeError("SharedCatalog was already released")
+        self._refs += 1
+        return self
+
+    def release(self):
+        """removes a reference; the files are removed when none are left"""
+        if self._refs == 0:
+            return
+        self._refs -= 1
+        if self._refs == 0:
+            detach_catalog(self.spec, force=True)
+            self._finalizer()
+
+    def close(self):
+        """removes the files now, whatever the reference count"""
+        self._refs = 1
+        self.release()
+
+    def view(self):
+        """a view of the catalog in the owner process"""
+        return attach_catalog(self.spec)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class CatalogView:
+    def __init__(self, spec):
+        """
+        Read-only numpy views of the fields of a SharedCatalog
+        """
+        for key, val in spec["header"].items():
+            setattr(self, key, val)
+        for key, path in spec["fields"].items():
+            setattr(self, key, np.load(path, mmap_mode="r"))
+        self._fields = list(spec["fields"].keys())
+
+    def keys(self):
+        return list(self._fields)
+
+    def close(self):
+        """drops the views (the memory is unmapped once no array uses it)"""
+        for key in self._fields:
+            delattr(self, key)
+        self._fields = []
+
+
+def attach_catalog(spec):
+    """
+    The CatalogView of a SharedCatalog spec in this process (the same view
+    for every call, counted until detach_catalog)
+    """
+    token = spec["token"]
+    if token not in _attached:
+        _attached[token] = [CatalogView(spec), 0]
+    _attached[token][1] += 1
+    return _attached[token][0]
+
+
+def detach_catalog(spec=None, force=False):
+    """
+    Removes one attachment of a catalog (all catalogs if spec is None);
+    the views are dropped when the count reaches zero or with force=True
+    """
+    tokens = list(_attached) if spec is None else [spec["token"]]
+    for token in tokens:
+        if token not in _attached:
+            continue
+        _attached[token][1] -= 1
+        if force or spec is None or _attached[token][1] <= 0:
+            _attached.pop(token)[0].close()
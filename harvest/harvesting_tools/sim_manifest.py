@@ -0,0 +1,258 @@
+"""
+Manifest of the files of a TNG simulation directory: the group catalog
+chunks of every snapshot with their header counts and datablocks, the
+merger tree files with their row counts, the SubLink file offsets and the
+offsets_NNN.hdf5 files.
+
+subfind_catalog otherwise finds every chunk with up to four
+os.path.exists calls (naming_Py3.return_general_filebase), opens every
+chunk to read its header, and opens the first chunk again for every
+datablock it looks up; TreeDB checks its paths and opens offsets_000 to
+read the file offsets. With a manifest these come from one small json
+file that is written once.
+
+Usage:
+------
+To write the manifest (once per simulation):
+    python -m harvesting_tools.sim_manifest <path-to-harvest> <path-to-tng>
+
+or from python:
+    manifest = build_manifest(paths.tng_base)
+    manifest.save(manifest_path(paths.path_misc, paths.tng_base))
+
+paths.tng(path_to_tng) then loads data/misc/manifest_<simulation>.json if
+it exists (as paths.tng_manifest) and registers it, and subfind_catalog
+and TreeDB use the registered manifest of their directory:
+    paths.tng(path_to_tng)
+    cat = subfind_catalog(paths.tng_base, 99, lazy=True)   # no path probing
+    tree = TreeDB(paths.tng_trees)                         # no offsets_000
+    -- NOTE:
+        - a manifest can also be given to the readers directly, with
+            manifest=SimManifest or manifest=<path>; manifest=False
+            ignores the registered one
+        - the manifest is not checked against the files: rebuild it if the
+            simulation directory changes (e.g. more snapshots are added)
+        - snapshots that are not in the manifest are read as before
+"""
+
+__date__   = "October 2026"
+
+import os
+import json
+import argparse
+
+import numpy as np
+import h5py
+
+import harvesting_tools.naming_Py3 as naming
+
+# header attributes of the group catalogs that describe the whole catalog
+catalog_header = ["NumFiles", "Ngroups_Total", "Nids_Total", "Nsubgroups_Total", "Redshift", "BoxSize"]
+
+# manifests registered by directory (see register and lookup)
+_registry = {}
+
+
+def _key(path):
+    return os.path.normpath(os.path.abspath(path))
+
+
+def manifest_path(path_misc, tng_base):
+    """default manifest file of a simulation: <misc>/manifest_<simulation>.json"""
+    return f"{path_misc}manifest_{os.path.basename(os.path.normpath(tng_base))}.json"
+
+
+def _python(val):
+    """json serializable copy of an HDF5 attribute"""
+    return val.item() if isinstance(val, np.generic) else val
+
+
+def _catalog_snapshots(basedir):
+    """snapshots with a groups_NNN directory in basedir or basedir/output"""
+    snapshots = set()
+    for directory in [basedir, os.path.join(basedir, "output")]:
+        if not os.path.isdir(directory):
+            continue
+        for dname in os.listdir(directory):
+            if dname.startswith("groups_") and dname[7:].isdigit():
+                snapshots.add(int(dname[7:]))
+    return sorted(snapshots)
+
+
+def scan_catalog(basedir, snapnum, name="fof_subhalo_tab"):
+    """
+    Files, per-chunk row counts, header and datablocks of the group
+    catalog of one snapshot
+
+    Returns:
+    --------
+    entry: dict
+        filebase, files, ngroups and nsubs (rows per chunk), firstgroup
+        and firstsub (global row of the first row of each chunk), header
+        (the catalog_header attributes) and blocks (Group/<key> and
+        Subhalo/<key> datasets of the catalog)
+    """
+    filebase, firstfile = naming.return_subfind_filebase(basedir, snapnum, name, 0)
+    f = h5py.File(firstfile, 'r')
+    nfiles = int(f["Header"].attrs["NumFiles"])
+    f.close()
+    if firstfile == filebase + ".hdf5":
+        files = [firstfile]
+    else:
+        files = [f"{filebase}.{filenum}.hdf5" for filenum in range(nfiles)]
+
+    entry = {"filebase": filebase, "files": files, "ngroups": [], "nsubs": [], "blocks": []}
+    for filenum, curfile in enumerate(files):
+        f = h5py.File(curfile, 'r')
+        attrs = f["Header"].attrs
+        if filenum == 0:
+            entry["header"] = {attr: _python(attrs[attr]) for attr in catalog_header}
+        entry["ngroups"].append(int(attrs["Ngroups_ThisFile"]))
+        entry["nsubs"].append(int(attrs["Nsubgroups_ThisFile"]))
+        # chunks without groups or subhalos have no datasets
+        for gname in ["Group", "Subhalo"]:
+            if gname in f:
+                entry["blocks"].extend(f"{gname}/{key}" for key in f[gname].keys())
+        f.close()
+    entry["blocks"] = sorted(set(entry["blocks"]))
+    # global index of the first group and subhalo of every chunk
+    entry["firstgroup"] = np.concatenate([[0], np.cumsum(entry["ngroups"])[:-1]]).astype(int).tolist()
+    entry["firstsub"] = np.concatenate([[0], np.cumsum(entry["nsubs"])[:-1]]).astype(int).tolist()
+    return entry
+
+
+def scan_trees(treedir, name="tree_extended"):
+    """
+    Tree files and their row counts, the SubLink file offsets and the
+    snapshots with an offsets file
+    """
+    files = []
+    while os.path.exists(f"{treedir}/{name}.{len(files)}.hdf5"):
+        files.append(f"{treedir}/{name}.{len(files)}.hdf5")
+    rows = []
+    for path in files:
+        f = h5py.File(path, 'r')
+        rows.append(int(f["SubhaloID"].shape[0]))
+        f.close()
+    offsetdir = f"{treedir}/offsets"
+    snapshots = sorted(int(fname[8:11]) for fname in os.listdir(offsetdir)
+                       if fname.startswith('offsets_') and fname.endswith('.hdf5'))
+    f = h5py.File(f"{offsetdir}/offsets_000.hdf5", 'r')
+    file_offsets = f['FileOffsets']['SubLink'][()].tolist()
+    f.close()
+    return {"treedir": treedir, "name": name, "files": files, "rows": rows,
+            "file_offsets": file_offsets, "offset_snapshots": snapshots}
+
+
+def build_manifest(tng_base, snapshots=None, name="fof_subhalo_tab", trees=True):
+    """
+    Scans a simulation directory
+
+    Parameters:
+    -----------
+    tng_base: str
+        simulation directory (as given to SetupPaths.tng)
+    snapshots: iterable of int or None
+        group catalogs to include (default: every groups_NNN directory)
+    name: str
+        base name of the group catalog files
+    trees: bool
+        also scan postprocessing/ (trees and offsets)
+
+    Returns:
+    --------
+    manifest: SimManifest
+    """
+    if snapshots is None:
+        snapshots = _catalog_snapshots(tng_base)
+    data = {"base": tng_base, "catalogs": {name: {}}, "trees": None}
+    for snapnum in snapshots:
+        data["catalogs"][name][str(snapnum)] = scan_catalog(tng_base, snapnum, name)
+    treedir = tng_base + "postprocessing/"
+    if trees and os.path.exists(f"{treedir}/offsets/offsets_000.hdf5"):
+        data["trees"] = scan_trees(treedir)
+    return SimManifest(data)
+
+
+class SimManifest:
+    def __init__(self, data, path=None):
+        """
+        Resolved paths and header counts of a simulation directory, as
+        written by build_manifest
+        """
+        self.data = data
+        self.path = path
+        self.base = data["base"]
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f), path)
+
+    def save(self, path):
+        """writes the manifest to a temporary file that replaces path when complete"""
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(self.data, f)
+        os.replace(f"{path}.tmp", path)
+        self.path = path
+
+    def catalog(self, snapnum, name="fof_subhalo_tab"):
+        """entry of a group catalog (see scan_catalog), or None if it is not in the manifest"""
+        return self.data["catalogs"].get(name, {}).get(str(snapnum))
+
+    def snapshots(self, name="fof_subhalo_tab"):
+        return sorted(int(snap) for snap in self.data["catalogs"].get(name, {}))
+
+    def trees(self, name="tree_extended"):
+        """tree entry (see scan_trees), or None if the trees are not in the manifest"""
+        trees = self.data["trees"]
+        if trees is None or trees["name"] != name:
+            return None
+        return trees
+
+
+def register(manifest):
+    """
+    Makes the readers use a manifest for its simulation directory, its
+    output/ directory and its merger trees
+    """
+    _registry[_key(manifest.base)] = manifest
+    _registry[_key(os.path.join(manifest.base, "output"))] = manifest
+    if manifest.data["trees"] is not None:
+        _registry[_key(manifest.data["trees"]["treedir"])] = manifest
+
+
+def lookup(directory, manifest=None):
+    """
+    The manifest the readers should use for a directory: the given one
+    (a SimManifest, or the path to one), none if manifest is False,
+    otherwise the registered one (or None)
+    """
+    if manifest is False:
+        return None
+    if isinstance(manifest, str):
+        return SimManifest.load(manifest)
+    if manifest is not None:
+        return manifest
+    return _registry.get(_key(directory))
+
+
+if __name__ == "__main__":
+    from harvesting_tools.harvest_paths import SetupPaths
+
+    parser = argparse.ArgumentParser(description="Write the file manifest of a simulation")
+    parser.add_argument("harvest", help="path to the harvest base directory")
+    parser.add_argument("tng", help="path to the simulation, e.g. .../TNG100-1/")
+    parser.add_argument("--snapshots", type=int, nargs="+", default=None,
+                        help="group catalogs to include (default: all)")
+    parser.add_argument("--output", default=None, help="manifest file (default: data/misc/manifest_<simulation>.json)")
+    args = parser.parse_args()
+
+    paths = SetupPaths(args.harvest)
+    paths.tng(args.tng, manifest=False)
+    manifest = build_manifest(paths.tng_base, args.snapshots)
+    path = args.output if args.output is not None else manifest_path(paths.path_misc, paths.tng_base)
+    manifest.save(path)
+    ncat = len(manifest.snapshots())
+    print(f"wrote {path}: {ncat} group catalogs"
+          + ("" if manifest.trees() is None else f", {len(manifest.trees()['files'])} tree files"))
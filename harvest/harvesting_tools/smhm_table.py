@@ -0,0 +1,200 @@
+"""
+Lookup table of the abundance matching (stellar mass - halo mass)
+relation of AbundanceMatching, for fast conversions in both directions.
+
+log10(stellar mass) is tabulated on a grid of log10(halo mass) and
+redshift, once per set of relation parameters. Stellar masses are then
+interpolated in the table, and halo masses are found by inverting the
+(monotonic) relation at every redshift of the grid, instead of
+root-finding.
+
+Usage:
+------
+    table = load_smhm_table(paths.path_misc, redshifts=snapdata['Redshift'])
+    mstar = table.stellar_mass(mhalo, redshift)
+    mhalo = table.halo_mass(mstar, redshift)
+    -- NOTE:
+        - masses in Msun, as in AbundanceMatching
+        - the parameters default to the medians of AbundanceMatching
+            (med=True); a row of AbundanceMatching.draw_parameters() gives
+            the table of one realization
+        - between grid redshifts, the table is interpolated linearly in
+            z/(1+z), the variable the relation parameters are linear in;
+            at grid redshifts (e.g. the snapshot redshifts) only the mass
+            is interpolated
+        - table.error and table.inverse_error are the largest differences
+            (in dex) from a direct evaluation at the centres of the grid
+            cells; masses outside the table give NaN
+"""
+
+__date__   = "October 2026"
+
+import os
+import hashlib
+
+import numpy as np
+
+from harvesting_tools.abundance_matching import AbundanceMatching
+
+default_logmhalo = np.linspace(9, 15.5, 651)
+default_redshifts = np.linspace(0, 6, 61)
+
+
+def median_parameters():
+    """the (8,) median relation parameters, in the order of draw_parameters"""
+    return AbundanceMatching(1, 0, 1).draw_parameters(med=True)[0]
+
+
+def direct_stellar_mass(mhalo, redshift, params):
+    """stellar mass of halos at one redshift, evaluated with AbundanceMatching"""
+    am = AbundanceMatching(np.asarray(mhalo, dtype=np.float64), redshift, 1)
+    return am.realizations(params=np.asarray(params)[np.newaxis, :])[:, 0]
+
+
+class SMHMTable:
+    def __init__(self, redshifts=None, logmhalo=None, params=None, table=None, errors=None):
+        """
+        log10 stellar mass on a (redshift, log10 halo mass) grid
+
+        Parameters:
+        -----------
+        redshifts: array or None
+            increasing redshift grid (default: 0 to 6 in steps of 0.1)
+        logmhalo: array or None
+            increasing log10 halo mass grid in Msun (default: 9 to 15.5 in
+            steps of 0.01)
+        params: (8,) array or None
+            relation parameters (default: median_parameters())
+        table: (nredshifts, nmasses) array or None
+            precomputed log10 stellar masses (e.g. read from the cache)
+        errors: tuple or None
+            precomputed (error, inverse_error) of the table (e.g. read from
+            the cache); computed if None, which evaluates the relation
+            directly at every grid cell centre
+        """
+        self.redshifts = np.asarray(default_redshifts if redshifts is None else redshifts, dtype=np.float64)
+        self.logmhalo = np.asarray(default_logmhalo if logmhalo is None else logmhalo, dtype=np.float64)
+        self.params = np.asarray(median_parameters() if params is None else params, dtype=np.float64)
+        if np.any(np.diff(self.redshifts) <= 0) or np.any(np.diff(self.logmhalo) <= 0):
+            raise ValueError("The redshift and halo mass grids must be increasing.")
+        self._x = self.redshifts/(1 + self.redshifts)
+
+        if table is None:
+            table = np.array([np.log10(direct_stellar_mass(10**self.logmhalo, z, self.params))
+                              for z in self.redshifts])
+        self.table = table
+        if np.any(np.diff(self.table, axis=1) <= 0):
+            raise ValueError("The relation is not monotonic in halo mass for these parameters, "
+                             "so it cannot be inverted.")
+        if errors is None:
+            errors = self._errors()
+        self.error, self.inverse_error = (float(err) for err in errors)
+
+    def _rows(self, redshift, npoints):
+        """lower grid row and weight of the upper row of each redshift"""
+        x = np.broadcast_to(np.asarray(redshift, dtype=np.float64), (npoints,))
+        x = x/(1 + x)
+        row = np.clip(np.searchsorted(self._x, x, side='right') - 1, 0, max(len(self._x) - 2, 0))
+        if len(self._x) == 1:
+            weight = np.zeros(npoints)
+            inside = x == self._x[0]
+        else:
+            weight = (x - self._x[row])/(self._x[row + 1] - self._x[row])
+            inside = (x >= self._x[0]) & (x <= self._x[-1])
+        return row, weight, inside
+
+    def _interp_rows(self, values, redshift, xgrid, ygrid):
+        """
+        interpolates values in the rows xgrid -> ygrid of the two grid
+        redshifts around each redshift, then linearly between them
+        """
+        values = np.asarray(values, dtype=np.float64)
+        shape = values.shape
+        values = values.ravel()
+        row, weight, inside = self._rows(redshift, len(values))
+        result = np.full(len(values), np.nan)
+        for r in np.unique(row[inside]):
+            sel = inside & (row == r)
+            lower = np.interp(values[sel], xgrid(r), ygrid(r), left=np.nan, right=np.nan)
+            if len(self._x) == 1:
+                result[sel] = lower
+                continue
+            w = weight[sel]
+            upper = np.interp(values[sel], xgrid(r + 1), ygrid(r + 1), left=np.nan, right=np.nan)
+            # at grid redshifts, only the row of that redshift is used
+            result[sel] = np.where(w == 0, lower, np.where(w == 1, upper, (1 - w)*lower + w*upper))
+        return result.reshape(shape)
+
+    def log_stellar_mass(self, logmhalo, redshift):
+        """log10 stellar mass (Msun) of log10 halo masses at the redshift(s)"""
+        return self._interp_rows(logmhalo, redshift, lambda r: self.logmhalo, lambda r: self.table[r])
+
+    def log_halo_mass(self, logmstar, redshift):
+        """log10 halo mass (Msun) of log10 stellar masses at the redshift(s)"""
+        return self._interp_rows(logmstar, redshift, lambda r: self.table[r], lambda r: self.logmhalo)
+
+    def stellar_mass(self, mhalo, redshift):
+        """stellar mass (Msun) of halo masses (Msun) at the redshift(s)"""
+        return 10**self.log_stellar_mass(np.log10(mhalo), redshift)
+
+    def halo_mass(self, mstar, redshift):
+        """halo mass (Msun) with the given stellar mass (Msun) at the redshift(s)"""
+        return 10**self.log_halo_mass(np.log10(mstar), redshift)
+
+    def _errors(self):
+        """
+        largest differences from the direct evaluation at the centres of
+        the grid cells, in dex of stellar mass (forward) and halo mass
+        (inverse)
+        """
+        logm = 0.5*(self.logmhalo[1:] + self.logmhalo[:-1])
+        if len(self.redshifts) > 1:
+            x = 0.5*(self._x[1:] + self._x[:-1])
+            redshifts = x/(1 - x)
+        else:
+            redshifts = self.redshifts
+        error, inverse_error = 0., 0.
+        for z in redshifts:
+            exact = np.log10(direct_stellar_mass(10**logm, z, self.params))
+            error = max(error, np.nanmax(np.abs(self.log_stellar_mass(logm, z) - exact)))
+            inverse_error = max(inverse_error, np.nanmax(np.abs(self.log_halo_mass(exact, z) - logm)))
+        return error, inverse_error
+
+
+def table_key(redshifts, logmhalo, params):
+    """hash of the parameters and grids that identifies a cached table"""
+    data = np.concatenate([np.asarray(params, dtype=np.float64),
+                           np.asarray(redshifts, dtype=np.float64),
+                           np.asarray(logmhalo, dtype=np.float64)])
+    return hashlib.sha1(data.tobytes()).hexdigest()[:16]
+
+
+def load_smhm_table(cachedir, redshifts=None, logmhalo=None, params=None):
+    """
+    SMHMTable for the parameters and grids, read from
+    cachedir/smhm_<key>.npz if it was built before, otherwise built and
+    saved there
+    """
+    redshifts = default_redshifts if redshifts is None else redshifts
+    logmhalo = default_logmhalo if logmhalo is None else logmhalo
+    params = median_parameters() if params is None else params
+
+    path = os.path.join(cachedir, f"smhm_{table_key(redshifts, logmhalo, params)}.npz")
+    if os.path.exists(path):
+        cached = np.load(path)
+        # tables cached before the errors were saved compute them again
+        errors = None
+        if 'error' in cached.files:
+            errors = (cached['error'], cached['inverse_error'])
+        return SMHMTable(cached['redshifts'], cached['logmhalo'], cached['params'],
+                         cached['table'], errors)
+
+    smhm = SMHMTable(redshifts, logmhalo, params)
+    # write to a temporary file first, so an interrupted write never
+    # leaves a partial table behind
+    tmppath = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmppath, redshifts=smhm.redshifts, logmhalo=smhm.logmhalo,
+             params=smhm.params, table=smhm.table,
+             error=smhm.error, inverse_error=smhm.inverse_error)
+    os.replace(tmppath, path)
+    return smhm
@@ -0,0 +1,448 @@
+"""
+Writes small to large synthetic simulations in the IllustrisTNG file
+layout, to exercise and benchmark TreeDB, subfind_catalog,
+TraceMergerTree and the orbit collection without the TNG100 data.
+
+The SubLink merger trees are built depth-first (every subhalo is
+followed by the subtree of its first progenitor, then of its next
+progenitors), with main branches, mergers and skipped snapshots, and
+all the ID columns the readers rely on (SubhaloID, DescendantID,
+First/NextProgenitorID, MainLeafProgenitorID, LastProgenitorID,
+RootDescendantID). The group catalogs and offsets of every snapshot
+are consistent with the trees: the subhalos of the catalog are those of
+the trees at that snapshot (plus a few that are not in the trees),
+ordered by group and decreasing mass.
+
+Usage:
+------
+From the command line:
+    python -m harvesting_tools.synthetic_tng <outdir> --trees 2000 --snapshots 100
+
+From python:
+    info = make_synthetic_tng(outdir, ntrees=2000)
+    write_snapshot_data(f"{outdir}/snapshot_data.hdf5", info["nsnaps"])
+    -- NOTE:
+        - outdir is laid out like a TNG simulation directory, i.e. it can
+            be given to paths.tng(outdir + "/"): postprocessing/ (trees and
+            offsets) and output/groups_NNN/ (group catalogs)
+        - the number of tree rows grows linearly with ntrees (about 80
+            per tree with the default settings)
+        - the same seed gives the same files
+"""
+
+__date__   = "October 2026"
+
+import os
+import argparse
+
+import numpy as np
+import h5py
+
+tree_dtypes = {'SubhaloID': np.int64, 'DescendantID': np.int64, 'FirstProgenitorID': np.int64,
+               'NextProgenitorID': np.int64, 'MainLeafProgenitorID': np.int64,
+               'LastProgenitorID': np.int64, 'RootDescendantID': np.int64,
+               'SnapNum': np.int16, 'SubfindID': np.int32, 'SubhaloGrNr': np.int32,
+               'SubhaloPos': np.float32, 'SubhaloVel': np.float32, 'SubhaloMass': np.float32,
+               'SubhaloMassType': np.float32, 'Group_M_TopHat200': np.float32,
+               'Group_R_TopHat200': np.float32}
+
+
+def make_trees(ntrees, nsnaps=100, seed=0, p_continue=0.97, p_merger=0.03, p_skip=0.02):
+    """
+    Depth-first SubLink ID structure of ntrees trees
+
+    Parameters:
+    -----------
+    ntrees: int
+        number of trees (root descendants)
+    nsnaps: int
+        number of snapshots; most trees end at the last snapshot
+    p_continue: float
+        probability that a subhalo has a first progenitor
+    p_merger: float
+        probability that a subhalo has a second progenitor (a merger)
+    p_skip: float
+        probability that a progenitor skips a snapshot
+
+    Returns:
+    --------
+    columns: dict
+        SnapNum, DescendantID and the tree number of every row (the
+        SubhaloID of each row is its row number), and the first row of
+        every tree
+    """
+    rng = np.random.default_rng(seed)
+    nominal = int(ntrees*nsnaps*1.2) + 16
+    continues = rng.random(nominal) < p_continue
+    mergers = rng.random(nominal) < p_merger
+    skips = np.where(rng.random(nominal) < p_skip, 2, 1)
+    root_snaps = np.where(rng.random(ntrees) < 0.9, nsnaps - 1,
+                          rng.integers(nsnaps//2, nsnaps, ntrees))
+
+    snapnum, descendant, tree_start = [], [], []
+    draw = 0
+    for tree in range(ntrees):
+        tree_start.append(len(snapnum))
+        # stack of (snapshot, descendant row) still to visit; the first
+        # progenitor is pushed last, so that it is visited next
+        stack = [(int(root_snaps[tree]), -1)]
+        while stack:
+            snap, desc = stack.pop()
+            row = len(snapnum)
+            snapnum.append(snap)
+            descendant.append(desc)
+            k = draw % nominal
+            draw += 1
+            if snap - skips[k] >= 0 and continues[k]:
+                if mergers[k] and snap >= 2:
+                    stack.append((snap - 1, row))
+                stack.append((snap - skips[k], row))
+    return {"SnapNum": np.array(snapnum, dtype=np.int16),
+            "DescendantID": np.array(descendant, dtype=np.int64),
+            "TreeStart": np.array(tree_start, dtype=np.int64)}
+
+
+def tree_links(descendant, tree_start):
+    """
+    Progenitor and subtree columns of depth-first trees, from the
+    descendant of every row
+
+    Returns:
+    --------
+    links: dict
+        FirstProgenitorID, NextProgenitorID, MainLeafProgenitorID,
+        LastProgenitorID, RootDescendantID (as row numbers)
+    """
+    nrows = len(descendant)
+    rows = np.arange(nrows, dtype=np.int64)
+    has_desc = descendant >= 0
+
+    # progenitors of each row, in row order: the first is the first
+    # progenitor, each is followed by the next
+    prog = rows[has_desc]
+    order = np.lexsort((prog, descendant[has_desc]))
+    prog, desc = prog[order], descendant[has_desc][order]
+    first = np.ones(len(prog), dtype=bool)
+    first[1:] = desc[1:] != desc[:-1]
+    first_progenitor = np.full(nrows, -1, dtype=np.int64)
+    first_progenitor[desc[first]] = prog[first]
+    next_progenitor = np.full(nrows, -1, dtype=np.int64)
+    same = ~first[1:]
+    next_progenitor[prog[:-1][same]] = prog[1:][same]
+
+    # the first progenitor is the next row, so a main branch is the run of
+    # rows up to the first row without progenitors
+    leaf = np.where(first_progenitor < 0, rows, nrows)
+    main_leaf = np.minimum.accumulate(leaf[::-1])[::-1]
+
+    # the subtree of a row is the rows after it, up to the largest row of
+    # the subtrees of its progenitors; descendants are always on earlier
+    # rows, so one pass from the last row up propagates the largest rows
+    tree_of_row = np.repeat(np.arange(len(tree_start)), np.diff(np.append(tree_start, nrows)))
+    last_progenitor = rows.copy()
+    depth_order = np.argsort(-rows)
+    for row in depth_order[has_desc[depth_order]]:
+        d = descendant[row]
+        if last_progenitor[row] > last_progenitor[d]:
+            last_progenitor[d] = last_progenitor[row]
+    root = tree_start[tree_of_row]
+    return {"FirstProgenitorID": first_progenitor,
+            "NextProgenitorID": next_progenitor,
+            "MainLeafProgenitorID": main_leaf,
+            "LastProgenitorID": last_progenitor,
+            "RootDescendantID": root}
+
+
+def make_synthetic_tng(outdir, ntrees=500, nsnaps=100, ntreefiles=4, ncatfiles=4, seed=0,
+                       boxsize=75000., little_h=0.6774, untracked=0.05, empty_groups=0.02):
+    """
+    Writes merger trees, offsets and group catalogs of a synthetic
+    simulation in the TNG layout
+
+    Parameters:
+    -----------
+    outdir: str
+        simulation directory to write (postprocessing/ and output/)
+    ntrees: int
+        number of merger trees
+    nsnaps: int
+        number of snapshots
+    ntreefiles, ncatfiles: int
+        number of tree_extended.N.hdf5 files and of chunks of each group
+        catalog
+    seed: int
+        random seed
+    boxsize: float
+        box size in ckpc/h
+    untracked: float
+        fraction of extra catalog subhalos that are not in the trees
+        (their SubLink RowNum is -1)
+    empty_groups: float
+        fraction of extra groups without subhalos
+
+    Returns:
+    --------
+    info: dict
+        nsnaps, number of tree rows and the number of groups and
+        subhalos of every snapshot
+    """
+    rng = np.random.default_rng(seed + 1)
+    ids = make_trees(ntrees, nsnaps, seed)
+    snapnum, descendant, tree_start = ids["SnapNum"], ids["DescendantID"], ids["TreeStart"]
+    links = tree_links(descendant, tree_start)
+    nrows = len(snapnum)
+    tree_of_row = np.repeat(np.arange(ntrees), np.diff(np.append(tree_start, nrows)))
+
+    # masses and phase space coordinates, from the root descendants down
+    # (every descendant is at a later snapshot than its progenitors)
+    mass = np.empty(nrows)
+    pos = np.empty((nrows, 3))
+    vel = rng.normal(0, 150, (nrows, 3))
+    roots = descendant < 0
+    mass[roots] = 10**rng.uniform(-0.5, 3.5, roots.sum())
+    pos[roots] = rng.uniform(0, boxsize, (roots.sum(), 3))
+    is_first = np.zeros(nrows, dtype=bool)
+    is_first[links["FirstProgenitorID"][links["FirstProgenitorID"] >= 0]] = True
+    for snap in range(nsnaps - 1, -1, -1):
+        sel = np.flatnonzero((snapnum == snap) & ~roots)
+        desc = descendant[sel]
+        shrink = np.where(is_first[sel], rng.uniform(0.75, 1.0, len(sel)), rng.uniform(0.05, 0.5, len(sel)))
+        mass[sel] = mass[desc]*shrink
+        # mergers come in from a few hundred kpc away
+        spread = np.where(is_first[sel], 30., 300.)[:, np.newaxis]
+        pos[sel] = np.mod(pos[desc] + rng.normal(0, 1, (len(sel), 3))*spread, boxsize)
+
+    # hosts: every tree belongs to one host (a few trees per host), so
+    # the subhalos of a tree and of the other trees of its host share a
+    # FoF group at every snapshot
+    host_of_tree = rng.integers(0, max(ntrees//3, 1), ntrees)
+    host_of_row = host_of_tree[tree_of_row]
+
+    subfind = np.full(nrows, -1, dtype=np.int32)
+    grnr = np.full(nrows, -1, dtype=np.int32)
+    group_m = np.zeros(nrows, dtype=np.float32)
+    group_r = np.zeros(nrows, dtype=np.float32)
+    catalogs = {}
+    for snap in range(nsnaps):
+        rows = np.flatnonzero(snapnum == snap)
+        # catalog subhalos: tree rows, plus untracked ones in random hosts
+        nextra = rng.binomial(len(rows), untracked) if len(rows) > 0 else 0
+        extra_host = (host_of_row[rows][rng.integers(0, len(rows), nextra)]
+                      if nextra > 0 else np.zeros(0, dtype=np.int64))
+        cat_row = np.concatenate([rows, np.full(nextra, -1)])
+        cat_host = np.concatenate([host_of_row[rows], extra_host])
+        cat_mass = np.concatenate([mass[rows], 10**rng.uniform(-2, -0.5, nextra)])
+        cat_pos = np.concatenate([pos[rows], rng.uniform(0, boxsize, (nextra, 3))])
+        cat_vel = np.concatenate([vel[rows], rng.normal(0, 150, (nextra, 3))])
+
+        # groups by decreasing total mass, subhalos by group and mass
+        hosts, host_index = np.unique(cat_host, return_inverse=True)
+        host_mass = np.bincount(host_index, weights=cat_mass, minlength=len(hosts))
+        group_of_host = np.empty(len(hosts), dtype=np.int64)
+        group_of_host[np.argsort(-host_mass, kind='stable')] = np.arange(len(hosts))
+        cat_group = group_of_host[host_index]
+        order = np.lexsort((-cat_mass, cat_group))
+        cat_row, cat_group = cat_row[order], cat_group[order]
+        cat_mass, cat_pos, cat_vel = cat_mass[order], cat_pos[order], cat_vel[order]
+        nsubs_tracked = len(cat_row)
+
+        ngroups = len(hosts) + int(round(empty_groups*len(hosts)))
+        nsubs = np.bincount(cat_group, minlength=ngroups).astype(np.int32)
+        first_sub = np.where(nsubs > 0, np.cumsum(nsubs) - nsubs, -1).astype(np.int32)
+        m200 = np.zeros(ngroups)
+        m200[:len(hosts)] = np.sort(host_mass)[::-1]*1.1
+        m200[len(hosts):] = 10**rng.uniform(-2, -1, ngroups - len(hosts))
+        r200 = 163.*(np.maximum(m200, 1e-3)/little_h/100)**(1/3)*little_h
+        group_pos = np.zeros((ngroups, 3))
+        group_pos[:len(hosts)] = cat_pos[first_sub[:len(hosts)]]
+        group_pos[len(hosts):] = rng.uniform(0, boxsize, (ngroups - len(hosts), 3))
+
+        tracked = cat_row >= 0
+        subfind[cat_row[tracked]] = np.flatnonzero(tracked)
+        grnr[cat_row[tracked]] = cat_group[tracked]
+        group_m[cat_row[tracked]] = m200[cat_group[tracked]]
+        group_r[cat_row[tracked]] = r200[cat_group[tracked]]
+
+        # particle numbers: subhalos, and groups with some fuzz on top
+        sub_len = np.zeros((nsubs_tracked, 6), dtype=np.int32)
+        sub_len[:, 1] = np.maximum(cat_mass*200, 20).astype(np.int32)
+        sub_len[:, 0] = sub_len[:, 1]//8
+        sub_len[:, 4] = sub_len[:, 1]//20
+        group_len = np.zeros((ngroups, 6), dtype=np.int64)
+        np.add.at(group_len, cat_group, sub_len)
+        group_len[:, 1] += rng.integers(0, 50, ngroups)
+        masstype = sub_len*np.array([1.2e-4, 5.9e-4, 0, 0, 1.2e-4, 0])[np.newaxis, :]*100
+        # black holes, star formation and metallicity scale with the gas
+        # and stellar mass (no random draws, so the other fields do not change)
+        bh_mass = masstype[:, 4]*1e-3
+        sfr = masstype[:, 0]*2.
+        metallicity = 0.01 + 0.005*np.log10(1 + cat_mass)
+
+        catalogs[snap] = {
+            "Group": {"GroupNsubs": nsubs, "GroupFirstSub": first_sub,
+                      "GroupLenType": group_len.astype(np.int32),
+                      "GroupLen": group_len.sum(axis=1).astype(np.int32),
+                      "GroupPos": group_pos.astype(np.float32),
+                      "GroupMass": m200.astype(np.float32),
+                      "Group_M_TopHat200": m200.astype(np.float32),
+                      "Group_R_TopHat200": r200.astype(np.float32)},
+            "Subhalo": {"SubhaloGrNr": cat_group.astype(np.int32),
+                        "SubhaloLenType": sub_len,
+                        "SubhaloLen": sub_len.sum(axis=1).astype(np.int32),
+                        "SubhaloPos": cat_pos.astype(np.float32),
+                        "SubhaloVel": cat_vel.astype(np.float32),
+                        "SubhaloMass": cat_mass.astype(np.float32),
+                        "SubhaloMassType": masstype.astype(np.float32),
+                        "SubhaloBHMass": bh_mass.astype(np.float32),
+                        "SubhaloBHMdot": (bh_mass*1e-3).astype(np.float32),
+                        "SubhaloSFR": sfr.astype(np.float32),
+                        "SubhaloSFRinRad": (sfr*0.6).astype(np.float32),
+                        "SubhaloGasMetallicity": metallicity.astype(np.float32),
+                        "SubhaloParent": np.zeros(nsubs_tracked, dtype=np.int32)},
+            "RowNum": cat_row}
+
+    columns = {"SubhaloID": np.arange(nrows, dtype=np.int64),
+               "DescendantID": descendant,
+               "SnapNum": snapnum,
+               "SubfindID": subfind,
+               "SubhaloGrNr": grnr,
+               "SubhaloPos": pos,
+               "SubhaloVel": vel,
+               "SubhaloMass": mass,
+               "Group_M_TopHat200": group_m,
+               "Group_R_TopHat200": group_r}
+    for key in ["FirstProgenitorID", "NextProgenitorID", "MainLeafProgenitorID",
+                "LastProgenitorID", "RootDescendantID"]:
+        columns[key] = links[key]
+    columns["SubhaloMassType"] = np.zeros((nrows, 6))
+    has_sub = subfind >= 0
+    for snap in range(nsnaps):
+        sel = np.flatnonzero(has_sub & (snapnum == snap))
+        columns["SubhaloMassType"][sel] = catalogs[snap]["Subhalo"]["SubhaloMassType"][subfind[sel]]
+
+    _write_trees(outdir, columns, tree_start, ntreefiles)
+    _write_offsets(outdir, columns, catalogs, tree_start, ntreefiles)
+    for snap, catalog in catalogs.items():
+        _write_catalog(outdir, snap, catalog, ncatfiles, nsnaps, boxsize, little_h)
+
+    return {"nsnaps": nsnaps, "nrows": nrows,
+            "ngroups": np.array([len(catalogs[snap]["Group"]["GroupNsubs"]) for snap in range(nsnaps)]),
+            "nsubs": np.array([len(catalogs[snap]["Subhalo"]["SubhaloMass"]) for snap in range(nsnaps)])}
+
+
+def _file_starts(tree_start, nrows, nfiles):
+    """first row of each tree file (whole trees per file)"""
+    cuts = np.linspace(0, len(tree_start), nfiles + 1).astype(np.int64)[:-1]
+    return np.array([tree_start[c] if c < len(tree_start) else nrows for c in cuts], dtype=np.int64)
+
+
+def _write_trees(outdir, columns, tree_start, nfiles):
+    treedir = f"{outdir}/postprocessing"
+    os.makedirs(treedir, exist_ok=True)
+    nrows = len(columns["SnapNum"])
+    starts = _file_starts(tree_start, nrows, nfiles)
+    ends = np.append(starts[1:], nrows)
+    for fnum, (lo, hi) in enumerate(zip(starts, ends)):
+        f = h5py.File(f"{treedir}/tree_extended.{fnum}.hdf5", 'w')
+        for key, val in columns.items():
+            f.create_dataset(key, data=np.asarray(val[lo:hi], dtype=tree_dtypes[key]))
+        f.close()
+
+
+def _write_offsets(outdir, columns, catalogs, tree_start, nfiles):
+    offsetdir = f"{outdir}/postprocessing/offsets"
+    os.makedirs(offsetdir, exist_ok=True)
+    starts = _file_starts(tree_start, len(columns["SnapNum"]), nfiles)
+    for snap, catalog in catalogs.items():
+        rownum = catalog["RowNum"].astype(np.int64)
+        tracked = rownum >= 0
+        subhalo_id = np.where(tracked, columns["SubhaloID"][np.maximum(rownum, 0)], -1)
+        last_progenitor = np.where(tracked, columns["LastProgenitorID"][np.maximum(rownum, 0)], -1)
+        f = h5py.File(f"{offsetdir}/offsets_{snap:03d}.hdf5", 'w')
+        f.create_dataset("FileOffsets/SubLink", data=starts)
+        f.create_dataset("Subhalo/SubLink/RowNum", data=rownum)
+        f.create_dataset("Subhalo/SubLink/SubhaloID", data=subhalo_id)
+        f.create_dataset("Subhalo/SubLink/LastProgenitorID", data=last_progenitor)
+        f.close()
+
+
+def _write_catalog(outdir, snap, catalog, nfiles, nsnaps, boxsize, little_h):
+    catdir = f"{outdir}/output/groups_{snap:03d}"
+    os.makedirs(catdir, exist_ok=True)
+    groups, subhalos = catalog["Group"], catalog["Subhalo"]
+    ngroups, nsubs = len(groups["GroupNsubs"]), len(subhalos["SubhaloMass"])
+    # groups split evenly over the chunks, subhalos with their group
+    group_cuts = np.linspace(0, ngroups, nfiles + 1).astype(np.int64)
+    sub_cuts = np.searchsorted(subhalos["SubhaloGrNr"], group_cuts, side='left')
+    redshift = snapshot_redshifts(nsnaps)[snap]
+    for fnum in range(nfiles):
+        f = h5py.File(f"{catdir}/fof_subhalo_tab_{snap:03d}.{fnum}.hdf5", 'w')
+        header = f.create_group("Header")
+        glo, ghi = group_cuts[fnum], group_cuts[fnum + 1]
+        slo, shi = sub_cuts[fnum], sub_cuts[fnum + 1]
+        for attr, val in [("Ngroups_ThisFile", ghi - glo), ("Nsubgroups_ThisFile", shi - slo),
+                          ("Ngroups_Total", ngroups), ("Nsubgroups_Total", nsubs),
+                          ("Nids_ThisFile", 0), ("Nids_Total", 0), ("NumFiles", nfiles),
+                          ("Redshift", redshift), ("Time", 1/(1 + redshift)),
+                          ("BoxSize", boxsize), ("HubbleParam", little_h)]:
+            header.attrs[attr] = val
+        gdata, sdata = f.create_group("Group"), f.create_group("Subhalo")
+        if ghi > glo:
+            for key, val in groups.items():
+                gdata.create_dataset(key, data=val[glo:ghi])
+        if shi > slo:
+            for key, val in subhalos.items():
+                sdata.create_dataset(key, data=val[slo:shi])
+        f.close()
+
+
+def snapshot_redshifts(nsnaps):
+    """redshifts of nsnaps snapshots, evenly spaced in log(scale) from z=20 to z=0"""
+    scale = np.exp(np.linspace(np.log(1/21), 0, nsnaps))
+    redshift = 1/scale - 1
+    redshift[-1] = 0.
+    return redshift
+
+
+def write_snapshot_data(path, nsnaps, little_h=0.6774, omega0=0.3089):
+    """
+    misc/snapshot_data.hdf5 of the synthetic snapshots, with the layout of
+    the file made in collection-orbits.ipynb (flat LCDM ages)
+    """
+    redshift = snapshot_redshifts(nsnaps)
+    scale = 1/(1 + redshift)
+    # age in Gyr: integral of da / (a H(a))
+    grid = np.linspace(1e-6, 1, 200001)
+    hubble_time = 977.8/(100*little_h)
+    integrand = 1/(grid*np.sqrt(omega0/grid**3 + 1 - omega0))
+    age_grid = np.concatenate([[0], np.cumsum(0.5*(integrand[1:] + integrand[:-1])*np.diff(grid))])*hubble_time
+    age = np.interp(scale, grid, age_grid)
+    data = {"Snapshot": np.arange(nsnaps), "Redshift": redshift, "Scale": scale,
+            "Lookback Time": age[-1] - age, "Age": age}
+    info_dict = {"Snapshot":"Snapshot number",
+                 "Redshift":"Redshift at snapshot",
+                 "Scale":"Scale at snapshot",
+                 "Lookback Time":"Time that has elapsed from snapshot to z=0 (in Gyr)",
+                 "Age":"Age of the Universe (in Gyr)"}
+    f = h5py.File(path, 'w')
+    for key, val in data.items():
+        dset = f.create_dataset(f'/{key}', data=val)
+        dset.attrs[key] = info_dict[key]
+    f.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic simulation in the TNG file layout")
+    parser.add_argument("outdir", help="simulation directory to create")
+    parser.add_argument("--trees", type=int, default=500, help="number of merger trees")
+    parser.add_argument("--snapshots", type=int, default=100)
+    parser.add_argument("--treefiles", type=int, default=4)
+    parser.add_argument("--catfiles", type=int, default=4, help="chunks per group catalog")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    info = make_synthetic_tng(args.outdir, args.trees, args.snapshots, args.treefiles,
+                              args.catfiles, args.seed)
+    write_snapshot_data(f"{args.outdir}/snapshot_data.hdf5", args.snapshots)
+    print(f"{info['nrows']} tree rows, {info['nsubs'][-1]} subhalos and "
+          f"{info['ngroups'][-1]} groups at the last snapshot")
@@ -0,0 +1,157 @@
+"""
+Builds the unique-orbits/*.hdf5 files: the orbits of every pair that
+appears in the orbit files of any snapshot, each pair once.
+
+The orbit files of all snapshots are concatenated, the pair keys are
+deduplicated with np.unique (keeping the first occurrence, i.e. the
+earliest snapshot), and every column is gathered with one fancy index,
+instead of checking each key against a growing list.
+
+Usage:
+------
+    build_unique_orbits(paths, "high", "major")
+
+or, from an orbit store (orbit_store.OrbitStore):
+    with OrbitStore(storepath) as store:
+        unique = unique_orbits(store["highmass_major"].load())
+
+    -- NOTE:
+        - pairs are compared by PairID (the integer SubhaloIDs of the
+            earliest progenitors) when the orbit files have it, otherwise
+            by the PairKey strings
+        - Snapshot of the output is the snapshot at which each pair was
+            first found; the order of the pairs is the order in which they
+            are first found, as in _dev/unique-orbits.ipynb
+"""
+
+__date__   = "October 2026"
+
+import os
+
+import numpy as np
+import h5py
+
+from harvesting_tools.orbits import info_dict, pair_key_view
+
+# datasets of the orbit files that are not per pair
+snapshot_keys = ["Redshift", "Scale", "Snapshot"]
+
+
+def concatenate_orbits(orbits):
+    """
+    Concatenates orbit collections of several snapshots along the pairs
+
+    Parameters:
+    -----------
+    orbits: list of tuples
+        (snapshot, collection) with collection read from an orbit file
+
+    Returns:
+    --------
+    collection: dict
+        per-pair datasets of all snapshots, with CatalogSnapshot the
+        snapshot of each pair
+    """
+    collection = {"CatalogSnapshot": np.concatenate(
+        [np.full(len(orbit["PairKey"]), snapshot, dtype=np.int64) for snapshot, orbit in orbits])}
+    for key in orbits[0][1].keys():
+        if key in snapshot_keys:
+            continue
+        if key == "PairKey":
+            collection[key] = np.concatenate([np.asarray(orbit[key], dtype=bytes) for snapshot, orbit in orbits])
+        else:
+            collection[key] = np.concatenate([np.asarray(orbit[key]) for snapshot, orbit in orbits])
+    return collection
+
+
+def first_occurrences(collection):
+    """
+    Row of the first occurrence of every distinct pair, in the order in
+    which the pairs first occur
+    """
+    if "PairID" in collection:
+        keys = pair_key_view(collection["PairID"])
+    else:
+        keys = np.asarray(collection["PairKey"], dtype=bytes)
+    unique, first = np.unique(keys, return_index=True)
+    return np.sort(first)
+
+
+def unique_orbits(collection):
+    """
+    The orbit of every distinct pair of a concatenated collection (from
+    concatenate_orbits or OrbitSample.load), each pair once
+
+    Returns:
+    --------
+    unique: dict
+        per-pair datasets of the distinct pairs, with Snapshot the
+        snapshot at which each pair is first found
+    """
+    rows = first_occurrences(collection)
+    unique = {}
+    for key, val in collection.items():
+        if key in ["Redshift", "Scale", "Snapshot"]:
+            continue
+        if key == "CatalogSnapshot":
+            unique["Snapshot"] = np.asarray(val, dtype=np.int64)[rows]
+        elif key == "PairKey":
+            unique[key] = np.asarray(val, dtype=bytes)[rows]
+        else:
+            unique[key] = np.asarray(val)[rows]
+    return unique
+
+
+def read_orbits(paths, masstype, pairtype, snapshots=range(100)):
+    """(snapshot, collection) of the orbit files of a sample that exist"""
+    orbits = []
+    for snapshot in snapshots:
+        path = f"{paths.path_orbits}{masstype}mass_{pairtype}_{snapshot}.hdf5"
+        if not os.path.exists(path):
+            continue
+        f = h5py.File(path, 'r')
+        orbits.append((snapshot, {key: np.array(val) for key, val in f.items()}))
+        f.close()
+    return orbits
+
+
+def write_unique_orbits(path, unique, header_dict):
+    """
+    Saves unique orbits in the format of the unique-orbits/*.hdf5 files
+    """
+    f = h5py.File(path, 'w')
+    dset = f.create_group('/Header')
+    for key in header_dict.keys():
+        dset.attrs[key] = header_dict[key]
+
+    for key, val in unique.items():
+        val = np.array(val)
+        dset = f.create_dataset(f'/{key}',
+                                shape=val.shape,
+                                dtype=val.dtype)
+        dset.attrs[key] = info_dict[key]
+        dset[:] = val
+    f.close()
+
+
+def build_unique_orbits(paths, masstype, pairtype, snapshots=range(100), simulation="TNG100-1"):
+    """
+    Writes orbits/unique-orbits/<mass>mass-<ratio>.hdf5 from the orbit
+    files of the given snapshots (missing files are skipped)
+
+    Returns:
+    --------
+    path: str
+        file written
+    """
+    orbits = read_orbits(paths, masstype, pairtype, snapshots)
+    if len(orbits) == 0:
+        raise FileNotFoundError(f"No {masstype}mass_{pairtype} orbit files in {paths.path_orbits}")
+    unique = unique_orbits(concatenate_orbits(orbits))
+
+    os.makedirs(f"{paths.path_orbits}unique-orbits", exist_ok=True)
+    path = f"{paths.path_orbits}unique-orbits/{masstype}mass-{pairtype}.hdf5"
+    header_dict = {"Details":f"Full UNIQUE sample of {masstype} mass {pairtype} pair orbits",
+                   "Simulation":simulation}
+    write_unique_orbits(path, unique, header_dict)
+    return path